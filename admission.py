@@ -0,0 +1,120 @@
+"""Admission control of the Flask endpoints, per lane of endpoints (file analyses, run submissions, event streams).
+
+A lane admits at most "limit" requests at a time over all the uwsgi workers, and lets at most "queue" more wait for a
+slot, up to "max_wait" seconds. Anything beyond is rejected at once with a retry hint, so the waiting requests never
+hold more worker threads than the operator allowed and the cheap lookups always find a free one. The async jobs of a
+lane hold one of its "jobs" tickets from their submission to their end, and share its slots when they run.
+
+The slots and the wait tickets are files of <ADMISSION_DIR>/<lane>, held with a non-blocking flock: the limits span
+the processes and the threads, and the kernel frees the slots of a worker that dies.
+"""
+import fcntl
+import json
+import os.path
+import tempfile
+import time
+
+import metrics
+
+DEFAULT_LANES = {"analysis": {"limit": 3, "queue": 1, "max_wait": 10, "jobs": 8},
+                 "run": {"limit": 1, "queue": 0, "max_wait": 0, "jobs": 2},
+                 "stream": {"limit": 2, "queue": 0, "max_wait": 0, "jobs": 0, "max_duration": 120}}
+POLL_INTERVAL = 0.05  # seconds between two attempts of a queued request
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, lane, message, retry_after):
+        super().__init__(message)
+        self.LANE = lane
+        self.RETRY_AFTER = retry_after
+
+
+def load_lanes():
+    file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+    with open(file_path) as f:
+        config = json.load(f)
+        f.close()
+    admission_dir = config.get("ADMISSION_DIR", os.path.join(tempfile.gettempdir(), "cama_admission"))
+    lanes = dict(DEFAULT_LANES)
+    lanes.update(config.get("ADMISSION_LANES", {}))
+    for name in lanes:
+        if not os.path.exists(os.path.join(admission_dir, name)):
+            os.makedirs(os.path.join(admission_dir, name))
+    return admission_dir, lanes
+
+
+ADMISSION_DIR, LANES = load_lanes()
+
+
+def try_lock(lane, kind, count):
+    # the first free one of the count lock files, as an open descriptor holding its flock, or None
+    for k in range(count):
+        fd = os.open(os.path.join(ADMISSION_DIR, lane, kind + "_" + str(k)), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fd
+        except OSError:
+            os.close(fd)
+    return None
+
+
+def unlock(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+def admit(lane):
+    """Waits for a slot of the lane and returns it, to be given back with release; raises AdmissionRejected when the
+    queue of the lane is full or the wait exceeds max_wait
+    """
+    settings = LANES[lane]
+    retry_after = int(settings.get("retry_after", max(settings["max_wait"], 1)))
+    start = time.time()
+    slot = try_lock(lane, "slot", int(settings["limit"]))
+    if slot is not None:
+        metrics.observe("cama_admission_wait_seconds", 0, {"lane": lane})
+        return slot
+    ticket = try_lock(lane, "wait", int(settings["queue"]))
+    if ticket is None:
+        metrics.inc("cama_admission_rejected_total", 1, {"lane": lane, "reason": "queue_full"})
+        raise AdmissionRejected(lane, "Too many " + lane + " requests, retry later", retry_after)
+    try:
+        while time.time() - start < settings["max_wait"]:
+            time.sleep(POLL_INTERVAL)
+            slot = try_lock(lane, "slot", int(settings["limit"]))
+            if slot is not None:
+                metrics.observe("cama_admission_wait_seconds", time.time() - start, {"lane": lane})
+                return slot
+    finally:
+        unlock(ticket)
+    metrics.inc("cama_admission_rejected_total", 1, {"lane": lane, "reason": "timeout"})
+    raise AdmissionRejected(lane, "No " + lane + " slot freed up within " + str(settings["max_wait"]) + "s, retry later",
+                            retry_after)
+
+
+def release(slot):
+    unlock(slot)
+
+
+def admit_job(lane):
+    """Takes a ticket for an async job of the lane, to be released when the job ends; raises AdmissionRejected when
+    the lane already has "jobs" queued or running jobs
+    """
+    settings = LANES[lane]
+    ticket = try_lock(lane, "job", int(settings.get("jobs", 0)))
+    if ticket is None:
+        metrics.inc("cama_admission_rejected_total", 1, {"lane": lane, "reason": "jobs_full"})
+        raise AdmissionRejected(lane, "Too many queued " + lane + " jobs, retry later",
+                                int(settings.get("retry_after", max(settings["max_wait"], 1))))
+    return ticket
+
+
+def wait_for_slot(lane):
+    """Waits for a slot of the lane as long as it takes; for the job pool threads, which hold no request thread"""
+    start = time.time()
+    while True:
+        slot = try_lock(lane, "slot", int(LANES[lane]["limit"]))
+        if slot is not None:
+            metrics.observe("cama_admission_wait_seconds", time.time() - start, {"lane": lane})
+            return slot
+        time.sleep(POLL_INTERVAL)
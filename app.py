@@ -1,24 +1,70 @@
-from flask import Flask, request, abort
-import geojson
+from flask import Flask, request, abort, Response, stream_with_context
+from werkzeug.exceptions import HTTPException, InternalServerError
 import json
-from shapely.geometry import MultiPolygon, Polygon
-from cama_convert import CamaConvert
-from db_connect import DbConnect
+import time
+import geojson_stream
+import admission
+from cama_convert import CamaConvert, preload_static
+import bson
+from db_connect import DbConnect, ensure_indexes
+from job_queue import JobQueue
+import metrics
+from profiler import RequestProfiler, PROFILE_HEADER
 from flask import g
 from flask_cors import CORS
 
 app = Flask(__name__)
 CORS(app)
+metrics.register_mongo_listener()
+# uwsgi imports the app in the master before forking the workers (unless --lazy-apps), so the static grids read here
+# are inherited by every worker instead of being read again by each of them; no storage or Mongo client is opened here
+try:
+    for table, error in preload_static().items():
+        print("Unable to preload " + table + ": " + error)
+except Exception as e:
+    print("Unable to preload the static grids: " + str(e))
+
+
+# set once this process attempted to ensure the indexes, and to recover the jobs its previous instance left unfinished;
+# done on the first connection of every uwsgi worker rather than in the master, so that no Mongo client is opened before
+# the fork. Each step is attempted once per worker: a failure is logged and not retried on every request
+INDEXES_ENSURED = False
+ORPHANS_RECOVERED = False
+# page size limit of /output_folders
+MAX_PAGE_SIZE = 1000
+# admission lane of the endpoints (see admission.py); the lookups that aren't listed are admitted at once
+ENDPOINT_LANES = {"to_geojson": "analysis", "to_arcgis": "analysis", "wetland_flow": "analysis",
+                  "river_profile": "analysis", "impact_summary": "analysis", "reservoir_flow": "analysis",
+                  "comparative_flow": "analysis", "peak_flow": "analysis", "build_climatology": "analysis",
+                  "climatology": "analysis", "compare_flow": "analysis", "sweep_status": "analysis",
+                  "came_run_pre": "run", "came_run_post": "run", "came_run_extend": "run", "cama_sweep": "run",
+                  "remove_output_folder": "run",
+                  "job_stream": "stream"}
+# endpoints queued in the job pool unless the client sends "async": false, since they read a whole run
+ASYNC_ENDPOINTS = ["build_climatology"]
 
 
 def get_db():
     """Opens a new database connection if there is none yet for the
     current application context.
     """
+    global INDEXES_ENSURED, ORPHANS_RECOVERED
     if not hasattr(g, 'mongodb'):
         db = DbConnect()
         db.connect_db()
         g.mongodb = db
+        if not INDEXES_ENSURED:
+            INDEXES_ENSURED = True
+            try:
+                ensure_indexes(db.get_connection())
+            except Exception as e:
+                print("Unable to create the indexes: " + str(e))
+        if not ORPHANS_RECOVERED:
+            ORPHANS_RECOVERED = True
+            try:
+                JobQueue(db.get_connection()).recover_orphans()
+            except Exception as e:
+                print("Unable to recover the unfinished jobs: " + str(e))
     return g.mongodb.get_connection()
 
 
@@ -29,6 +75,80 @@ def close_db(error):
         db.disconnect_db()
 
 
+def rejection(error):
+    body = json.dumps({"message": str(error), "lane": error.LANE, "retry_after": error.RETRY_AFTER})
+    return Response(body, status=503, headers={"Retry-After": str(error.RETRY_AFTER)}, mimetype="application/json")
+
+
+def is_async(request_data):
+    return request_data.get("async", request.endpoint in ASYNC_ENDPOINTS) in [True, "true", "True", 1]
+
+
+def run_request(cama, request_data):
+    """Runs the request inline, profiled when the profiling header carries the secret, or queues it in the job pool
+    when the client asked for "async" (the default of ASYNC_ENDPOINTS)
+    """
+    if is_async(request_data):
+        try:
+            job_id = JobQueue(get_db()).submit(request_data, ENDPOINT_LANES.get(request.endpoint), g.pop('job_ticket', None))
+        except admission.AdmissionRejected as e:
+            return rejection(e)
+        return json.dumps({"job_id": job_id, "status": "queued"}), 202
+    profiler = RequestProfiler()
+    if profiler.is_enabled(request.headers.get(PROFILE_HEADER)):
+        return profiler.profile(lambda: cama.do_request(request_data), request.endpoint, request_data)
+    return cama.do_request(request_data)
+
+
+@app.before_request
+def start_timer():
+    g.request_start = time.time()
+
+
+@app.before_request
+def admit_request():
+    lane = ENDPOINT_LANES.get(request.endpoint)
+    if lane is None:
+        return None
+    request_data = request.get_json(silent=True)
+    try:
+        if isinstance(request_data, dict) and is_async(request_data):
+            # the job keeps the ticket until it ends, and takes a slot of the lane to run
+            g.job_ticket = admission.admit_job(lane)
+        else:
+            g.admission_slot = admission.admit(lane)
+    except admission.AdmissionRejected as e:
+        return rejection(e)
+
+
+@app.teardown_request
+def release_admission(error):
+    # after the end of the body for the streamed responses, which keep the request context until then
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        admission.release(slot)
+    # not handed over to a job, the request failed before the submission
+    ticket = g.pop('job_ticket', None)
+    if ticket is not None:
+        admission.release(ticket)
+
+
+@app.errorhandler(InternalServerError)
+def unwrap_abort(error):
+    # the routes turn every exception into abort(500, e), their own abort(400)/abort(404) included; those keep their status
+    if isinstance(error.description, HTTPException):
+        return error.description.get_response()
+    return error
+
+
+@app.after_request
+def record_latency(response):
+    if hasattr(g, 'request_start'):
+        metrics.observe("cama_http_request_seconds", time.time() - g.request_start,
+                        {"endpoint": request.endpoint or "unknown", "status": response.status_code})
+    return response
+
+
 @app.route('/')
 def index():
     response = {
@@ -42,13 +162,10 @@ def index():
 def to_geojson():
     try:
         request_data = request.get_json()
-        input = request_data.operationalLayers[3].featureCollection.layers[0].featureSet.features
-        coord_set = [x["geometry"] for x in input]
-        polygon_list = [Polygon(cc) for cc in coord_set]
-        multipolygon = MultiPolygon(polygon_list)
-        response = geojson.Feature(geometry=geojson.MultiPolygon(coord_set))
-        response["bbox"] = multipolygon.bounds
-        return json.dumps(response)
+        coord_set = geojson_stream.arcgis_features(request_data)
+        # the bbox pass also validates every coordinate, so a bad upload is refused before the response starts
+        bbox = geojson_stream.bounds(coord_set)
+        return Response(stream_with_context(geojson_stream.stream_feature(coord_set, bbox)), mimetype="application/json")
     except Exception as e:
         abort(400, e)
 
@@ -57,8 +174,8 @@ def to_geojson():
 def to_arcgis():
     try:
         request_data = request.get_json()
-        response = geojson.Feature(geometry=geojson.MultiPolygon(request_data))
-        return json.dumps(response)
+        geojson_stream.positions(request_data)
+        return Response(stream_with_context(geojson_stream.stream_feature(request_data)), mimetype="application/json")
     except Exception as e:
         abort(400, e)
 
@@ -81,7 +198,55 @@ def wetland_flow():
                 abort(400, "Expected number, received: " + this_key + "=" + request_data[this_key])
 
         request_data["request"] = "plot_hydrograph_from_wetlands"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/river_profile", methods=["POST"])
+def river_profile():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["pre_path", "post_path", "year", "lat", "lon"]
+        numeric_keys = ["lat", "lon", "year"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        for this_key in numeric_keys:
+            if not cama.is_number(request_data[this_key]):
+                abort(400, "Expected number, received: " + this_key + "=" + str(request_data[this_key]))
+
+        request_data["request"] = "river_profile"
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/impact_summary", methods=["POST"])
+def impact_summary():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["pre_folder", "post_folder", "start_year", "end_year", "lat", "lon"]
+        numeric_keys = ["lat", "lon", "start_year", "end_year"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        for this_key in numeric_keys:
+            if not cama.is_number(request_data[this_key]):
+                abort(400, "Expected number, received: " + this_key + "=" + str(request_data[this_key]))
+
+        request_data["request"] = "impact_summary"
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -105,7 +270,7 @@ def reservoir_flow():
                 abort(400, "Expected number, received: " + this_key + "=" + request_data[this_key])
 
         request_data["request"] = "plot_hydrograph_nearest_reservoir"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -129,7 +294,7 @@ def comparative_flow():
                 abort(400, "Expected number, received: " + this_key + "=" + request_data[this_key])
 
         request_data["request"] = "plot_hydrograph_deltas"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -148,7 +313,7 @@ def vegetation_lookup():
                 abort(400, "Missing required input key: " + this_key)
 
         request_data["request"] = "veg_lookup"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -167,7 +332,7 @@ def cama_status():
                 abort(400, "Missing required input key: " + this_key)
 
         request_data["request"] = "cama_status"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -186,7 +351,7 @@ def came_run_pre():
                 abort(400, "Missing required input key: " + this_key)
 
         request_data["request"] = "cama_run_pre"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -200,6 +365,20 @@ def came_run_post():
         request_data = request.get_json()
         mandatory_keys = ["lat", "lon", "riv_base", "riv_new", "fld_base", "fld_new", "size_wetland", "start_year", "end_year", "folder_name"]
         numeric_keys = ["lat", "lon", "riv_base", "riv_new", "fld_base",  "fld_new", "size_wetland"]
+        if "sites" in request_data:
+            # several wetlands, each with its own lat, lon, riv_new, fld_new and size_wetland
+            mandatory_keys = ["riv_base", "fld_base", "start_year", "end_year", "folder_name"]
+            numeric_keys = ["riv_base", "fld_base"]
+            # a one-site list isn't the same run as the single-wetland keys: its cell gets size_wetland + 1 lowered
+            # floodplain layers, the single-wetland request keeps the historic fldhgt.bin (see update_manning)
+            if not isinstance(request_data["sites"], list) or len(request_data["sites"]) == 0:
+                abort(400, "sites must be a non-empty list")
+            for site in request_data["sites"]:
+                if not isinstance(site, dict):
+                    abort(400, "Every site must be an object, received: " + json.dumps(site))
+                for this_key in ["lat", "lon", "riv_new", "fld_new", "size_wetland"]:
+                    if this_key not in site or not cama.is_number(site[this_key]):
+                        abort(400, "Every site needs a numeric " + this_key)
         given_keys = request_data.keys()
         for this_key in mandatory_keys:
             if this_key not in given_keys:
@@ -207,10 +386,75 @@ def came_run_post():
 
         for this_key in numeric_keys:
             if not cama.is_number(request_data[this_key]):
-                abort(400, "Expected number, received: " + this_key + "=" + request[this_key])
+                abort(400, "Expected number, received: " + this_key + "=" + str(request_data[this_key]))
 
         request_data["request"] = "cama_run_post"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/cama_run/extend", methods=["POST"])
+def came_run_extend():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["folder_name", "end_year"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        request_data["request"] = "cama_extend"
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/cama_sweep", methods=["POST"])
+def cama_sweep():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["lat", "lon", "riv_base", "fld_base", "start_year", "end_year", "grid"]
+        numeric_keys = ["lat", "lon", "riv_base", "fld_base"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        for this_key in numeric_keys:
+            if not cama.is_number(request_data[this_key]):
+                abort(400, "Expected number, received: " + this_key + "=" + str(request_data[this_key]))
+
+        if not isinstance(request_data["grid"], dict):
+            abort(400, "Expected object, received: grid=" + str(request_data["grid"]))
+
+        request_data["request"] = "cama_sweep"
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/sweep_status", methods=["POST"])
+def sweep_status():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["sweep_id"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        request_data["request"] = "sweep_status"
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -234,7 +478,7 @@ def coord_to_grid():
                 abort(400, "Expected number, received: " + this_key + "=" + request_data[this_key])
 
         request_data["request"] = "coord_to_grid"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -258,7 +502,50 @@ def peak_flow():
                 abort(400, "Expected number, received: " + this_key + "=" + request_data[this_key])
 
         request_data["request"] = "peak_flow"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/climatology/build", methods=["POST"])
+def build_climatology():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["folder_name"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        request_data["request"] = "build_climatology"
+        response = run_request(cama, request_data)
+        return response
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/climatology", methods=["POST"])
+def climatology():
+    try:
+        mongo_client = get_db()
+        cama = CamaConvert(mongo_client)
+        request_data = request.get_json()
+        mandatory_keys = ["folder_name", "lat", "lon"]
+        numeric_keys = ["lat", "lon"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        for this_key in numeric_keys:
+            if not cama.is_number(request_data[this_key]):
+                abort(400, "Expected number, received: " + this_key + "=" + str(request_data[this_key]))
+
+        request_data["request"] = "climatology"
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -277,7 +564,7 @@ def remove_output_folder():
                 abort(400, "Missing required input key: " + this_key)
 
         request_data["request"] = "remove_output_folder"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
@@ -289,8 +576,30 @@ def get_output_folders():
         mongo_client = get_db()
         database = mongo_client["output"]
         folder_collection = database["folder"]
-        response = list(folder_collection.find({}, {"_id": 0}))
-        return json.dumps(response)
+        # optional filters, e.g. ?status=completed&model=postflow
+        query = {key: request.args[key] for key in ["status", "model"] if key in request.args}
+        # ?fields=folder_name,status returns only these fields
+        fields = [field for field in request.args.get("fields", "").split(",") if field]
+        if "limit" not in request.args:
+            projection = dict({field: 1 for field in fields}, _id=0)
+            return json.dumps(list(folder_collection.find(query, projection)), default=str)
+
+        # paginated by _id: ?limit=100 returns the first page and the X-Next-Cursor header, ?after=<cursor> the next one
+        if not request.args["limit"].isdigit() or not 0 < int(request.args["limit"]) <= MAX_PAGE_SIZE:
+            abort(400, "limit must be between 1 and " + str(MAX_PAGE_SIZE))
+        if "after" in request.args:
+            if not bson.ObjectId.is_valid(request.args["after"]):
+                abort(400, "Invalid cursor: " + request.args["after"])
+            query["_id"] = {"$gt": bson.ObjectId(request.args["after"])}
+        limit = int(request.args["limit"])
+        # _id is kept for the cursor and removed from the page
+        folders = list(folder_collection.find(query, {field: 1 for field in fields} or None).sort("_id", 1).limit(limit))
+        headers = {}
+        if len(folders) == limit:
+            headers["X-Next-Cursor"] = str(folders[-1]["_id"])
+        for folder in folders:
+            del folder["_id"]
+        return Response(json.dumps(folders, default=str), headers=headers)
     except Exception as e:
         abort(500, e)
 
@@ -313,11 +622,65 @@ def compare_flow():
                 abort(400, "Expected number, received: " + this_key + "=" + request_data[this_key])
 
         request_data["request"] = "plot_compare_flow"
-        response = cama.do_request(request_data)
+        response = run_request(cama, request_data)
         return response
     except Exception as e:
         abort(500, e)
 
 
+@app.route("/job_status", methods=["POST"])
+def job_status():
+    try:
+        request_data = request.get_json()
+        mandatory_keys = ["job_id"]
+        given_keys = request_data.keys()
+        for this_key in mandatory_keys:
+            if this_key not in given_keys:
+                abort(400, "Missing required input key: " + this_key)
+
+        job = JobQueue(get_db()).job_status(request_data["job_id"])
+        if job is None:
+            abort(404, "Job doesn't exist: " + request_data["job_id"])
+        return json.dumps(job)
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/job_stream/<job_id>", methods=["GET"])
+def job_stream(job_id):
+    # Server-sent events: one status event per poll until the job finishes or the timeout is reached
+    try:
+        # capped, so that a client can't hold one of the few stream slots for ever; EventSource reconnects by itself
+        max_duration = float(admission.LANES["stream"].get("max_duration", 120))
+        timeout = min(float(request.args.get("timeout", max_duration)), max_duration)
+        jobs = JobQueue(get_db())
+        if jobs.job_status(job_id) is None:
+            abort(404, "Job doesn't exist: " + job_id)
+
+        def generate():
+            deadline = time.time() + timeout
+            while True:
+                job = jobs.job_status(job_id)
+                yield "data: " + json.dumps(job) + "\n\n"
+                if job["status"] in ["completed", "error"] or time.time() > deadline:
+                    break
+                time.sleep(1)
+
+        return Response(stream_with_context(generate()), mimetype="text/event-stream")
+    except Exception as e:
+        abort(500, e)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    try:
+        mongo_client = get_db()
+        active_runs = mongo_client["output"]["folder"].count_documents({"status": "running"})
+        body = metrics.render({"cama_active_runs": active_runs})
+        return Response(body, mimetype="text/plain; version=0.0.4")
+    except Exception as e:
+        abort(500, e)
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', threaded=True)  # run app in debug mode on port 80
@@ -0,0 +1,287 @@
+"""Times every CamaConvert request type and Flask route against synthetic data and local stand-ins.
+
+usage: python benchmark/run_benchmark.py [--output results.json] [--baseline baseline.json] [--repeat 3]
+
+The cases that raise or answer with an HTTP error are listed at the end and make the exit status 1.
+"""
+import argparse
+import glob
+import json
+import os.path
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import app  # noqa: E402
+import cama_archive  # noqa: E402
+import cama_convert  # noqa: E402
+import db_connect  # noqa: E402
+import job_queue  # noqa: E402
+import synthetic  # noqa: E402
+from stand_ins import LocalDbConnect, LocalProcess, MONGO_CLIENT  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+
+YEAR = 1990
+LAT = 32.05
+LON = -100.05
+PRE = "bench_pre"
+POST = "bench_post"
+# a completed post run extended by the /cama_run/extend case, and the sweep polled by /sweep_status
+EXTEND = "bench_extend"
+SWEEP_SCENARIO = "bench_sweep_0"
+
+
+def install_stand_ins(base_path, storage_path):
+    original_init = cama_convert.CamaConvert.__init__
+
+    def local_init(self, mongo_client):
+        original_init(self, mongo_client)
+        self.BASE_PATH = base_path
+
+    cama_convert.get_storage = lambda: LocalStorage(storage_path)
+    cama_convert.CamaConvert.__init__ = local_init
+    cama_convert.subprocess.Popen = LocalProcess
+    app.DbConnect = LocalDbConnect
+    job_queue.DbConnect = LocalDbConnect
+
+
+def insert_run_folders(storage_path):
+    """The folder of the /cama_run/extend case, with the restart file of its last year, and the sweep of /sweep_status"""
+    folder_collection = MONGO_CLIENT["output"]["folder"]
+    metadata = {"p_lat": LAT, "p_lon": LON, "p_riv_base": 0.03, "p_riv_new": 0.06, "p_fld_base": 0.1, "p_fld_new": 0.2,
+                "size_wetland": 1, "start_year": 1990, "end_year": 1995, "output_variables": ["outflw"], "threads": 1}
+    folder_collection.insert_one({"model": "postflow", "status": "completed", "folder_name": EXTEND, "format": "bin",
+                                  "metadata": metadata})
+    # the data directory is reused between runs
+    if not LocalStorage(storage_path).folder_exists(EXTEND):
+        LocalStorage(storage_path).create_folder(EXTEND)
+    with open(os.path.join(storage_path, EXTEND, "restart19960101.bin"), "wb") as f:
+        f.write(bytes(16))
+        f.close()
+    sweep_id = MONGO_CLIENT["output"]["sweep"].insert_one({"status": "running", "concurrency": 1, "baseline_folder": PRE,
+                                                            "scenarios": [{"folder_name": SWEEP_SCENARIO}]}).inserted_id
+    folder_collection.insert_one({"model": "postflow", "status": "running", "folder_name": SWEEP_SCENARIO,
+                                  "sweep_id": str(sweep_id), "metadata": dict(metadata, end_year=1991),
+                                  "progress": {"year": 1990, "years": [{"year": 1990, "seconds": 60}]}})
+    return str(sweep_id)
+
+
+def reset_runs(base_path, storage_path):
+    """Undoes a queued run, since the stand-ins never run the model: frees the run slot, gives the extended folder back
+    its end year and removes the sweep scenarios, with the scripts the sweep script would have removed on exit"""
+    folder_collection = MONGO_CLIENT["output"]["folder"]
+    MONGO_CLIENT["output"]["lock"].delete_one({"_id": db_connect.RUN_SLOT})
+    folder_collection.update_one({"folder_name": EXTEND}, {"$set": {"status": "completed", "metadata.end_year": 1995},
+                                                           "$unset": {"resume_year": ""}})
+    for folder in folder_collection.find({"status": "running"}):
+        if folder["folder_name"].startswith("sweep_"):
+            folder_collection.delete_one({"_id": folder["_id"]})
+            for path in [os.path.join(base_path, "map", folder["folder_name"]), os.path.join(storage_path, folder["folder_name"])]:
+                shutil.rmtree(path, ignore_errors=True)
+    for file_path in glob.glob(os.path.join(base_path, "gosh", "sweep_*.sh")):
+        os.remove(file_path)
+
+
+def time_case(function, repeat):
+    timings = []
+    status = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        status = function()
+        timings.append(time.perf_counter() - start)
+    result = {"median": statistics.median(timings), "min": min(timings), "runs": repeat}
+    if isinstance(status, int):
+        result["status"] = status  # HTTP status of the routes, so error paths are not mistaken for speedups
+    return result
+
+
+def cama_cases():
+    paths = {"pre_path": "/" + PRE + "/outflw" + str(YEAR) + ".bin", "post_path": "/" + POST + "/outflw" + str(YEAR) + ".bin",
+             "year": YEAR, "lat": LAT, "lon": LON}
+
+    def request(name, **extra):
+        payload = dict(paths)
+        payload.update(extra)
+        payload["request"] = name
+        return lambda: cama_convert.CamaConvert(MONGO_CLIENT).do_request(payload)
+
+    def update_manning():
+        cama_convert.CamaConvert(MONGO_CLIENT).update_manning(LAT, LON, 0.03, 0.06, 0.1, 0.2, 1)
+
+    def update_manning_sites():
+        # a portfolio of 10 wetlands along a line through the benchmark location, written in one pass
+        sites = [{"lat": LAT + 0.1 * k, "lon": LON + 0.1 * k, "riv_new": 0.06, "fld_new": 0.2, "size_wetland": k % 3}
+                 for k in range(10)]
+        cama_convert.CamaConvert(MONGO_CLIENT).update_manning(None, None, 0.03, None, 0.1, None, None, sites=sites)
+
+    def config_cama():
+        cama_convert.CamaConvert(MONGO_CLIENT).config_cama("post", 1990, 1995)
+
+    return {
+        "cama.plot_hydrograph_from_wetlands": request("plot_hydrograph_from_wetlands"),
+        "cama.plot_hydrograph_nearest_reservoir": request("plot_hydrograph_nearest_reservoir"),
+        "cama.plot_hydrograph_deltas": request("plot_hydrograph_deltas"),
+        "cama.plot_compare_flow": request("plot_compare_flow"),
+        "cama.river_profile": request("river_profile"),
+        "cama.impact_summary": request("impact_summary", pre_folder=PRE, post_folder=POST, start_year=1981, end_year=2010),
+        "cama.peak_flow": request("peak_flow", folder_name=PRE, return_period=10),
+        "cama.veg_lookup": request("veg_lookup", veg_type="trees"),
+        "cama.coord_to_grid": request("coord_to_grid"),
+        "cama.cama_status": request("cama_status", folder_name=PRE),
+        # the run requests start CaMa through sudo, so only their Python-side preparation is timed
+        "cama.update_manning": update_manning,
+        "cama.update_manning_sites": update_manning_sites,
+        "cama.config_cama": config_cama,
+    }
+
+
+def route_cases(base_path, storage_path, sweep_id):
+    client = app.app.test_client()
+    paths = {"pre_path": "/" + PRE + "/outflw" + str(YEAR) + ".bin", "post_path": "/" + POST + "/outflw" + str(YEAR) + ".bin",
+             "year": YEAR, "lat": LAT, "lon": LON}
+    square = [[[-100.0, 32.0], [-99.9, 32.0], [-99.9, 32.1], [-100.0, 32.0]]]
+    features = {"operationalLayers": [{}, {}, {}, {"featureCollection": {"layers": [
+        {"featureSet": {"features": [{"geometry": square} for i in range(1000)]}}]}}]}
+
+    def post(url, payload):
+        def call():
+            response = client.post(url, json=payload)
+            # reads the body, so that streamed responses are timed to their end
+            response.get_data()
+            return response.status_code
+        return call
+
+    def get(url):
+        return lambda: client.get(url).status_code
+
+    def run(url, payload):
+        # the queued run is undone after every call, so that each repeat submits it again
+        call = post(url, payload)
+
+        def call_and_reset():
+            status = call()
+            reset_runs(base_path, storage_path)
+            return status
+        return call_and_reset
+
+    first_folder = MONGO_CLIENT["output"]["folder"].find_one({"folder_name": PRE})
+    sweep = {"lat": LAT, "lon": LON, "riv_base": 0.03, "fld_base": 0.1, "start_year": 1990, "end_year": 1991,
+             "grid": {"riv_new": [0.06, 0.08], "fld_new": [0.2], "size_wetland": [0, 2]}, "core_budget": 1}
+
+    return {
+        "route./": get("/"),
+        "route./to_geojson": post("/to_geojson", features),
+        "route./to_arcgis": post("/to_arcgis", [square] * 1000),
+        "route./wetland_flow": post("/wetland_flow", paths),
+        "route./reservoir_flow": post("/reservoir_flow", paths),
+        "route./river_profile": post("/river_profile", paths),
+        "route./impact_summary": post("/impact_summary", {"pre_folder": PRE, "post_folder": POST, "start_year": 1981,
+                                                          "end_year": 2010, "lat": LAT, "lon": LON}),
+        "route./comparative_flow": post("/comparative_flow", dict(paths, return_period=10)),
+        "route./compare_flow": post("/compare_flow", paths),
+        "route./vegetation_lookup": post("/vegetation_lookup", {"veg_type": "trees"}),
+        "route./coord_to_grid": post("/coord_to_grid", {"lat": LAT, "lon": LON}),
+        "route./peak_flow": post("/peak_flow", {"folder_name": PRE, "lat": LAT, "lon": LON, "return_period": 10}),
+        "route./cama_status": post("/cama_status", {"folder_name": PRE}),
+        "route./output_folders": get("/output_folders"),
+        "route./output_folders?limit": get("/output_folders?limit=100&fields=folder_name,status"),
+        "route./output_folders?after": get("/output_folders?limit=100&after=" + str(first_folder["_id"])),
+        "route./metrics": get("/metrics"),
+        # inline, to time the build rather than its queueing
+        "route./climatology/build": post("/climatology/build", {"folder_name": POST, "async": False}),
+        "route./climatology": post("/climatology", {"folder_name": PRE, "lat": LAT, "lon": LON, "year": YEAR}),
+        "route./cama_sweep": run("/cama_sweep", sweep),
+        "route./sweep_status": post("/sweep_status", {"sweep_id": sweep_id}),
+        "route./cama_run/extend": run("/cama_run/extend", {"folder_name": EXTEND, "end_year": 1997}),
+    }
+
+
+def compare(results, baseline):
+    print("%-45s %12s %12s %8s" % ("case", "baseline", "current", "ratio"))
+    for name in sorted(results):
+        if name not in baseline or "median" not in results[name] or "median" not in baseline[name]:
+            continue
+        ratio = results[name]["median"] / baseline[name]["median"] if baseline[name]["median"] else float("nan")
+        print("%-45s %12.4f %12.4f %8.2f" % (name, baseline[name]["median"], results[name]["median"], ratio))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=os.path.join(tempfile.gettempdir(), "cama_benchmark"),
+                        help="where the synthetic data is generated (reused between runs)")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="results file of a previous run to compare against")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", default="", help="only run the cases containing this string")
+    parser.add_argument("--archive", action="store_true", help="read the outputs from compressed archives")
+    args = parser.parse_args()
+
+    base_path = os.path.join(args.data, "cama")
+    storage_path = os.path.join(args.data, "storage")
+    print("Generating synthetic data in " + args.data)
+    synthetic.generate(base_path, storage_path, range(1916, 2011), PRE, POST)
+    install_stand_ins(base_path, storage_path)
+    # as app.py does in the uwsgi master, so the cases time warm workers
+    cama_convert.preload_static(base_path)
+    output_format = "bin"
+    if args.archive:
+        output_format = "archive"
+        for folder_name in [PRE, POST]:
+            for file_name in os.listdir(os.path.join(storage_path, folder_name)):
+                archive_path = os.path.join(storage_path, folder_name, cama_archive.archive_name(file_name))
+                if cama_archive.OUTPUT_NAME.match(file_name) and not os.path.exists(archive_path):
+                    cama_archive.write_archive(os.path.join(storage_path, folder_name, file_name), archive_path,
+                                                 synthetic.NX * synthetic.NY)
+    for folder_name in [PRE, POST]:
+        MONGO_CLIENT["output"]["folder"].insert_one({"model": "preflow", "status": "completed", "folder_name": folder_name,
+                                                     "format": output_format,
+                                                     "metadata": {"start_year": 1916, "end_year": 2010}})
+    sweep_id = insert_run_folders(storage_path)
+
+    output_path = os.path.abspath(args.output)
+    work_dir = tempfile.mkdtemp(prefix="cama_benchmark_")
+    os.chdir(work_dir)
+    cases = dict(cama_cases())
+    cases.update(route_cases(base_path, storage_path, sweep_id))
+    if any(args.filter in name for name in ["route./climatology"]):
+        # the bands read the climatology of the baseline, built once here rather than timed
+        cama_convert.CamaConvert(MONGO_CLIENT).build_climatology(PRE)
+    results = {}
+    for name in sorted(cases):
+        if args.filter not in name:
+            continue
+        try:
+            results[name] = time_case(cases[name], args.repeat)
+            print("%-45s median %.4fs  min %.4fs  %s" % (name, results[name]["median"], results[name]["min"],
+                                                         results[name].get("status", "")))
+        except Exception as e:
+            # a failing case is recorded, so the comparison shows it instead of aborting the whole run
+            results[name] = {"error": repr(e)}
+            print("%-45s error %r" % (name, e))
+        if "error" in results[name] or results[name].get("status", 200) >= 400:
+            results[name]["failed"] = True
+
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+    print("Results saved to " + output_path)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+            f.close()
+        compare(results, baseline)
+    failed = sorted(name for name in results if results[name].get("failed"))
+    if len(failed) > 0:
+        print("FAILED %d case(s):" % len(failed))
+        for name in failed:
+            print("  %-43s %s" % (name, results[name].get("error", results[name].get("status"))))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
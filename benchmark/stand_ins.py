@@ -0,0 +1,173 @@
+"""Local stand-ins for DbConnect and the run commands so the benchmarks run offline (storage.LocalStorage replaces
+Dropbox)"""
+import copy
+import subprocess
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+
+class InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, modified_count):
+        self.modified_count = modified_count
+
+
+class LocalCursor(list):
+    def sort(self, key, direction=1):
+        return LocalCursor(sorted(self, key=lambda document: document.get(key), reverse=direction < 0))
+
+    def limit(self, count):
+        return LocalCursor(self[:count])
+
+
+class LocalCollection:
+    """The subset of the pymongo collection API used by the service, with equality filters only"""
+
+    def __init__(self):
+        self.DOCUMENTS = []
+
+    def matches(self, document, query):
+        for key, value in (query or {}).items():
+            if isinstance(value, dict) and "$gt" in value:
+                if key not in document or not document[key] > value["$gt"]:
+                    return False
+            elif isinstance(value, dict) and "$in" in value:
+                if document.get(key) not in value["$in"]:
+                    return False
+            elif document.get(key) != value:
+                return False
+        return True
+
+    def project(self, document, projection):
+        # copies, like the documents decoded by pymongo, so that the callers never alias the stored sub-documents
+        document = copy.deepcopy(document)
+        if projection is None:
+            return document
+        included = [key for key, value in projection.items() if value == 1]
+        if len(included) > 0:
+            return {key: value for key, value in document.items() if key in included or (key == "_id" and projection.get("_id") != 0)}
+        excluded = [key for key, value in projection.items() if value == 0]
+        return {key: value for key, value in document.items() if key not in excluded}
+
+    def insert_one(self, document):
+        document.setdefault("_id", ObjectId())
+        self.DOCUMENTS.append(document)
+        return InsertResult(document["_id"])
+
+    def find_one(self, query=None, projection=None):
+        for document in self.DOCUMENTS:
+            if self.matches(document, query):
+                return self.project(document, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        return LocalCursor(self.project(document, projection) for document in self.DOCUMENTS if self.matches(document, query))
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def apply(self, document, update):
+        # $set and $unset, with dotted keys reaching into the sub-documents
+        for operator in ["$set", "$unset"]:
+            for key, value in update.get(operator, {}).items():
+                target = document
+                path = key.split(".")
+                for part in path[:-1]:
+                    target = target.setdefault(part, {})
+                if operator == "$set":
+                    target[path[-1]] = value
+                else:
+                    target.pop(path[-1], None)
+
+    def update_one(self, query, update):
+        for document in self.DOCUMENTS:
+            if self.matches(document, query):
+                self.apply(document, update)
+                return
+
+    update = update_one
+
+    def update_many(self, query, update):
+        matched = [document for document in self.DOCUMENTS if self.matches(document, query)]
+        for document in matched:
+            self.apply(document, update)
+        return UpdateResult(len(matched))
+
+    def find_one_and_update(self, query, update, upsert=False):
+        for document in self.DOCUMENTS:
+            if self.matches(document, query):
+                before = dict(document)
+                self.apply(document, update)
+                return before
+        if upsert:
+            if "_id" in query and self.find_one({"_id": query["_id"]}) is not None:
+                raise DuplicateKeyError("duplicate key: " + str(query["_id"]))
+            document = dict(query)
+            self.apply(document, update)
+            self.insert_one(document)
+        return None
+
+    def create_index(self, keys, **kwargs):
+        return keys
+
+    def delete_one(self, query):
+        for document in self.DOCUMENTS:
+            if self.matches(document, query):
+                self.DOCUMENTS.remove(document)
+                return
+
+
+class LocalDatabase(dict):
+    def __missing__(self, key):
+        self[key] = LocalCollection()
+        return self[key]
+
+
+class LocalMongoClient(dict):
+    def __missing__(self, key):
+        self[key] = LocalDatabase()
+        return self[key]
+
+    def close(self):
+        pass
+
+
+MONGO_CLIENT = LocalMongoClient()
+
+
+class LocalDbConnect:
+    def __init__(self):
+        self.MONGO_CLIENT = None
+
+    def connect_db(self):
+        self.MONGO_CLIENT = MONGO_CLIENT
+
+    def get_connection(self):
+        return self.MONGO_CLIENT
+
+    def disconnect_db(self):
+        self.MONGO_CLIENT = None
+
+
+# kept before install_stand_ins replaces subprocess.Popen with LocalProcess
+POPEN = subprocess.Popen
+
+
+class LocalProcess:
+    """subprocess.Popen stand-in: the sudo copies, removals and chmods of the map directories run without sudo, the
+    model scripts are not started"""
+    MAP_COMMANDS = ("sudo cp ", "sudo rm ", "sudo chmod ")
+
+    def __init__(self, command, shell=False):
+        self.RETURNCODE = 0
+        parts = [part.strip() for part in command.split(";") if part.strip()]
+        if all(part.startswith(self.MAP_COMMANDS) for part in parts):
+            self.RETURNCODE = POPEN(command.replace("sudo ", ""), shell=True, stdout=subprocess.DEVNULL).wait()
+
+    def wait(self):
+        return self.RETURNCODE
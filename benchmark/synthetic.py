@@ -0,0 +1,108 @@
+"""Generates a synthetic CaMa tree (map, res, inp and yearly outputs) in the layouts read by cama_convert"""
+import calendar
+import os.path
+import shutil
+
+import numpy
+
+NX = 90
+NY = 61
+NLFP = 10
+WEST = -104.05
+NORTH = 34.95
+STEP = 0.1
+MOUTH_X = 89  # build_flow_grids keeps 89 columns per row, so the synthetic rivers end at column 89
+RESERVOIR_X = 88
+DIMINFO = """%12d     !! nXX
+%12d     !! nYY
+%12d     !! floodplain layer
+%12d     !! input nXX
+%12d     !! input nYY
+           1     !! input nLFP (if only 1 layer)
+%s
+%12.3f     !! west  edge
+%12.3f     !! east  edge
+%12.3f     !! north edge
+%12.3f     !! south edge
+"""
+
+
+def cell_centers():
+    """Returns the lon/lat of every cell, row major from the north-west corner"""
+    lon = WEST + STEP / 2 + STEP * numpy.arange(NX)
+    lat = NORTH - STEP / 2 - STEP * numpy.arange(NY)
+    lon_mat, lat_mat = numpy.meshgrid(lon, lat)
+    return lon_mat.ravel(), lat_mat.ravel()
+
+
+def write_static(base_path):
+    for folder in ["res", "inp", "gosh", os.path.join("map", "hamid"), os.path.join("map", "hamid_copy")]:
+        if not os.path.exists(os.path.join(base_path, folder)):
+            os.makedirs(os.path.join(base_path, folder))
+
+    # every river flows east along its row and reaches the sea at column MOUTH_X
+    xx, yy = numpy.meshgrid(numpy.arange(1, NX + 1), numpy.arange(1, NY + 1))
+    next_x = numpy.where(xx < MOUTH_X, xx + 1, -9999).ravel()
+    next_y = numpy.where(xx < MOUTH_X, yy, -9999).ravel()
+    numpy.savetxt(os.path.join(base_path, "res", "nextxy.txt"), numpy.column_stack([next_x, next_y]), fmt="%d")
+    # the map's nextxy.bin flags the mouths with -9 and keeps -9999 for the cells outside the network
+    map_next_x = numpy.where(xx < MOUTH_X, xx + 1, numpy.where(xx == MOUTH_X, -9, -9999))
+    map_next_y = numpy.where(xx < MOUTH_X, yy, numpy.where(xx == MOUTH_X, -9, -9999))
+    numpy.stack([map_next_x, map_next_y]).astype(numpy.int32).tofile(os.path.join(base_path, "map", "hamid", "nextxy.bin"))
+
+    lon, lat = cell_centers()
+    reservoirs = numpy.arange(NY) * NX + RESERVOIR_X - 1
+    # note: reservoir locations are [lon,lat]
+    numpy.savetxt(os.path.join(base_path, "res", "Reservoir_xy.txt"), numpy.column_stack([lon[reservoirs], lat[reservoirs]]),
+                  fmt="%.3f")
+
+    map_path = os.path.join(base_path, "map", "hamid")
+    numpy.savetxt(os.path.join(map_path, "lonlat"), numpy.column_stack([lon, lat]), fmt="%.3f")
+    numpy.savetxt(os.path.join(map_path, "wetland_loc_multiple"), numpy.column_stack([lat[:5 * NX:NX], lon[:5 * NX:NX]]),
+                  fmt="%.3f")
+    rng = numpy.random.default_rng(0)
+    rng.random(NX * NY, dtype=numpy.float32).tofile(os.path.join(map_path, "rivhgt.bin"))
+    (rng.random(NX * NY * NLFP, dtype=numpy.float32) * 10).tofile(os.path.join(map_path, "fldhgt_original.bin"))
+    with open(os.path.join(map_path, "diminfo_0625.txt"), "w") as f:
+        # the standard layout: nx, ny, layers, the input grid, the input matrix file and the edges
+        f.write(DIMINFO % (NX, NY, NLFP, NX, NY, "./inpmat_0625.bin", WEST, WEST + STEP * NX, NORTH, NORTH - STEP * NY))
+        f.close()
+
+    # the pristine map, copied by the sweeps and reset_map_directory
+    for file_name in os.listdir(map_path):
+        shutil.copyfile(os.path.join(map_path, file_name), os.path.join(base_path, "map", "hamid_copy", file_name))
+    shutil.copyfile(os.path.join(map_path, "fldhgt_original.bin"), os.path.join(base_path, "map", "hamid_copy", "fldhgt.bin"))
+
+    dates = []
+    for year in range(1915, 2012):
+        for month in range(1, 13):
+            for day in range(1, calendar.monthrange(year, month)[1] + 1):
+                dates.append((year, month, day))
+    numpy.savetxt(os.path.join(base_path, "inp", "hamid_dates_1915_2011"), numpy.asarray(dates), fmt="%d")
+
+    for model in ["pre", "post"]:
+        with open(os.path.join(base_path, "gosh", "hamid_" + model + "_template.sh"), "w") as f:
+            f.write("#!/bin/sh\nYSTART=<SYEAR>\nYEND=<EYEAR>\n")
+            f.close()
+
+
+def write_outflow(folder_path, year, seed, scale=1.0):
+    """Writes outflw<YEAR>.bin as days x 61 x 90 float32, with a seasonal signal and a few >100000 fill values"""
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    days = 366 if calendar.isleap(year) else 365
+    rng = numpy.random.default_rng(seed)
+    season = 1 + numpy.sin(numpy.linspace(0, 2 * numpy.pi, days, dtype=numpy.float32))
+    cells = rng.random(NX * NY, dtype=numpy.float32) * 500
+    flow = (season[:, None] * cells[None, :] * scale).astype(numpy.float32)
+    flow[:, ::97] = 1e20  # no-data filler, zeroed out by the readers
+    flow.tofile(os.path.join(folder_path, "outflw" + str(year) + ".bin"))
+
+
+def generate(base_path, storage_path, years, pre_folder="bench_pre", post_folder="bench_post"):
+    write_static(base_path)
+    for year in years:
+        if not os.path.exists(os.path.join(storage_path, pre_folder, "outflw" + str(year) + ".bin")):
+            write_outflow(os.path.join(storage_path, pre_folder), year, year)
+        if not os.path.exists(os.path.join(storage_path, post_folder, "outflw" + str(year) + ".bin")):
+            write_outflow(os.path.join(storage_path, post_folder), year, year, 0.9)
@@ -0,0 +1,100 @@
+"""Compressed, chunked archive of a yearly CaMa output (days x cells float32).
+
+Layout: MAGIC, the header length as a little-endian uint64, a JSON header, then the chunks. Every chunk holds all the
+days of a block of BLOCK_CELLS consecutive cells, compressed on its own, so a reader decompresses only the blocks of
+the cells it needs.
+"""
+import json
+import re
+import struct
+import zlib
+
+import numpy
+
+MAGIC = b"CAMAARC1"
+EXTENSION = ".cca"
+BLOCK_CELLS = 64
+# CaMa yearly outputs are named <6-letter variable><YEAR>.bin, e.g. outflw1990.bin
+OUTPUT_NAME = re.compile(r"^[a-z]{6}\d{4}\.bin$")
+
+
+def is_archive(file_path):
+    return file_path.endswith(EXTENSION)
+
+
+def archive_name(file_name):
+    return file_name[:-len(".bin")] + EXTENSION if file_name.endswith(".bin") else file_name
+
+
+def write_archive(bin_path, archive_path, cells, block_cells=BLOCK_CELLS, level=1):
+    # mapped rather than loaded, so that large grids are read one block of cells at a time
+    data = numpy.memmap(bin_path, dtype=numpy.float32, mode="r")
+    if data.size % cells != 0:
+        raise Exception("File size doesn't match the grid: " + bin_path)
+    days = data.size // cells
+    grid = data.reshape(days, cells)
+    chunks = []
+    offset = 0
+    payloads = []
+    for start in range(0, cells, block_cells):
+        payload = zlib.compress(numpy.ascontiguousarray(grid[:, start:start + block_cells]).tobytes(), level)
+        chunks.append([offset, len(payload)])
+        payloads.append(payload)
+        offset += len(payload)
+    header = json.dumps({"dtype": "float32", "days": days, "cells": cells, "block_cells": block_cells, "codec": "zlib",
+                         "chunks": chunks}).encode()
+    with open(archive_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for payload in payloads:
+            f.write(payload)
+        f.close()
+
+
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise Exception("Not a CaMa archive")
+    header_length = struct.unpack("<Q", f.read(8))[0]
+    header = json.loads(f.read(header_length).decode())
+    header["data_offset"] = len(MAGIC) + 8 + header_length
+    return header
+
+
+def read_block(f, header, block):
+    offset, length = header["chunks"][block]
+    f.seek(header["data_offset"] + offset)
+    raw = zlib.decompress(f.read(length))
+    return numpy.frombuffer(raw, dtype=numpy.float32).reshape(header["days"], -1)
+
+
+def read_values(archive_path, indices):
+    """Gathers the values at the given flat indices of the original days x cells layout"""
+    indices = numpy.asarray(indices, dtype=numpy.int64)
+    with open(archive_path, "rb") as f:
+        header = read_header(f)
+        cells = header["cells"]
+        # negative indices count from the end, as on the flat array
+        indices = numpy.where(indices < 0, indices + header["days"] * cells, indices)
+        days = indices // cells
+        cell = indices % cells
+        blocks = cell // header["block_cells"]
+        values = numpy.empty(indices.shape, dtype=numpy.float32)
+        for block in numpy.unique(blocks):
+            selected = blocks == block
+            data = read_block(f, header, int(block))
+            values[selected] = data[days[selected], cell[selected] - block * header["block_cells"]]
+        f.close()
+    return values
+
+
+def read_all(archive_path):
+    """Decompresses the whole archive back to the flat days x cells layout"""
+    with open(archive_path, "rb") as f:
+        header = read_header(f)
+        grid = numpy.empty((header["days"], header["cells"]), dtype=numpy.float32)
+        for block in range(len(header["chunks"])):
+            start = block * header["block_cells"]
+            grid[:, start:start + header["block_cells"]] = read_block(f, header, block)
+        f.close()
+    return grid.ravel()
@@ -1,4 +1,6 @@
 import calendar
+import datetime
+import itertools
 import json
 import math
 import os.path
@@ -6,11 +8,183 @@ import shutil
 import string
 import subprocess
 import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import bson
 import numpy
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None  # only needed to read the netCDF outputs (LOUTCDF)
 # Custom import
-from dropbox_connect import DropBox
+import cama_archive
+import cama_grid
+import climatology
+from storage import get_storage
+from run_monitor import estimate_progress
 import db_connect
+import metrics
+
+VECTOR_EXTENSION = ".vec"
+NETCDF_EXTENSION = ".nc"
+MISSING_VALUE = 1e20  # CaMa's fill value, zeroed out by the cleaning readers like any value > 100000
+# land sequences of the 1-D vector output, per nextxy.bin path, computed once per process
+LAND_SEQUENCES = {}
+# downstream cells (nextxy.bin) per path, read once per process
+NEXT_XY = {}
+# read-only text tables (res/nextxy.txt, lonlat, reservoirs, dates) per path; filled by preload_static in the uwsgi
+# master, so the workers share the pages copy-on-write
+STATIC_TABLES = {}
+RESERVOIR_CELLS = {}
+# nearest-cell indexes over lonlat, per path
+CELL_INDEXES = {}
+# output variables a run can select, and the template setting that enables each of them
+OUTPUT_VARIABLES = {"rivout": "CRIVOUTDIR", "rivsto": "CRIVSTODIR", "rivvel": "CRIVVELDIR", "rivdph": "CRIVDPHDIR",
+                    "fldout": "CFLDOUTDIR", "fldsto": "CFLDSTODIR", "flddph": "CFLDDPHDIR", "fldare": "CFLDAREDIR",
+                    "fldfrc": "CFLDFRCDIR", "sfcelv": "CSFCELVDIR", "outflw": "COUTFLWDIR", "storge": "CSTORGEDIR",
+                    "pthout": "CPTHOUTDIR", "pthflw": "CPTHFLWDIR"}
+DEFAULT_OUTPUT_VARIABLES = ["outflw", "storge"]
+DEFAULT_THREADS = 4
+# parameters a sweep varies, in the order of its scenario tuples
+SWEEP_KEYS = ["riv_new", "fld_new", "size_wetland"]
+MAX_SWEEP_SCENARIOS = 64
+# folder formats an extension can write again: plain binaries (archived or not), land-only vectors and netCDF
+EXTENSIBLE_FORMATS = ["bin", "archive", "vector", "netcdf"]
+# keys of every wetland of a multi-site post run, in the order of the single wetland arguments of run_cama_post
+SITE_KEYS = ["lat", "lon", "riv_new", "fld_new", "size_wetland"]
+MAX_SUMMARY_YEARS = 200
+# The pool of compare_years is created lazily, so that every uwsgi worker forks its own after the static grids were
+# preloaded and its processes share them
+SUMMARY_POOL = None
+SUMMARY_POOL_LOCK = threading.Lock()
+
+
+def map_grid(base_path):
+    return cama_grid.load_grid(os.path.join(base_path, "map", "hamid"))
+
+
+def read_text(file_path, **kwargs):
+    with metrics.timed("cama_file_read_seconds", {"reader": "loadtxt"}):
+        return numpy.loadtxt(file_path, **kwargs)
+
+
+def load_static_table(file_path, **kwargs):
+    """Reads a text table of the model tree once per process; the array is read-only since it is shared"""
+    if file_path not in STATIC_TABLES:
+        table = read_text(file_path, **kwargs)
+        table.setflags(write=False)
+        STATIC_TABLES[file_path] = table
+    return STATIC_TABLES[file_path]
+
+
+def load_next_xy(base_path):
+    """Returns the map's nextxy.bin as a (2, ny, nx) array of 1-based downstream x and y; -9 and -10 flag the river
+    mouths and inland terminations, -9999 the cells outside the river network
+    """
+    file_path = os.path.join(base_path, "map", "hamid", "nextxy.bin")
+    if file_path not in NEXT_XY:
+        grid = map_grid(base_path)
+        NEXT_XY[file_path] = numpy.fromfile(file_path, dtype=numpy.int32).reshape(2, grid.NY, grid.NX)
+    return NEXT_XY[file_path]
+
+
+def load_land_sequence(base_path):
+    """Returns the 0-based grid cells (row major) in the order of CaMa's 1-D land-only vector output (LOUTVEC)
+
+    This follows CaMa's CALC_SEQ on the map's nextxy.bin: the river cells from upstream to downstream, then the river
+    mouths and inland terminations.
+    """
+    file_path = os.path.join(base_path, "map", "hamid", "nextxy.bin")
+    if file_path in LAND_SEQUENCES:
+        return LAND_SEQUENCES[file_path]
+    grid = map_grid(base_path)
+    next_xy = load_next_xy(base_path)
+    next_x = next_xy[0]
+    next_y = next_xy[1]
+    upstream_count = numpy.zeros(next_x.shape, dtype=numpy.int32)
+    river = next_x > 0
+    numpy.add.at(upstream_count, (next_y[river] - 1, next_x[river] - 1), 1)
+
+    sequence = [(iy, ix) for iy, ix in zip(*numpy.nonzero(river & (upstream_count == 0)))]
+    upstream_done = numpy.zeros(next_x.shape, dtype=numpy.int32)
+    first = 0
+    last = len(sequence)
+    while first < last:
+        for k in range(first, last):
+            iy, ix = sequence[k]
+            jy = next_y[iy, ix] - 1
+            jx = next_x[iy, ix] - 1
+            upstream_done[jy, jx] += 1
+            if upstream_done[jy, jx] == upstream_count[jy, jx] and next_x[jy, jx] > 0:
+                sequence.append((jy, jx))
+        first = last
+        last = len(sequence)
+    # river mouths (-9) and inland terminations (-10) come last; -9999 is outside the river network
+    sequence += [(iy, ix) for iy, ix in zip(*numpy.nonzero((next_x < 0) & (next_x != -9999)))]
+
+    cells = numpy.asarray([iy * grid.NX + ix for iy, ix in sequence], dtype=numpy.int64)
+    LAND_SEQUENCES[file_path] = cells
+    return cells
+
+
+def load_cell_index(base_path):
+    """Returns the nearest-row index over the map's lonlat, built once per process; row k is grid cell k + 1"""
+    file_path = os.path.join(base_path, "map", "hamid", "lonlat")
+    if file_path not in CELL_INDEXES:
+        lon_lat = load_static_table(file_path)
+        CELL_INDEXES[file_path] = cama_grid.NearestCellIndex(lon_lat[:, 0], lon_lat[:, 1])
+    return CELL_INDEXES[file_path]
+
+
+def coords_to_grid_cells(base_path, lats, lons):
+    """Returns the grid cell of each of the coordinates, all looked up in one batch"""
+    grid = map_grid(base_path)
+    index = load_cell_index(base_path)
+    if len(index.VECTORS) != grid.cells:
+        # lonlat doesn't list every cell of the grid in order, so it can't name the cell
+        return numpy.atleast_1d(grid.cells_of(lats, lons))
+    return index.nearest_many(lats, lons) + 1
+
+
+def load_reservoir_cells(base_path):
+    # grid cells of the reservoirs; note: reservoir locations are [lon,lat], in contradiction of ISO 6709
+    file_path = os.path.join(base_path, "res", "Reservoir_xy.txt")
+    if file_path not in RESERVOIR_CELLS:
+        reservoir_raw = load_static_table(file_path, usecols=range(2))
+        cells = coords_to_grid_cells(base_path, reservoir_raw[:, 1], reservoir_raw[:, 0])
+        RESERVOIR_CELLS[file_path] = frozenset(int(cell) for cell in cells)
+    return RESERVOIR_CELLS[file_path]
+
+
+def preload_static(base_path=None):
+    """Loads the grid, the routing tables, lonlat and the date table of the model tree (CAMA_BASE_PATH by default).
+    Called once before the uwsgi workers fork, so they inherit these arrays instead of each reading them again; it needs
+    neither Mongo nor the storage backend. Every table is loaded on its own, a missing one is read later on demand;
+    returns the error of each table that couldn't be loaded
+    """
+    if base_path is None:
+        file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+        with open(file_path) as f:
+            base_path = json.load(f)["CAMA_BASE_PATH"]
+            f.close()
+    tables = [("diminfo", lambda: map_grid(base_path)), ("nextxy.bin", lambda: load_next_xy(base_path)),
+              ("land sequence", lambda: load_land_sequence(base_path)),
+              ("res/nextxy.txt", lambda: load_static_table(os.path.join(base_path, "res", "nextxy.txt"),
+                                                           usecols=range(2))),
+              ("lonlat", lambda: load_cell_index(base_path)),
+              ("dates", lambda: load_static_table(os.path.join(base_path, "inp", "hamid_dates_1915_2011"),
+                                                  dtype=numpy.int32)),
+              ("reservoirs", lambda: load_reservoir_cells(base_path))]
+    errors = dict()
+    for name, load in tables:
+        try:
+            load()
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
 
 class CamaConvert:
     def __init__(self, mongo_client):
@@ -19,7 +193,10 @@ class CamaConvert:
             config = json.load(f)
             f.close()
         self.BASE_PATH = config["CAMA_BASE_PATH"]
-        self.DROPBOX = DropBox()
+        self.SUMMARY_WORKERS = int(config.get("SUMMARY_WORKERS", 4))
+        # the climatology sketch holds climatology.BYTES_PER_CELL per cell of the map in memory
+        self.MAX_CLIMATOLOGY_CELLS = int(config.get("MAX_CLIMATOLOGY_CELLS", 50000))
+        self.STORAGE = get_storage()
         self.MONGO_CLIENT = mongo_client
         self.YEAR = None  # the year to evaluate
         self.PRE_PATH = ""  # file path to the pre-restoration modelling results
@@ -67,19 +244,175 @@ class CamaConvert:
             path = new_config["pre_path"].split("/")
             folder_name = path[1]
             file_name = path[2]
-            self.DROPBOX.download_file(folder_name, file_name, self.TMP_FOLDER)
-            self.PRE_PATH = os.path.join(os.getcwd(), self.TMP_FOLDER, folder_name, file_name)
+            self.PRE_PATH = self.fetch_output(folder_name, file_name)
         if "post_path" in new_config:
             path = new_config["post_path"].split("/")
             folder_name = path[1]
             file_name = path[2]
-            self.DROPBOX.download_file(folder_name, file_name, self.TMP_FOLDER)
-            self.POST_PATH = os.path.join(os.getcwd(), self.TMP_FOLDER, folder_name, file_name)
+            self.POST_PATH = self.fetch_output(folder_name, file_name)
         if "lat" in new_config:
             self.LAT = new_config["lat"]
         if "lon" in new_config:
             self.LON = new_config["lon"]
 
+    def fetch_output(self, folder_name, file_name):
+        """Makes an output file of the folder readable locally, in whichever format the folder was uploaded"""
+        folder = self.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": folder_name}, {"format": 1})
+        folder_format = folder.get("format") if folder is not None else None
+        return self.STORAGE.download_file(folder_name, self.output_file_name(folder_format, file_name), self.TMP_FOLDER)
+
+    def output_file_name(self, folder_format, file_name):
+        """Name under which a folder uploaded in the given format keeps an output file, e.g. outflw2000.bin"""
+        if folder_format == "archive":
+            return cama_archive.archive_name(file_name)
+        elif folder_format == "vector" and file_name.endswith(".bin"):
+            return file_name[:-len(".bin")] + VECTOR_EXTENSION
+        elif folder_format == "netcdf" and file_name.endswith(".bin"):
+            return file_name[:-len(".bin")] + NETCDF_EXTENSION
+        return file_name
+
+    def grid(self):
+        """Returns the grid descriptor of the map, parsed once per process"""
+        return map_grid(self.BASE_PATH)
+
+    def next_xy(self):
+        return load_next_xy(self.BASE_PATH)
+
+    def downstream_path(self, grid_cell):
+        # the 1-based grid cells from grid_cell to the river mouth, following nextxy
+        grid = self.grid()
+        next_xy = self.next_xy()
+        path = [grid_cell]
+        while len(path) <= grid.cells:
+            iy, ix = divmod(path[-1] - 1, grid.NX)
+            if next_xy[0, iy, ix] <= 0:
+                return path
+            path.append(int((next_xy[1, iy, ix] - 1) * grid.NX + next_xy[0, iy, ix]))
+        raise Exception("The river network has a loop downstream of grid cell " + str(grid_cell))
+
+    def land_sequence(self):
+        return load_land_sequence(self.BASE_PATH)
+
+    def read_vector(self, file_path):
+        # decodes a land-only vector output back to the flat days x cells grid layout
+        cells = self.land_sequence()
+        vector = numpy.fromfile(file_path, dtype=numpy.float32).reshape(-1, len(cells))
+        grid = numpy.full((vector.shape[0], self.grid().cells), MISSING_VALUE, dtype=numpy.float32)
+        grid[:, cells] = vector
+        return grid.ravel()
+
+    def read_vector_values(self, file_path, indices):
+        cells = self.land_sequence()
+        vector = numpy.memmap(file_path, dtype=numpy.float32, mode="r").reshape(-1, len(cells))
+        grid_cells = self.grid().cells
+        position = numpy.full(grid_cells, -1, dtype=numpy.int64)
+        position[cells] = numpy.arange(len(cells))
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        # negative indices count from the end, as on the flat grid array
+        indices = numpy.where(indices < 0, indices + vector.shape[0] * grid_cells, indices)
+        days = indices // grid_cells
+        vector_index = position[indices % grid_cells]
+        values = numpy.full(indices.shape, MISSING_VALUE, dtype=numpy.float32)
+        land = vector_index >= 0
+        values[land] = vector[days[land], vector_index[land]]
+        return values
+
+    def open_netcdf(self, file_path):
+        """Opens a CaMa netCDF output and returns the dataset, its (time, lat, lon) variable and whether the latitudes
+        run south to north, the opposite of the row order of the flat binaries
+        """
+        if netCDF4 is None:
+            raise Exception("netCDF4 is required to read " + file_path + ": pip install netCDF4")
+        dataset = netCDF4.Dataset(file_path, "r")
+        # CaMa names the variable after the file (outflw1990.nc holds outflw)
+        name = os.path.basename(file_path)[:6]
+        if name not in dataset.variables:
+            name = [key for key, value in dataset.variables.items() if value.ndim == 3][0]
+        variable = dataset.variables[name]
+        variable.set_auto_mask(False)
+        lat_name = [key for key in dataset.variables if key.lower() in ["lat", "latitude"]]
+        ascending = len(lat_name) > 0 and dataset.variables[lat_name[0]][0] < dataset.variables[lat_name[0]][-1]
+        return dataset, variable, ascending
+
+    def read_netcdf(self, file_path):
+        # reads the whole netCDF output into the flat days x cells layout of the binaries
+        dataset, variable, ascending = self.open_netcdf(file_path)
+        try:
+            data = numpy.asarray(variable[:], dtype=numpy.float32)
+        finally:
+            dataset.close()
+        if ascending:
+            data = data[:, ::-1, :]
+        return numpy.ascontiguousarray(data).ravel()
+
+    def read_netcdf_values(self, file_path, indices):
+        """Reads the time series of every touched cell with one [:, y, x] slice, so only the chunks of these cells
+        are read and decompressed
+        """
+        dataset, variable, ascending = self.open_netcdf(file_path)
+        try:
+            days, rows, cols = variable.shape
+            indices = numpy.asarray(indices, dtype=numpy.int64)
+            # negative indices count from the end, as on the flat grid array
+            indices = numpy.where(indices < 0, indices + days * rows * cols, indices)
+            day = indices // (rows * cols)
+            cell = indices % (rows * cols)
+            values = numpy.empty(indices.shape, dtype=numpy.float32)
+            for this_cell in numpy.unique(cell):
+                selected = cell == this_cell
+                row = this_cell // cols
+                if ascending:
+                    row = rows - 1 - row
+                series = numpy.asarray(variable[:, int(row), int(this_cell % cols)], dtype=numpy.float32)
+                values[selected] = series[day[selected]]
+        finally:
+            dataset.close()
+        return values
+
+    def read_binary(self, file_path):
+        if file_path.endswith(NETCDF_EXTENSION):
+            with metrics.timed("cama_file_read_seconds", {"reader": "netcdf"}):
+                return self.read_netcdf(file_path)
+        if file_path.endswith(VECTOR_EXTENSION):
+            with metrics.timed("cama_file_read_seconds", {"reader": "vector"}):
+                return self.read_vector(file_path)
+        if cama_archive.is_archive(file_path):
+            with metrics.timed("cama_file_read_seconds", {"reader": "archive"}):
+                return cama_archive.read_all(file_path)
+        with metrics.timed("cama_file_read_seconds", {"reader": "memmap"}):
+            # copy-on-write map: pages are read lazily and the callers may still zero out values in place
+            data = numpy.asarray(numpy.memmap(file_path, dtype=numpy.float32, mode="c"))
+        return data
+
+    def read_values(self, file_path, indices):
+        """Reads only the values at the given flat indices; archives decompress only the chunks holding them"""
+        if file_path.endswith(NETCDF_EXTENSION):
+            with metrics.timed("cama_file_read_seconds", {"reader": "netcdf"}):
+                return self.read_netcdf_values(file_path, indices)
+        if file_path.endswith(VECTOR_EXTENSION):
+            with metrics.timed("cama_file_read_seconds", {"reader": "vector"}):
+                return self.read_vector_values(file_path, indices)
+        if cama_archive.is_archive(file_path):
+            with metrics.timed("cama_file_read_seconds", {"reader": "archive"}):
+                return cama_archive.read_values(file_path, indices)
+        with metrics.timed("cama_file_read_seconds", {"reader": "memmap"}):
+            return numpy.memmap(file_path, dtype=numpy.float32, mode="r")[indices]
+
+    def read_text(self, file_path, **kwargs):
+        return read_text(file_path, **kwargs)
+
+    def static_table(self, file_path, **kwargs):
+        return load_static_table(file_path, **kwargs)
+
+    def cell_index(self):
+        return load_cell_index(self.BASE_PATH)
+
+    def reservoir_cells(self):
+        return load_reservoir_cells(self.BASE_PATH)
+
+    def preload_static(self):
+        return preload_static(self.BASE_PATH)
+
     def init_matrix(self, rows, cols, init_val):
         # noinspection PyUnusedLocal
         return [[init_val for i in range(cols)] for j in range(rows)]
@@ -95,9 +428,10 @@ class CamaConvert:
         if p_lon == 0:
             p_lon = self.LON
 
-        lat_baseline = 34.95
-        lon_baseline = 104.05
-        return math.floor((lat_baseline - p_lat) * 10) * 90 + math.floor(((lon_baseline + p_lon) * 10) + 1)
+        return int(self.coords_to_grid_cells(float(p_lat), float(p_lon))[0])
+
+    def coords_to_grid_cells(self, lats, lons):
+        return coords_to_grid_cells(self.BASE_PATH, lats, lons)
 
     def veg_to_manning(self, veg_type=""):
         veg_type = veg_type.lower()
@@ -112,7 +446,12 @@ class CamaConvert:
         else:
             return None  # not a recognized type of vegetation
 
-    def update_manning(self, p_lat, p_lon, p_riv_base, p_riv_new, p_fld_base, p_fld_new, size_wetland):
+    def update_manning(self, p_lat, p_lon, p_riv_base, p_riv_new, p_fld_base, p_fld_new, size_wetland, map_name="hamid",
+                       sites=None):
+        """Writes the Manning coefficients and the floodplain heights of the restored wetlands into the map. sites is a
+        list of {"lat", "lon", "riv_new", "fld_new", "size_wetland"}; when it is given the single wetland arguments are
+        ignored and all the sites are written in one pass
+        """
 
         # Check if map/hamid folder had been duplicated
         if not os.path.exists(os.path.join(self.BASE_PATH, "map", "hamid_copy")):
@@ -121,65 +460,58 @@ class CamaConvert:
             process = subprocess.Popen(command, shell=True)
             process.wait()
 
-        cell = self.coord_to_grid_cell(p_lat, p_lon) - 1  # must offset by 1; this is very sensitive in the raw binary
+        single_wetland = sites is None
+        if single_wetland:
+            sites = [{"lat": p_lat, "lon": p_lon, "riv_new": p_riv_new, "fld_new": p_fld_new, "size_wetland": size_wetland}]
+        # must offset by 1; this is very sensitive in the raw binary
+        lats = numpy.asarray([float(site["lat"]) for site in sites])
+        lons = numpy.asarray([float(site["lon"]) for site in sites])
+        cells = self.coords_to_grid_cells(lats, lons) - 1
         # 1) we pull the number of indices from the river height file
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "rivhgt.bin")
-        file = open(file_path, "r")
-        index_count = len(numpy.fromfile(file, dtype=numpy.float32))
-        file.close()
+        file_path = os.path.join(self.BASE_PATH, "map", map_name, "rivhgt.bin")
+        index_count = len(self.read_binary(file_path))
         # 2) we set all the values to a new base value
         new_riv = numpy.full((index_count, 1), p_riv_base, dtype=numpy.float32)
-        # 3) set the specific grid cell to a value double the baseline (?)
-        new_riv[cell] = p_riv_new
+        # 3) set the cells of the wetlands to their own coefficients; a later site wins on a shared cell
+        new_riv[cells, 0] = [float(site["riv_new"]) for site in sites]
         # 4) save that to the 'river manning' file
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "rivman.bin")
+        file_path = os.path.join(self.BASE_PATH, "map", map_name, "rivman.bin")
         new_riv.tofile(file_path)
         # 5) set all values to a different, new base value
         new_fld = numpy.full((index_count, 1), p_fld_base, dtype=numpy.float32)
-        # 6) set the specific grid cell to yet another specified manning coefficient
-        new_fld[cell] = p_fld_new
+        # 6) set the cells of the wetlands to yet another specified manning coefficient
+        new_fld[cells, 0] = [float(site["fld_new"]) for site in sites]
         # 7) save that as the 'floodplain manning' file
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "fldman.bin")
+        file_path = os.path.join(self.BASE_PATH, "map", map_name, "fldman.bin")
         new_fld.tofile(file_path)
-        # 8) update the fldhgt.bin
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "lonlat")
-        lon_lat_1 = numpy.loadtxt(file_path, usecols=range(2))
-        lon_lat = lon_lat_1
-
-        for i in range(9):
-            lon_lat = numpy.vstack([lon_lat_1, lon_lat])
-
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "fldhgt_original.bin")
-        file = open(file_path, "r")
-        fldhgt_original = numpy.fromfile(file, dtype=numpy.float32)
-        file.close()
-
-        lon_lat = numpy.insert(lon_lat, 2, fldhgt_original[0: lon_lat.shape[0]], axis=1)
-        lon_lat_4 = lon_lat
-
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "wetland_loc_multiple")
-        lon_lat_5 = numpy.loadtxt(file_path, usecols=range(2))
-
-        for k in range(3, 4):
-            lon_5 = lon_lat_5[k, 1]
-            lat_5 = lon_lat_5[k, 0]
-
-            lon_lat_2 = lon_lat_1[:, 0:2]
-            lon_lat_2 = numpy.insert(lon_lat_2, 2, 0, axis=1)
-
-            for j in range(0, lon_lat_2.shape[0]):
-                lon = lon_lat_2[j, 0]
-                lat = lon_lat_2[j, 1]
-                lon_lat_2[j, 2] = self.pos2dis(lat_5, lon_5, lat, lon)
-
-            lon_lat_3 = lon_lat_2[lon_lat_2[:, 2].argsort()]
-
-            location = numpy.where((lon_lat[:, 0] == lon_lat_3[0, 0]) & (lon_lat[:, 1] == lon_lat_3[0, 1]))
-            lon_lat_4[location[0: size_wetland + 1], 2] = lon_lat[location[0: size_wetland + 1], 2] - 1.5
-
-        file_path = os.path.join(self.BASE_PATH, "map", "hamid", "fldhgt.bin")
+        # 8) update the fldhgt.bin: the floodplain layers of the wetland cells are lowered by 1.5
+        # the scenario maps are copies of the hamid map, they share its lonlat and index
+        index = self.cell_index()
+        row_count = len(index.VECTORS)
+        layers = self.grid().NLFP
+        file_path = os.path.join(self.BASE_PATH, "map", map_name, "fldhgt_original.bin")
+        fldhgt = numpy.asarray(self.read_binary(file_path)[0:layers * row_count], dtype=numpy.float64)
+
+        if single_wetland:
+            # a single wetland keeps the historic depression: the cell nearest to row 3 of wetland_loc_multiple, on
+            # every layer (size_wetland never narrowed it)
+            file_path = os.path.join(self.BASE_PATH, "map", map_name, "wetland_loc_multiple")
+            wetland_loc = self.read_text(file_path, usecols=range(2))
+            rows = index.nearest_many(wetland_loc[3, 0], wetland_loc[3, 1])
+            depths = numpy.asarray([layers])
+        else:
+            # every site lowers the first size_wetland + 1 layers of its own cell
+            rows = index.nearest_many(lats, lons)
+            depths = numpy.asarray([min(int(site["size_wetland"]) + 1, layers) for site in sites])
+        # deepest depression per lonlat row, so that sites sharing a cell lower it once
+        row_depths = numpy.zeros(row_count, dtype=numpy.int64)
+        numpy.maximum.at(row_depths, rows, depths)
+        lowered = numpy.arange(layers)[:, None] < row_depths[None, :]
+        fldhgt[lowered.ravel()] -= 1.5
+
+        file_path = os.path.join(self.BASE_PATH, "map", map_name, "fldhgt.bin")
         with open(file_path, "w") as fp:
-            lon_lat_4[:, 2].astype("float32").tofile(fp)
+            fldhgt.astype("float32").tofile(fp)
             fp.close()
 
     def delta_max_q_y(self, p_cell=0):
@@ -190,17 +522,13 @@ class CamaConvert:
 
         grid_number = p_cell
         day_count = self.days_in_year(self.YEAR)
-        flow_denom = 90 * 61
 
-        raw_pre_input = numpy.fromfile(open(self.PRE_PATH, "r"), dtype=numpy.float32)
-        raw_post_input = numpy.fromfile(open(self.POST_PATH, "r"), dtype=numpy.float32)
-        pre_restore_flow = [0] * day_count
-        post_restore_flow = [0] * day_count
-        for day in range(day_count):
-            input_index = numpy.mod(grid_number, flow_denom) + (flow_denom * day)
-            pre_restore_flow[day] = raw_pre_input[input_index - 1]
-            post_restore_flow[day] = raw_post_input[input_index - 1]
+        input_index = self.flow_indices(grid_number, day_count)
+        pre_restore_flow = list(self.read_values(self.PRE_PATH, input_index))
+        post_restore_flow = list(self.read_values(self.POST_PATH, input_index))
+        return self.peak_flow_reduction(pre_restore_flow, post_restore_flow, day_count)
 
+    def peak_flow_reduction(self, pre_restore_flow, post_restore_flow, day_count):
         post_restore_flow_max = numpy.amax(post_restore_flow)
         # compute the difference between the results, in the week surrounding the annual peak
         max_index = post_restore_flow.index(post_restore_flow_max)
@@ -227,14 +555,14 @@ class CamaConvert:
 
         grid_number = p_cell
         day_count = self.days_in_year(self.YEAR)
-        flow_denom = 90 * 61
         # let's measure the pre-restoration base flow
-        raw_input = numpy.fromfile(open(self.PRE_PATH, "r"), dtype=numpy.float32)
-        pre_restore_flow = [0] * day_count
+        input_index = self.flow_indices(grid_number, day_count)
+        pre_restore_flow = list(self.read_values(self.PRE_PATH, input_index))
+        post_restore_flow = list(self.read_values(self.POST_PATH, input_index))
+        return self.base_flow_change(pre_restore_flow, post_restore_flow, day_count)
+
+    def base_flow_change(self, pre_restore_flow, post_restore_flow, day_count):
         weekly_flow = [0] * (day_count - 6)
-        for day in range(day_count):
-            input_index = numpy.mod(grid_number, flow_denom) + (flow_denom * day)
-            pre_restore_flow[day] = raw_input[input_index - 1]
 
         for day in range(day_count - 6):
             weekly_flow[day] = sum(pre_restore_flow[day:day + 6])
@@ -242,12 +570,7 @@ class CamaConvert:
         pre_avg_min = numpy.average(weekly_flow[week_start:week_start + 6])
 
         # now we measure the post-restoration base flow (which we expect to have risen)
-        raw_input = numpy.fromfile(open(self.POST_PATH, "r"), dtype=numpy.float32)
-        post_restore_flow = [0] * day_count
         weekly_flow = [0] * (day_count - 6)
-        for day in range(day_count):
-            input_index = numpy.mod(grid_number, flow_denom) + (flow_denom * day)
-            post_restore_flow[day] = raw_input[input_index - 1]
 
         for day in range(day_count - 6):
             weekly_flow[day] = sum(post_restore_flow[day:day + 6])
@@ -256,6 +579,111 @@ class CamaConvert:
 
         return post_avg_min - pre_avg_min
 
+    def river_profile(self):
+        """Summarizes the pre and post hydrographs of every cell from the wetland down to the river mouth; each file is
+        read with one gather over all the cells of the path
+        """
+        if not str(self.YEAR).isdigit():
+            raise ValueError("No configuration available for this conversion; use 'set_configuration'.")
+        grid = self.grid()
+        path = self.downstream_path(self.coord_to_grid_cell())
+        day_count = self.days_in_year(self.YEAR)
+        indices = grid.gather_indices(path, day_count)
+        pre_flow = self.read_values(self.PRE_PATH, indices).reshape(day_count, len(path))
+        post_flow = self.read_values(self.POST_PATH, indices).reshape(day_count, len(path))
+        # ensure that all overly-large values are zeroed out
+        pre_flow = numpy.where(pre_flow > 100000, 0, pre_flow)
+        post_flow = numpy.where(post_flow > 100000, 0, post_flow)
+
+        profile = []
+        for k in range(len(path)):
+            pre_restore_flow = list(pre_flow[:, k])
+            post_restore_flow = list(post_flow[:, k])
+            lat, lon = grid.cell_center(path[k])
+            profile.append({"grid_cell": path[k], "lat": lat, "lon": lon,
+                            "pre_peak": float(max(pre_restore_flow)), "post_peak": float(max(post_restore_flow)),
+                            "peak_delta": float(self.peak_flow_reduction(pre_restore_flow, post_restore_flow, day_count)),
+                            "base_flow_delta": float(self.base_flow_change(pre_restore_flow, post_restore_flow, day_count))})
+        return profile
+
+    def year_summary(self, year, pre_path, post_path, grid_cells):
+        """Pre vs post metrics of one year at the wetland cell, plus the peak reduction at the outlet, reservoir and
+        mouth cells as in plot_hydrograph_deltas; each file is read with one gather over the four cells
+        """
+        day_count = self.days_in_year(year)
+        indices = self.grid().gather_indices(grid_cells, day_count)
+        pre_flow = self.read_values(pre_path, indices).reshape(day_count, len(grid_cells))
+        post_flow = self.read_values(post_path, indices).reshape(day_count, len(grid_cells))
+        # ensure that all overly-large values are zeroed out
+        pre_flow = numpy.where(pre_flow > 100000, 0, pre_flow)
+        post_flow = numpy.where(post_flow > 100000, 0, post_flow)
+
+        pre_restore_flow = list(pre_flow[:, 0])
+        post_restore_flow = list(post_flow[:, 0])
+        summary = {"year": year, "pre_peak": float(max(pre_restore_flow)), "post_peak": float(max(post_restore_flow)),
+                   "peak_delta": float(self.peak_flow_reduction(pre_restore_flow, post_restore_flow, day_count)),
+                   "base_flow_delta": float(self.base_flow_change(pre_restore_flow, post_restore_flow, day_count)),
+                   "peak_shift_days": int(numpy.argmax(post_flow[:, 0])) - int(numpy.argmax(pre_flow[:, 0]))}
+        for k, site in enumerate(["outlet", "reservoir", "mouth"], 1):
+            delta = self.peak_flow_reduction(list(pre_flow[:, k]), list(post_flow[:, k]), day_count)
+            summary[site + "_delta"] = float(delta) * 3600 * 24
+        return summary
+
+    def summary_pool(self):
+        global SUMMARY_POOL
+        with SUMMARY_POOL_LOCK:
+            if SUMMARY_POOL is None:
+                SUMMARY_POOL = ProcessPoolExecutor(max_workers=self.SUMMARY_WORKERS)
+        return SUMMARY_POOL
+
+    def compare_years(self, pre_folder, post_folder, start_year, end_year, p_lat, p_lon):
+        """Per-year summary of a post-restoration folder against a pre-restoration one at a wetland. The years are
+        computed in parallel by the summary pool, each downloading its two outflw files once for all the metrics
+        """
+        global SUMMARY_POOL
+        start_year = int(start_year)
+        end_year = int(end_year)
+        if start_year > end_year:
+            raise Exception("start_year is after end_year")
+        if end_year - start_year + 1 > MAX_SUMMARY_YEARS:
+            raise Exception("At most " + str(MAX_SUMMARY_YEARS) + " years per summary")
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        formats = dict()
+        for folder_name in [pre_folder, post_folder]:
+            folder = folder_collection.find_one({"folder_name": folder_name}, {"format": 1})
+            if folder is None:
+                raise Exception("Record doesn't exist: " + folder_name)
+            formats[folder_name] = folder.get("format")
+        self.LAT = float(p_lat)
+        self.LON = float(p_lon)
+        grid_cells = [int(self.coord_to_grid_cell(self.LAT, self.LON)), int(self.grid_cell_of_wetlands_outlet()),
+                      int(self.grid_cell_of_reservoir()), int(self.grid_cell_of_river_mouth())]
+
+        pool = self.summary_pool()
+        futures = []
+        try:
+            for year in range(start_year, end_year + 1):
+                file_name = "outflw" + str(year) + ".bin"
+                futures.append(pool.submit(summarize_year, year, pre_folder, self.output_file_name(formats[pre_folder], file_name),
+                                           post_folder, self.output_file_name(formats[post_folder], file_name), grid_cells))
+            per_year = [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            # a killed pool process breaks the pool for good, the next request starts a new one
+            with SUMMARY_POOL_LOCK:
+                if SUMMARY_POOL is pool:
+                    SUMMARY_POOL = None
+            raise e
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            raise e
+        summary = {"pre_folder": pre_folder, "post_folder": post_folder, "grid_cell": grid_cells[0], "per_year": per_year}
+        if len(per_year) > 0:
+            summary["mean_peak_delta"] = sum(year["peak_delta"] for year in per_year) / len(per_year)
+            summary["mean_base_flow_delta"] = sum(year["base_flow_delta"] for year in per_year) / len(per_year)
+            summary["mean_peak_shift_days"] = sum(year["peak_shift_days"] for year in per_year) / len(per_year)
+        return summary
+
     def plot_hydrograph_from_wetlands(self):
         grid_cell = self.coord_to_grid_cell()
         # plot the data after transforming it
@@ -263,39 +691,34 @@ class CamaConvert:
         line2 = self.map_input_to_flow(self.POST_PATH, grid_cell, 0, True)
         return line1, line2
 
+    def flow_indices(self, grid_cell, day_count):
+        return self.grid().flow_indices(grid_cell, day_count)
+
     def map_input_to_flow(self, file_path, grid_cell, p_year=0, p_clean=False):
-        raw_input = numpy.fromfile(open(file_path, "r"), dtype=numpy.float32)
         if p_year == 0:
             p_year = self.YEAR
+        year_days = self.days_in_year(p_year)
+        flow = numpy.array(self.read_values(file_path, self.flow_indices(grid_cell, year_days)))
         if p_clean:
             # ensure that all overly-large values are zeroed out
-            for i in range(len(raw_input)):
-                if raw_input[i] > 100000:
-                    raw_input[i] = 0
-
-        year_days = self.days_in_year(p_year)
-        flow = []
-        k = 0
-        for i in range(year_days):
-            k += 1
-            idx = (grid_cell % (90 * 61)) + (90 * 61 * i) - 1
-            flow.append(raw_input[idx].item())
-        return flow
+            flow[flow > 100000] = 0
+        return flow.tolist()
 
     def build_flow_grids(self):
         # load ancillary data, including reservoir locations and mappings
         file_path = os.path.join(self.BASE_PATH, "res", "nextxy.txt")
-        next_xy_raw = numpy.loadtxt(file_path, usecols=range(2))
+        next_xy_raw = self.static_table(file_path, usecols=range(2))
         next_xx = next_xy_raw[:, 0]
         next_yy = next_xy_raw[:, 1]
+        grid = self.grid()
         # divvy up the next_xx and next_yy arrays into columns
         # noinspection PyUnusedLocal
-        self.LAT_MAT = [[0 for i in range(90)] for j in range(61)]
+        self.LAT_MAT = [[0 for i in range(grid.NX)] for j in range(grid.NY)]
         # noinspection PyUnusedLocal
-        self.LON_MAT = [[0 for i in range(90)] for j in range(61)]
-        for ctr in range(1, 62):
-            first = ((ctr - 1) * 90) + 1
-            second = (ctr * 90)
+        self.LON_MAT = [[0 for i in range(grid.NX)] for j in range(grid.NY)]
+        for ctr in range(1, grid.NY + 1):
+            first = ((ctr - 1) * grid.NX) + 1
+            second = (ctr * grid.NX)
             self.LON_MAT[ctr - 1] = next_xx[first - 1:second - 1]
             self.LAT_MAT[ctr - 1] = next_yy[first - 1:second - 1]
 
@@ -311,9 +734,10 @@ class CamaConvert:
             self.build_flow_grids()  # we haven't cached the flow grids yet
 
         # find the wetlands outlet, and use that to calculate the offset
-        xx_temp = int(coord_offset % 90) + 1
-        yy_temp = math.floor(coord_offset / 90) + 1
-        candidate = int(xx_temp + (yy_temp * 90)) + 1
+        nx = self.grid().NX
+        xx_temp = int(coord_offset % nx) + 1
+        yy_temp = math.floor(coord_offset / nx) + 1
+        candidate = int(xx_temp + (yy_temp * nx)) + 1
         return candidate  # and now we finally have a grid_offset that we can use in our main function
 
     def grid_cell_of_river_mouth(self, p_lat=0.0, p_lon=0.0):
@@ -328,12 +752,13 @@ class CamaConvert:
             self.build_flow_grids()  # we haven't cached the flow grids yet
 
         # find the nearest reservoir, and use that to calculate the offset
-        xx_temp = int(coord_offset % 90) + 1
-        yy_temp = math.floor(coord_offset / 90) + 1
+        nx = self.grid().NX
+        xx_temp = int(coord_offset % nx) + 1
+        yy_temp = math.floor(coord_offset / nx) + 1
         found_mouth = False
         candidate = 0
         while not found_mouth:
-            candidate = xx_temp + ((yy_temp - 1) * 90)
+            candidate = xx_temp + ((yy_temp - 1) * nx)
             results = (int(self.LON_MAT[yy_temp - 1][xx_temp - 1]), int(self.LAT_MAT[yy_temp - 1][xx_temp - 1]))
             xx_temp = results[0]
             yy_temp = results[1]
@@ -350,23 +775,19 @@ class CamaConvert:
 
         coord_offset = self.coord_to_grid_cell(p_lat, p_lon)
 
-        # note: reservoir locations are [lon,lat], in contradiction of ISO 6709
-        file_path = os.path.join(self.BASE_PATH, "res", "Reservoir_xy.txt")
-        reservoir_raw = numpy.loadtxt(file_path, usecols=range(2))
-        reservoir_offset = []
-        for row in range(len(reservoir_raw)):
-            reservoir_offset.append(self.coord_to_grid_cell(reservoir_raw[row][1], reservoir_raw[row][0]))
+        reservoir_offset = self.reservoir_cells()
 
         if len(self.LAT_MAT) == 1 | len(self.LON_MAT) == 1:
             self.build_flow_grids()  # we haven't cached the flow grids yet
 
         # find the nearest reservoir, and use that to calculate the offset
-        xx_temp = int(coord_offset % 90) + 1
-        yy_temp = math.floor(coord_offset / 90) + 1
+        nx = self.grid().NX
+        xx_temp = int(coord_offset % nx) + 1
+        yy_temp = math.floor(coord_offset / nx) + 1
         found_reservoir = False
         candidate = 0
         while not found_reservoir:
-            candidate = xx_temp + ((yy_temp - 1) * 90)
+            candidate = xx_temp + ((yy_temp - 1) * nx)
             if candidate not in reservoir_offset:
                 results = (int(self.LON_MAT[yy_temp - 1][xx_temp - 1]), int(self.LAT_MAT[yy_temp - 1][xx_temp - 1]))
                 xx_temp = results[0]
@@ -388,14 +809,42 @@ class CamaConvert:
 
     def delta_max_all(self):
         # run three times to compare:
-        line1 = self.delta_max_q_y(self.grid_cell_of_wetlands_outlet()) * 3600 * 24  # 1) the wetlands outlet
-        line2 = self.delta_max_q_y(self.grid_cell_of_reservoir()) * 3600 * 24  # 2) the nearest reservoir
-        line3 = self.delta_max_q_y(self.grid_cell_of_river_mouth()) * 3600 * 24  # 3) the river mouth
+        # as Python floats, json.dumps can't serialize the numpy float32 of the flows
+        line1 = float(self.delta_max_q_y(self.grid_cell_of_wetlands_outlet())) * 3600 * 24  # 1) the wetlands outlet
+        line2 = float(self.delta_max_q_y(self.grid_cell_of_reservoir())) * 3600 * 24  # 2) the nearest reservoir
+        line3 = float(self.delta_max_q_y(self.grid_cell_of_river_mouth())) * 3600 * 24  # 3) the river mouth
         return line1, line2, line3
 
-    def config_cama(self, model, s_year, e_year):
+    def validate_run_options(self, output_variables=None, threads=None):
+        """Returns the output variables and OpenMP thread count of a run, with the defaults filled in"""
+        if output_variables is None:
+            output_variables = DEFAULT_OUTPUT_VARIABLES
+        if not isinstance(output_variables, list) or len(output_variables) == 0:
+            raise ValueError("output_variables must be a non-empty list")
+        for variable in output_variables:
+            if variable not in OUTPUT_VARIABLES:
+                raise ValueError("Unknown output variable: " + str(variable) + ", expected one of " + ", ".join(sorted(OUTPUT_VARIABLES)))
+        if threads is None:
+            threads = min(DEFAULT_THREADS, os.cpu_count() or 1)
+        if not self.is_number(threads) or int(float(threads)) != float(threads):
+            raise ValueError("Expected integer, received: threads=" + str(threads))
+        threads = int(float(threads))
+        if threads < 1 or threads > (os.cpu_count() or 1):
+            raise ValueError("threads must be between 1 and " + str(os.cpu_count() or 1))
+        return sorted(set(output_variables)), threads
+
+    def script_path(self, model, run_name="hamid"):
+        if run_name == "hamid":
+            return os.path.join(self.BASE_PATH, "gosh", "hamid_<MODEL>.sh".replace("<MODEL>", model))
+        return os.path.join(self.BASE_PATH, "gosh", run_name + ".sh")
+
+    def config_cama(self, model, s_year, e_year, output_variables=None, threads=None, netcdf_output=False, run_name="hamid",
+                    folder_name="", restart=False, vector_output=False):
         # this function is for configuring the post-restoration ONLY
         # this is because all the pre-restoration results have been pre-computed
+        output_variables, threads = self.validate_run_options(output_variables, threads)
+        if netcdf_output and vector_output:
+            raise ValueError("netcdf_output and vector_output are exclusive")
         if e_year > 2011:
             e_year = 2011
         if s_year < 1916:
@@ -408,7 +857,19 @@ class CamaConvert:
                 file.close()
             cama_config = cama_config.replace("<SYEAR>", str(s_year))
             cama_config = cama_config.replace("<EYEAR>", str(e_year))
-            file_path = os.path.join(self.BASE_PATH, "gosh", "hamid_<MODEL>.sh".replace("<MODEL>", model))
+            cama_config = cama_config.replace("<OMP_NUM_THREADS>", str(threads))
+            # a restarted run reads restart<SYEAR>0101.bin from the run directory and skips the spin-up
+            cama_config = cama_config.replace("<SPINUP>", "1" if restart else "2")
+            # the run name selects the map and output directories, the folder name the record updated by the script
+            cama_config = cama_config.replace("<RUN>", run_name)
+            cama_config = cama_config.replace("<FOLDER_NAME>", str(folder_name))
+            # the plain 2-D binaries by default, netCDF or land-only vector binaries when the run asks for them
+            cama_config = cama_config.replace("<LOUTCDF>", ".TRUE." if netcdf_output else ".FALSE.")
+            cama_config = cama_config.replace("<LOUTVEC>", ".TRUE." if vector_output else ".FALSE.")
+            # the variables that are not selected are set to "NONE", so CaMa neither writes nor uploads them
+            for variable, setting in OUTPUT_VARIABLES.items():
+                cama_config = cama_config.replace("<" + setting + ">", "$COUTDIR" if variable in output_variables else "NONE")
+            file_path = self.script_path(model, run_name)
             with open(file_path, "w") as file:
                 file.write(cama_config)
                 file.close()
@@ -441,9 +902,8 @@ class CamaConvert:
         # for each year in the range
         year_peaks = [0] * 97
         for i in range(1916, 2011):
-            # Downloading the file from dropbox
-            self.DROPBOX.download_file(folder_name, "outflw" + str(i) + ".bin", self.TMP_FOLDER)
-            output_file = os.path.join(os.getcwd(), self.TMP_FOLDER, folder_name, "outflw" + str(i) + ".bin")
+            # Fetching the file from the storage
+            output_file = self.fetch_output(folder_name, "outflw" + str(i) + ".bin")
             year_flow = self.map_input_to_flow(output_file, grid_cell, i, False)
             year_peaks[i - 1916] = max(year_flow)
 
@@ -465,19 +925,89 @@ class CamaConvert:
                 min_val = this_flow
         return min_year
 
-    def run_cama_pre(self, s_year, e_year, folder_name):
+    def build_climatology(self, folder_name, variable="outflw"):
+        """Streams every yearly output of a completed folder once and uploads its daily climatology (mean and percentiles
+        per cell and day of year) to the same folder"""
+        if variable not in OUTPUT_VARIABLES:
+            raise ValueError("Unknown output variable: " + str(variable))
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        folder = folder_collection.find_one({"folder_name": folder_name})
+        if folder is None:
+            raise Exception("Record doesn't exist")
+        if folder["status"] != "completed":
+            raise Exception("The climatology needs a completed run")
+        metadata = folder.get("metadata", {})
+        years = range(max(int(metadata.get("start_year", 1916)), 1916), min(int(metadata.get("end_year", 2010)), 2011) + 1)
+
+        cells = self.grid().cells
+        if cells > self.MAX_CLIMATOLOGY_CELLS:
+            raise ValueError("The climatology of the " + str(cells) + " cells of the map needs " +
+                             str(cells * climatology.BYTES_PER_CELL // 2 ** 20) + " MB, the limit is " +
+                             str(self.MAX_CLIMATOLOGY_CELLS) + " cells (MAX_CLIMATOLOGY_CELLS)")
+        sketch = climatology.ClimatologySketch(cells)
+        for year in years:
+            output_file = self.fetch_output(folder_name, variable + str(year) + ".bin")
+            sketch.add_year(year, self.read_binary(output_file))
+        # one days x cells block per statistic, so the band of a cell is a single gather as in flow_indices
+        tmp_dir = os.path.join(os.getcwd(), self.TMP_FOLDER)
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+        file_name = "climatology_" + variable + ".bin"
+        file_path = os.path.join(tmp_dir, file_name)
+        sketch.statistics().tofile(file_path)
+        self.STORAGE.upload_file(file_path, folder_name, file_name)
+        summary = {"file": file_name, "years": [years[0], years[-1]], "statistics": climatology.STATISTICS}
+        folder_collection.update_one({"_id": folder["_id"]}, {"$set": {"climatology." + variable: summary}})
+        return summary
+
+    def climatology_bands(self, folder_name, p_lat, p_lon, year=None, variable="outflw"):
+        """Returns the daily climatology of the cell, and the flow of the given year on the same days"""
+        folder = self.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": folder_name})
+        if folder is None:
+            raise Exception("Record doesn't exist")
+        if variable not in folder.get("climatology", {}):
+            raise Exception("No climatology for " + variable + " in this folder, build it with /climatology/build")
+        summary = folder["climatology"][variable]
+        file_path = self.STORAGE.download_file(folder_name, summary["file"], self.TMP_FOLDER)
+        grid = self.grid()
+        grid_cell = self.coord_to_grid_cell(float(p_lat), float(p_lon))
+        statistic_count = len(climatology.STATISTICS)
+        indices = (numpy.arange(statistic_count)[:, None] * climatology.DAYS * grid.cells +
+                   self.flow_indices(grid_cell, climatology.DAYS)[None, :]).ravel()
+        bands = self.read_values(file_path, indices).reshape(statistic_count, climatology.DAYS)
+
+        year_flow = [None] * climatology.DAYS
+        if year is not None:
+            year = int(year)
+            output_file = self.fetch_output(folder_name, variable + str(year) + ".bin")
+            flow = self.map_input_to_flow(output_file, grid_cell, year, True)
+            for day, value in zip(climatology.day_of_year(year, len(flow)), flow):
+                year_flow[day] = float(value)
+        days = []
+        for day in range(climatology.DAYS):
+            # the days of the year are labelled as in a leap year
+            date = datetime.date(2000, 1, 1) + datetime.timedelta(days=day)
+            values = [None if numpy.isnan(value) else float(value) for value in bands[:, day]]
+            days.append([date.month, date.day] + values + [year_flow[day]])
+        return {"grid_cell": grid_cell, "years": summary["years"], "year": year,
+                "columns": ["month", "day"] + climatology.STATISTICS + ["year_flow"], "days": days}
+
+    def run_cama_pre(self, s_year, e_year, folder_name, output_variables=None, threads=None, netcdf_output=False,
+                     vector_output=False):
+        output_variables, threads = self.validate_run_options(output_variables, threads)
+        # Claim the run slot, atomically so that two requests can't both start the model
+        slot = db_connect.claim_run_slot(self.MONGO_CLIENT)
+        if slot is None:
+            return "Model is in execution, please retry after sometime"
         try:
             folder_collection = self.MONGO_CLIENT["output"]["folder"]
-            # Check if there is no existing model running
-            running_record = folder_collection.find_one({"status": "running"})
-            if running_record is not None:
-                return "Model is in execution, please retry after sometime"
-            # Check if there exist no such document with the folder_name in the DB and in dropbox
+            # Check if there exist no such document with the folder_name in the DB and in the storage
             record = folder_collection.find_one({"folder_name": folder_name})
             if record is not None:
                 raise Exception("folder_name is not unique. There exist a record with same folder_name")
 
-            metadata = {"start_year": s_year, "end_year": e_year}
+            metadata = {"start_year": s_year, "end_year": e_year, "output_variables": output_variables, "threads": threads,
+                        "netcdf_output": netcdf_output, "vector_output": vector_output}
             new_record = dict({"model": "preflow", "status": "running", "folder_name": folder_name, "metadata": metadata})
             # Inserting the record in MongoDB
             record_id = folder_collection.insert_one(new_record).inserted_id
@@ -487,14 +1017,16 @@ class CamaConvert:
 
             # Updating the folder_name of the new_record
             folder_collection.update({"_id": record_id}, {"$set": {"folder_name": folder_name}})
-            # Creating a folder for the record in Dropbox
-            self.DROPBOX.create_folder(folder_name)
+            # Creating a folder for the record in the storage
+            self.STORAGE.create_folder(folder_name)
             # Config the cama to run from s_year to e_year
-            self.config_cama("pre", s_year, e_year)
+            self.config_cama("pre", s_year, e_year, output_variables, threads, netcdf_output, folder_name=folder_name,
+                             vector_output=vector_output)
             # Starting the execution of the model
             subprocess.Popen("sudo " + self.BASE_PATH + "/gosh/hamid_pre.sh", shell=True)
             print("Cama in execution")
         except Exception as e:
+            db_connect.release_run_slot(self.MONGO_CLIENT, slot)
             self.handle_cama_exception(folder_name, )
             raise e
         return "Execution queued"
@@ -510,18 +1042,26 @@ class CamaConvert:
         try:
             folder_collection = self.MONGO_CLIENT["output"]["folder"]
             folder_collection.delete_one({"folder_name": folder_name})
-            self.DROPBOX.delete_folder(folder_name)
+            self.STORAGE.delete_folder(folder_name)
 
         except Exception as e:
             raise e
 
-    def run_cama_post(self, start_year, end_year, p_lat, p_lon, p_riv_base, p_riv_new, p_fld_base, p_fld_new, size_wetland, folder_name):
+    def run_cama_post(self, start_year, end_year, p_lat, p_lon, p_riv_base, p_riv_new, p_fld_base, p_fld_new, size_wetland, folder_name,
+                      output_variables=None, threads=None, netcdf_output=False, sites=None, vector_output=False):
+        output_variables, threads = self.validate_run_options(output_variables, threads)
+        if sites is not None:
+            # a portfolio of wetlands restored in the same run; the single wetland keys hold the first site
+            if len(sites) == 0:
+                raise ValueError("sites must list at least one wetland")
+            sites = [{key: site[key] for key in SITE_KEYS} for site in sites]
+            p_lat, p_lon, p_riv_new, p_fld_new, size_wetland = [sites[0][key] for key in SITE_KEYS]
+        # Claim the run slot, atomically so that two requests can't both start the model
+        slot = db_connect.claim_run_slot(self.MONGO_CLIENT)
+        if slot is None:
+            return "Model is in execution, please retry after sometime"
         try:
             folder_collection = self.MONGO_CLIENT["output"]["folder"]
-            # Check if the model is in execution
-            running_record = folder_collection.find_one({"status": "running"})
-            if running_record is not None:
-                return "Model is in execution, please retry after sometime"
             # Check if the folder_name is unique
             if folder_name is not None:
                 record = folder_collection.find_one({"folder_name": folder_name})
@@ -529,7 +1069,11 @@ class CamaConvert:
                     raise Exception("folder_name is not unique. There exist a record with same folder_name")
 
             metadata = {"p_lat": p_lat, "p_lon": p_lon, "p_riv_base": p_riv_base, "p_riv_new": p_riv_new, "p_fld_base": p_fld_base,
-                        "p_fld_new": p_fld_new, "size_wetland": size_wetland, "start_year": start_year, "end_year": end_year}
+                        "p_fld_new": p_fld_new, "size_wetland": size_wetland, "start_year": start_year, "end_year": end_year,
+                        "output_variables": output_variables, "threads": threads, "netcdf_output": netcdf_output,
+                        "vector_output": vector_output}
+            if sites is not None:
+                metadata["sites"] = sites
             # Inserting the record in MongoDB
             new_record = dict({"model": "postflow", "status": "running", "metadata": metadata})
             # Use record_id as the folder_name if its None
@@ -539,22 +1083,236 @@ class CamaConvert:
 
             # Updating the folder_name of the new_record
             folder_collection.update({"_id": record_id}, {"$set": {"folder_name": folder_name}})
-            # Creating the folder for the record in Dropbox
-            self.DROPBOX.create_folder(folder_name)
+            # Creating the folder for the record in the storage
+            self.STORAGE.create_folder(folder_name)
             # Config the Cama to run from s_year to e_year
-            self.config_cama("post", start_year, end_year)
-            # Update the wetland in the map
-            self.update_manning(p_lat, p_lon, p_riv_base, p_riv_new, p_fld_base, p_fld_new, size_wetland)
+            self.config_cama("post", start_year, end_year, output_variables, threads, netcdf_output, folder_name=folder_name,
+                             vector_output=vector_output)
+            # Update the wetlands in the map
+            self.update_manning(p_lat, p_lon, p_riv_base, p_riv_new, p_fld_base, p_fld_new, size_wetland, sites=sites)
             # Starting the execution of the model
             subprocess.Popen("sudo " + self.BASE_PATH + "/gosh/hamid_post.sh", shell=True)
 
         except Exception as e:
+            db_connect.release_run_slot(self.MONGO_CLIENT, slot)
             self.handle_cama_exception(folder_name)
             self.reset_map_directory()
             raise e
 
         return "Execution queued"
 
+    def extend_cama_post(self, folder_name, end_year):
+        """Simulates the years after the end of a completed post-restoration run, starting from its last restart file, and
+        appends them to the same output folder"""
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        folder = folder_collection.find_one({"folder_name": folder_name})
+        if folder is None:
+            raise Exception("Record doesn't exist")
+        if folder["model"] != "postflow" or folder["status"] != "completed":
+            raise Exception("Only completed post-restoration runs can be extended")
+        metadata = folder["metadata"]
+        # the added years must be uploaded in the layout of the years already in the folder
+        folder_format = folder.get("format", "bin")
+        if folder_format not in EXTENSIBLE_FORMATS:
+            raise Exception("Folders in the " + str(folder_format) + " format can't be extended")
+        resume_year = min(int(metadata["end_year"]), 2011) + 1
+        if not self.is_number(end_year) or int(end_year) < resume_year or int(end_year) > 2011:
+            raise ValueError("end_year must be between " + str(resume_year) + " and 2011")
+        end_year = int(end_year)
+        slot = db_connect.claim_run_slot(self.MONGO_CLIENT)
+        if slot is None:
+            return "Model is in execution, please retry after sometime"
+
+        try:
+            # CaMa writes restart<YEAR+1>0101.bin at the end of every year, and upload_output keeps it with the outputs
+            restart_name = "restart" + str(resume_year) + "0101.bin"
+            restart_path = self.STORAGE.download_file(folder_name, restart_name, self.TMP_FOLDER)
+            folder_collection.update_one({"_id": folder["_id"]}, {"$set": {"status": "running", "resume_year": resume_year,
+                                                                            "metadata.end_year": end_year},
+                                                                   "$unset": {"progress": ""}})
+            run_path = os.path.join(self.BASE_PATH, "out", "hamid")
+            if not os.path.exists(run_path):
+                os.makedirs(run_path)
+            shutil.copyfile(restart_path, os.path.join(run_path, restart_name))
+            self.config_cama("post", resume_year, end_year, metadata.get("output_variables"), metadata.get("threads"),
+                             folder_format == "netcdf", folder_name=folder_name, restart=True,
+                             vector_output=folder_format == "vector")
+            self.update_manning(metadata["p_lat"], metadata["p_lon"], metadata["p_riv_base"], metadata["p_riv_new"],
+                                metadata["p_fld_base"], metadata["p_fld_new"], metadata["size_wetland"], sites=metadata.get("sites"))
+            subprocess.Popen("sudo " + self.BASE_PATH + "/gosh/hamid_post.sh", shell=True)
+        except Exception as e:
+            # the years already uploaded stay valid, only the extension is rolled back
+            db_connect.release_run_slot(self.MONGO_CLIENT, slot)
+            folder_collection.update_one({"_id": folder["_id"]}, {"$set": {"status": "completed", "metadata.end_year": metadata["end_year"]},
+                                                                   "$unset": {"resume_year": ""}})
+            self.reset_map_directory()
+            raise e
+        return "Execution queued"
+
+    def run_cama_sweep(self, start_year, end_year, p_lat, p_lon, p_riv_base, p_fld_base, grid, core_budget=None, threads=None,
+                       output_variables=None, baseline_folder=None):
+        """Runs one post-restoration scenario per combination of the grid values, as concurrent CaMa processes"""
+        for key in SWEEP_KEYS:
+            if not isinstance(grid.get(key), list) or len(grid[key]) == 0:
+                raise ValueError("grid must give a non-empty list for " + key)
+            for value in grid[key]:
+                if not self.is_number(value):
+                    raise ValueError("Expected number, received: " + key + "=" + str(value))
+        combinations = list(itertools.product(*[grid[key] for key in SWEEP_KEYS]))
+        if len(combinations) > MAX_SWEEP_SCENARIOS:
+            raise ValueError("The grid gives " + str(len(combinations)) + " scenarios, the limit is " + str(MAX_SWEEP_SCENARIOS))
+        if threads is None:
+            threads = 1
+        output_variables, threads = self.validate_run_options(output_variables, threads)
+        if core_budget is None:
+            core_budget = os.cpu_count() or 1
+        if not self.is_number(core_budget) or int(float(core_budget)) < threads:
+            raise ValueError("core_budget must be a number of cores >= threads")
+        concurrency = max(int(float(core_budget)) // threads, 1)
+
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        sweep_collection = self.MONGO_CLIENT["output"]["sweep"]
+        slot = db_connect.claim_run_slot(self.MONGO_CLIENT)
+        if slot is None:
+            return {"message": "Model is in execution, please retry after sometime"}
+
+        sweep = {"status": "running", "grid": grid, "baseline_folder": baseline_folder, "concurrency": concurrency,
+                 "metadata": {"p_lat": p_lat, "p_lon": p_lon, "p_riv_base": p_riv_base, "p_fld_base": p_fld_base,
+                              "start_year": start_year, "end_year": end_year, "threads": threads,
+                              "output_variables": output_variables}}
+        sweep_id = str(sweep_collection.insert_one(sweep).inserted_id)
+        scenarios = []
+        # the scenarios whose map was copied, and the scripts written for them; the scripts are removed here unless
+        # the sweep script was started, which then removes them itself when it exits
+        runnable = []
+        scripts = []
+        launched = False
+        try:
+            for i in range(len(combinations)):
+                riv_new, fld_new, size_wetland = combinations[i]
+                # every scenario has its own map and output directories, named like its folder
+                folder_name = "sweep_" + sweep_id + "_" + str(i)
+                # written as a one-site portfolio, so that size_wetland sets the depth of the depression
+                sites = [{"lat": p_lat, "lon": p_lon, "riv_new": riv_new, "fld_new": fld_new, "size_wetland": int(size_wetland)}]
+                metadata = {"p_lat": p_lat, "p_lon": p_lon, "p_riv_base": p_riv_base, "p_riv_new": riv_new,
+                            "p_fld_base": p_fld_base, "p_fld_new": fld_new, "size_wetland": size_wetland,
+                            "start_year": start_year, "end_year": end_year, "output_variables": output_variables,
+                            "threads": threads, "sites": sites}
+                folder_collection.insert_one({"model": "postflow", "status": "running", "folder_name": folder_name,
+                                              "sweep_id": sweep_id, "metadata": metadata})
+                scenarios.append({"folder_name": folder_name, "riv_new": riv_new, "fld_new": fld_new,
+                                  "size_wetland": size_wetland})
+                self.STORAGE.create_folder(folder_name)
+                command = "sudo cp -avr ${CAMADIR}/map/hamid_copy ${CAMADIR}/map/" + folder_name
+                process = subprocess.Popen(command.replace("${CAMADIR}", self.BASE_PATH), shell=True)
+                if process.wait() != 0:
+                    # the scenario can't run without its map, the other ones go on
+                    folder_collection.update_one({"folder_name": folder_name},
+                                                 {"$set": {"status": "error", "error": "Unable to copy the map"}})
+                    self.STORAGE.delete_folder(folder_name)
+                    command = "sudo rm -rf ${CAMADIR}/map/" + folder_name
+                    subprocess.Popen(command.replace("${CAMADIR}", self.BASE_PATH), shell=True).wait()
+                    continue
+                self.update_manning(p_lat, p_lon, p_riv_base, riv_new, p_fld_base, fld_new, int(size_wetland), folder_name,
+                                    sites=sites)
+                scripts.append(self.script_path("post", folder_name))
+                self.config_cama("post", start_year, end_year, output_variables, threads, run_name=folder_name,
+                                 folder_name=folder_name)
+                runnable.append(folder_name)
+            if len(runnable) == 0:
+                raise Exception("No scenario of the sweep could copy its map")
+            sweep_collection.update_one({"_id": sweep["_id"]}, {"$set": {"scenarios": scenarios}})
+
+            # xargs keeps at most <concurrency> scenarios running, within the core budget
+            file_path = self.script_path("sweep", "sweep_" + sweep_id)
+            scripts.append(file_path)
+            with open(file_path, "w") as file:
+                file.write("#!/bin/sh\n")
+                file.write("trap 'rm -f " + " ".join(scripts) + "' EXIT\n")
+                file.write("printf '%s\\n' " + " ".join(self.script_path("post", folder_name) for folder_name in runnable) +
+                           " | xargs -P " + str(concurrency) + " -n 1 sh\n")
+                file.close()
+            os.chmod(file_path, 0o777)
+            subprocess.Popen("sudo " + file_path, shell=True)
+            launched = True
+        except Exception as e:
+            for scenario in scenarios:
+                folder_collection.delete_one({"folder_name": scenario["folder_name"]})
+                if self.STORAGE.folder_exists(scenario["folder_name"]):
+                    self.STORAGE.delete_folder(scenario["folder_name"])
+                command = "sudo rm -r ${CAMADIR}/map/" + scenario["folder_name"]
+                subprocess.Popen(command.replace("${CAMADIR}", self.BASE_PATH), shell=True).wait()
+            sweep_collection.update_one({"_id": sweep["_id"]}, {"$set": {"status": "error"}})
+            db_connect.release_run_slot(self.MONGO_CLIENT, slot)
+            raise e
+        finally:
+            if not launched:
+                for file_path in scripts:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+        return {"message": "Execution queued", "sweep_id": sweep_id, "scenarios": len(runnable), "concurrency": concurrency}
+
+    def summarize_scenario(self, folder, baseline_folder):
+        """Compares a completed scenario with the baseline at the wetland cell, for every simulated year"""
+        metadata = folder["metadata"]
+        grid_cell = self.coord_to_grid_cell(float(metadata["p_lat"]), float(metadata["p_lon"]))
+        per_year = []
+        for year in range(max(int(metadata["start_year"]), 1916), min(int(metadata["end_year"]), 2011) + 1):
+            self.YEAR = year
+            self.PRE_PATH = self.fetch_output(baseline_folder, "outflw" + str(year) + ".bin")
+            self.POST_PATH = self.fetch_output(folder["folder_name"], "outflw" + str(year) + ".bin")
+            per_year.append({"year": year, "delta_max": float(self.delta_max_q_y(grid_cell)),
+                             "delta_min": float(self.delta_min_q_y(grid_cell))})
+        summary = {"per_year": per_year}
+        if len(per_year) > 0:
+            summary["mean_delta_max"] = sum(year["delta_max"] for year in per_year) / len(per_year)
+            summary["mean_delta_min"] = sum(year["delta_min"] for year in per_year) / len(per_year)
+        return summary
+
+    def submit_summary(self, folder, baseline_folder):
+        """Queues the summary of a completed scenario once and returns the job_id, or None when the queue is full"""
+        # imported here, job_queue imports this module
+        from job_queue import JobQueue
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        # claimed first, so that concurrent polls queue a single job
+        if folder_collection.find_one_and_update({"_id": folder["_id"], "summary_job": None},
+                                                 {"$set": {"summary_job": "pending"}}) is None:
+            return "pending"
+        try:
+            job_id = JobQueue(self.MONGO_CLIENT).submit({"request": "summarize_scenario", "folder_name": folder["folder_name"],
+                                                         "baseline_folder": baseline_folder}, "analysis")
+        except Exception:
+            # the next poll tries again
+            folder_collection.update_one({"_id": folder["_id"]}, {"$unset": {"summary_job": ""}})
+            return None
+        folder_collection.update_one({"_id": folder["_id"]}, {"$set": {"summary_job": job_id}})
+        return job_id
+
+    def sweep_status(self, sweep_id):
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        sweep_collection = self.MONGO_CLIENT["output"]["sweep"]
+        sweep = sweep_collection.find_one({"_id": bson.ObjectId(sweep_id)})
+        if sweep is None:
+            return "Record doesn't exist"
+        result = {"sweep_id": sweep_id, "status": sweep["status"], "concurrency": sweep["concurrency"], "scenarios": []}
+        for scenario in sweep.get("scenarios", []):
+            folder = folder_collection.find_one({"folder_name": scenario["folder_name"]})
+            entry = dict(scenario)
+            entry["status"] = folder["status"] if folder is not None else "removed"
+            if folder is not None and folder["status"] == "completed" and sweep.get("baseline_folder"):
+                # the summary reads every year of the scenario, so it is computed once, by a job of the job pool
+                if "summary" not in folder and folder.get("summary_job") is None:
+                    folder["summary_job"] = self.submit_summary(folder, sweep["baseline_folder"])
+                entry["summary"] = folder.get("summary")
+                entry["summary_job"] = folder.get("summary_job")
+            elif folder is not None and folder["status"] == "running":
+                entry["progress"] = estimate_progress(folder)
+            result["scenarios"].append(entry)
+        if sweep["status"] == "running" and all(entry["status"] != "running" for entry in result["scenarios"]):
+            sweep_collection.update_one({"_id": sweep["_id"]}, {"$set": {"status": "completed"}})
+            result["status"] = "completed"
+        return result
+
     def clean_up(self):
         """Deleting all content of the temp folder"""
         directory = os.path.join(os.getcwd(), self.TMP_FOLDER)
@@ -572,79 +1330,56 @@ class CamaConvert:
         except Exception as e:
             raise e
 
+    def cama_progress(self, folder_name):
+        folder_collection = self.MONGO_CLIENT["output"]["folder"]
+        folder = folder_collection.find_one({"folder_name": folder_name})
+        if folder is None:
+            return None
+        return estimate_progress(folder)
+
     def remove_output_folder(self, folder_name):
         folder_collection = self.MONGO_CLIENT["output"]["folder"]
         folder = folder_collection.find_one({"folder_name": folder_name})
-        if folder is None and not self.DROPBOX.folder_exists(folder_name):
+        if folder is None and not self.STORAGE.folder_exists(folder_name):
             raise Exception("unable to delete the folder")
         if folder is not None:
             folder_collection.delete_one({"_id": folder["_id"]})
-        if self.DROPBOX.folder_exists(folder_name):
-            self.DROPBOX.delete_folder(folder_name)
+        if self.STORAGE.folder_exists(folder_name):
+            self.STORAGE.delete_folder(folder_name)
+        self.STORAGE.purge_cache(folder_name)
         return "Deletion Successful"
 
     def compare_flow(self):
         file_path = os.path.join(self.BASE_PATH, "map", "hamid", "lonlat")
-        lon_lat = numpy.loadtxt(file_path)
+        lon_lat = self.static_table(file_path)
         no_of_lon_lat = lon_lat.shape[0]
         no_of_days = self.days_in_year(self.YEAR)
         # Finding nearest lon_lat to the wetland location
-        distance = [self.pos2dis(self.LAT, self.LON, location[1], location[0]) for location in lon_lat]
-        grid_cell = distance.index(min(distance))
+        grid_cell = int(self.cell_index().nearest_many(float(self.LAT), float(self.LON))[0])
+        # only the row of that location is returned, so only its values are read
+        indices = grid_cell + no_of_lon_lat * numpy.arange(no_of_days)
 
         # plotting preflow
-        preflow = []
-        with open(self.PRE_PATH, "r") as f:
-            outflow = numpy.fromfile(f, dtype=numpy.float32)
-            f.close()
-
+        preflow = self.read_values(self.PRE_PATH, indices)
         # ensure that all overly-large values are zeroed out
-        for i in range(len(outflow)):
-            if outflow[i] > 100000:
-                outflow[i] = 0
-
-        for i in range(0, no_of_lon_lat):
-            idx = i
-            flow = []
-            for day in range(1, no_of_days + 1):
-                flow.append(outflow[idx])
-                idx += no_of_lon_lat
-            preflow.append(flow)
-
-        preflow = numpy.asarray(preflow)
+        preflow = numpy.where(preflow > 100000, 0, preflow)
 
         # plotting the postflow
-        postflow = []
-        with open(self.POST_PATH, "r") as f:
-            outflow = numpy.fromfile(f, dtype=numpy.float32)
-            f.close()
-
-        # ensure that all overly-large values are zeroed out
-        for i in range(len(outflow)):
-            if outflow[i] > 100000:
-                outflow[i] = 0
-
-        for i in range(0, no_of_lon_lat):
-            idx = i
-            flow = []
-            for day in range(1, no_of_days + 1):
-                flow.append(outflow[idx])
-                idx += no_of_lon_lat
-            postflow.append(flow)
-
-        postflow = numpy.asarray(postflow)
+        postflow = self.read_values(self.POST_PATH, indices)
+        postflow = numpy.where(postflow > 100000, 0, postflow)
 
         # Generating dates
         file_path = os.path.join(self.BASE_PATH, "inp", "hamid_dates_1915_2011")
-        dates = numpy.loadtxt(file_path, dtype=numpy.int32)
+        dates = self.static_table(file_path, dtype=numpy.int32)
         dates_in_range = dates[dates[:, 0] == self.YEAR]
-        data = numpy.column_stack([dates_in_range, preflow[grid_cell] * 35.31, postflow[grid_cell] * 35.31])
+        data = numpy.column_stack([dates_in_range, preflow * 35.31, postflow * 35.31])
         return data.tolist()
 
     def do_request(self, p_request_json):
         try:
             if p_request_json["request"] == "plot_hydrograph_from_wetlands" or p_request_json["request"] == "plot_hydrograph_nearest_reservoir" or \
-                    p_request_json["request"] == "plot_hydrograph_deltas" or p_request_json["request"] == "plot_compare_flow":
+                    p_request_json["request"] == "plot_hydrograph_deltas" or p_request_json["request"] == "plot_compare_flow" or \
+                    p_request_json["request"] == "river_profile":
                 # startup and configuration
                 config = dict()
                 config["pre_path"] = p_request_json["pre_path"]
@@ -661,6 +1396,17 @@ class CamaConvert:
                 result = self.plot_hydrograph_nearest_reservoir(p_request_json["lat"], p_request_json["lon"])
             elif p_request_json["request"] == "peak_flow":
                 result = self.peak_flow(p_request_json["folder_name"], p_request_json["lat"], p_request_json["lon"], p_request_json["return_period"])
+            elif p_request_json["request"] == "build_climatology":
+                result = self.build_climatology(p_request_json["folder_name"], p_request_json.get("variable", "outflw"))
+            elif p_request_json["request"] == "climatology":
+                result = self.climatology_bands(p_request_json["folder_name"], p_request_json["lat"], p_request_json["lon"],
+                                                p_request_json.get("year"), p_request_json.get("variable", "outflw"))
+            elif p_request_json["request"] == "river_profile":
+                result = self.river_profile()
+            elif p_request_json["request"] == "impact_summary":
+                result = self.compare_years(p_request_json["pre_folder"], p_request_json["post_folder"],
+                                            p_request_json["start_year"], p_request_json["end_year"],
+                                            p_request_json["lat"], p_request_json["lon"])
             elif p_request_json["request"] == "plot_hydrograph_deltas":
                 result = self.delta_max_all()
             elif p_request_json["request"] == "veg_lookup":
@@ -671,17 +1417,41 @@ class CamaConvert:
                 result = dict()
                 message = self.cama_status(p_request_json["folder_name"])
                 result["message"] = message
+                result["progress"] = self.cama_progress(p_request_json["folder_name"])
             elif p_request_json["request"] == "cama_run_pre":
                 result = dict()
-                message = self.run_cama_pre(p_request_json["start_year"], p_request_json["end_year"], p_request_json["folder_name"])
+                message = self.run_cama_pre(p_request_json["start_year"], p_request_json["end_year"], p_request_json["folder_name"],
+                                            p_request_json.get("output_variables"), p_request_json.get("threads"),
+                                            p_request_json.get("netcdf_output") in [True, "true", "True", 1],
+                                            p_request_json.get("vector_output") in [True, "true", "True", 1])
                 result["message"] = message
             elif p_request_json["request"] == "cama_run_post":
                 result = dict()
-                message = self.run_cama_post(p_request_json["start_year"], p_request_json["end_year"], p_request_json["lat"],
-                                             p_request_json["lon"], p_request_json["riv_base"], p_request_json["riv_new"],
-                                             p_request_json["fld_base"], p_request_json["fld_new"], p_request_json["size_wetland"],
-                                             p_request_json["folder_name"])
+                message = self.run_cama_post(p_request_json["start_year"], p_request_json["end_year"], p_request_json.get("lat"),
+                                             p_request_json.get("lon"), p_request_json["riv_base"], p_request_json.get("riv_new"),
+                                             p_request_json["fld_base"], p_request_json.get("fld_new"),
+                                             p_request_json.get("size_wetland"), p_request_json["folder_name"],
+                                             p_request_json.get("output_variables"), p_request_json.get("threads"),
+                                             p_request_json.get("netcdf_output") in [True, "true", "True", 1],
+                                             p_request_json.get("sites"),
+                                             p_request_json.get("vector_output") in [True, "true", "True", 1])
                 result["message"] = message
+            elif p_request_json["request"] == "cama_extend":
+                result = dict()
+                result["message"] = self.extend_cama_post(p_request_json["folder_name"], p_request_json["end_year"])
+            elif p_request_json["request"] == "cama_sweep":
+                result = self.run_cama_sweep(p_request_json["start_year"], p_request_json["end_year"], p_request_json["lat"],
+                                             p_request_json["lon"], p_request_json["riv_base"], p_request_json["fld_base"],
+                                             p_request_json["grid"], p_request_json.get("core_budget"),
+                                             p_request_json.get("threads"), p_request_json.get("output_variables"),
+                                             p_request_json.get("baseline_folder"))
+            elif p_request_json["request"] == "summarize_scenario":
+                folder_collection = self.MONGO_CLIENT["output"]["folder"]
+                folder = folder_collection.find_one({"folder_name": p_request_json["folder_name"]})
+                result = self.summarize_scenario(folder, p_request_json["baseline_folder"])
+                folder_collection.update_one({"_id": folder["_id"]}, {"$set": {"summary": result}})
+            elif p_request_json["request"] == "sweep_status":
+                result = self.sweep_status(p_request_json["sweep_id"])
             elif p_request_json["request"] == "remove_output_folder":
                 result = dict()
                 message = self.remove_output_folder(p_request_json["folder_name"])
@@ -702,6 +1472,16 @@ class CamaConvert:
             raise e
 
 
+def summarize_year(year, pre_folder, pre_file, post_folder, post_file, grid_cells):
+    """Runs in the summary pool: fetches the pre and post outputs of a year and returns its CamaConvert.year_summary"""
+    cama = CamaConvert(None)
+    try:
+        pre_path = cama.STORAGE.download_file(pre_folder, pre_file, cama.TMP_FOLDER)
+        post_path = cama.STORAGE.download_file(post_folder, post_file, cama.TMP_FOLDER)
+        return cama.year_summary(year, pre_path, post_path, grid_cells)
+    finally:
+        cama.clean_up()
+
 if __name__ == '__main__':
     db = db_connect.DbConnect()
     db.connect_db()
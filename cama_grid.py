@@ -0,0 +1,208 @@
+"""Grid descriptor of a CaMa map: dimensions and bounds, and the index arithmetic of the flat days x cells outputs.
+
+The dimensions come from the map's diminfo file (nx, ny, floodplain layers, then the input grid, the input matrix file
+and the west, east, north and south edges). When diminfo doesn't list the edges, they are derived from the cell centers
+in lonlat.
+"""
+import glob
+import math
+import os.path
+
+import numpy
+
+# grid descriptors per map directory, computed once per process
+GRIDS = {}
+
+
+class Grid:
+    def __init__(self, nx, ny, nlfp, west, east, north, south):
+        self.NX = nx
+        self.NY = ny
+        self.NLFP = nlfp
+        self.WEST = float(west)
+        self.EAST = float(east)
+        self.NORTH = float(north)
+        self.SOUTH = float(south)
+        # cells per degree, rounded so that 1 / 0.1 stays exactly 10 in the index arithmetic
+        self.X_RESOLUTION = round(nx / (self.EAST - self.WEST), 6)
+        self.Y_RESOLUTION = round(ny / (self.NORTH - self.SOUTH), 6)
+
+    @property
+    def cells(self):
+        return self.NX * self.NY
+
+    def cell_of(self, lat, lon):
+        """Returns the 1-based, row-major grid cell holding the coordinates"""
+        return math.floor((self.NORTH - lat) * self.Y_RESOLUTION) * self.NX + math.floor((lon - self.WEST) * self.X_RESOLUTION + 1)
+
+    def cells_of(self, lat, lon):
+        """Returns the 1-based, row-major grid cells holding each of the coordinates"""
+        rows = numpy.floor((self.NORTH - numpy.asarray(lat, dtype=numpy.float64)) * self.Y_RESOLUTION)
+        cols = numpy.floor((numpy.asarray(lon, dtype=numpy.float64) - self.WEST) * self.X_RESOLUTION + 1)
+        return (rows * self.NX + cols).astype(numpy.int64)
+
+    def cell_center(self, grid_cell):
+        """Returns the lat, lon of the center of a 1-based grid cell"""
+        row, col = divmod(grid_cell - 1, self.NX)
+        return round(self.NORTH - (row + 0.5) / self.Y_RESOLUTION, 6), round(self.WEST + (col + 0.5) / self.X_RESOLUTION, 6)
+
+    def flow_indices(self, grid_cell, day_count):
+        # flat indices of a grid cell for every day of the year; grid cells are 1-based
+        return numpy.mod(grid_cell, self.cells) + self.cells * numpy.arange(day_count) - 1
+
+    def gather_indices(self, grid_cells, day_count):
+        """Flat indices of several grid cells for every day, day-major, so that the values reshape to days x cells"""
+        grid_cells = numpy.asarray(grid_cells)
+        return (numpy.mod(grid_cells, self.cells)[None, :] - 1 + self.cells * numpy.arange(day_count)[:, None]).ravel()
+
+
+def read_diminfo(file_path):
+    # every line holds a value followed by an optional "!!" comment
+    values = []
+    with open(file_path) as f:
+        for line in f:
+            fields = line.split("!!")[0].split()
+            if len(fields) > 0:
+                values.append(fields[0])
+        f.close()
+    return values
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def bounds_from_lonlat(file_path, nx, ny):
+    lon_lat = numpy.loadtxt(file_path, usecols=range(2))
+    lon_step = (lon_lat[:, 0].max() - lon_lat[:, 0].min()) / max(nx - 1, 1)
+    lat_step = (lon_lat[:, 1].max() - lon_lat[:, 1].min()) / max(ny - 1, 1)
+    west = round(lon_lat[:, 0].min() - lon_step / 2, 6)
+    north = round(lon_lat[:, 1].max() + lat_step / 2, 6)
+    return west, round(west + lon_step * nx, 6), north, round(north - lat_step * ny, 6)
+
+
+def load_grid(map_path):
+    """Returns the grid of a map directory, e.g. <CAMA_BASE_PATH>/map/hamid"""
+    if map_path in GRIDS:
+        return GRIDS[map_path]
+    diminfo = sorted(glob.glob(os.path.join(map_path, "diminfo*.txt")))
+    if len(diminfo) == 0:
+        raise Exception("No diminfo file in " + map_path)
+    values = read_diminfo(diminfo[0])
+    nx, ny, nlfp = int(values[0]), int(values[1]), int(values[2])
+    # the input matrix file name (line 7 of a standard diminfo) sits between the input grid and the edges
+    numbers = [float(value) for value in values if is_number(value)]
+    if len(numbers) >= 10:
+        west, east, north, south = numbers[6:10]
+    else:
+        west, east, north, south = bounds_from_lonlat(os.path.join(map_path, "lonlat"), nx, ny)
+    GRIDS[map_path] = Grid(nx, ny, nlfp, west, east, north, south)
+    return GRIDS[map_path]
+
+
+def unit_vectors(lat, lon):
+    # points on the unit sphere, so that the largest dot product is the smallest great-circle distance
+    lat = numpy.radians(numpy.asarray(lat, dtype=numpy.float64))
+    lon = numpy.radians(numpy.asarray(lon, dtype=numpy.float64))
+    return numpy.stack([numpy.cos(lat) * numpy.cos(lon), numpy.cos(lat) * numpy.sin(lon), numpy.sin(lat)], axis=-1)
+
+
+class NearestCellIndex:
+    """Nearest point (e.g. row of lonlat) to arbitrary coordinates, by great-circle distance.
+
+    The points are bucketed on a uniform lat/lon grid of about 4 points per bucket. The longitude buckets go around the
+    whole circle, so the neighbors of a bucket at the antimeridian are on the other side of it. A query only compares
+    the points of the rings of buckets around it, and stops once no point of a farther ring can be closer.
+    """
+
+    def __init__(self, lon, lat):
+        lon = numpy.asarray(lon, dtype=numpy.float64)
+        lat = numpy.asarray(lat, dtype=numpy.float64)
+        self.VECTORS = unit_vectors(lat, lon)
+        self.LON_MIN = lon.min()
+        self.LAT_MIN = lat.min()
+        span = max(lon.max() - self.LON_MIN, lat.max() - self.LAT_MIN, 1e-9)
+        # a whole number of buckets around the circle, and at most ~8 buckets per point on a small or regional map
+        self.NBX = int(math.ceil(360 / max(span * 2 / math.sqrt(len(lon)), 90 / math.sqrt(len(lon)))))
+        self.BUCKET = 360 / self.NBX
+        self.NBY = int((lat.max() - self.LAT_MIN) / self.BUCKET) + 1
+        keys = self.bucket_y(lat) * self.NBX + self.bucket_x(lon)
+        # points sorted by bucket; the points of bucket k are ORDER[STARTS[k]:STARTS[k + 1]]
+        self.ORDER = numpy.argsort(keys, kind="stable")
+        self.STARTS = numpy.searchsorted(keys[self.ORDER], numpy.arange(self.NBX * self.NBY + 1))
+
+    def bucket_x(self, lon):
+        # any longitude convention (-180..180, 0..360) lands in the same bucket
+        return numpy.clip((((lon - self.LON_MIN) % 360) // self.BUCKET).astype(numpy.int64), 0, self.NBX - 1)
+
+    def bucket_y(self, lat):
+        return numpy.clip(((lat - self.LAT_MIN) // self.BUCKET).astype(numpy.int64), 0, self.NBY - 1)
+
+    def ring_offsets(self, r):
+        # the (dx, dy) bucket offsets at Chebyshev distance r; dx is taken in (-NBX / 2, NBX / 2], so that no bucket is
+        # listed twice once the ring wraps around the circle
+        dx = numpy.arange(max(-r, -((self.NBX - 1) // 2)), min(r, self.NBX // 2) + 1)
+        dy = numpy.arange(-r, r + 1)
+        dx, dy = [a.ravel() for a in numpy.meshgrid(dx, dy)]
+        on_ring = numpy.maximum(numpy.abs(dx), numpy.abs(dy)) == r
+        return dx[on_ring], dy[on_ring]
+
+    def bucket_reach(self, nx, ny, cos_lat):
+        # the least distance (radians) from a query to a point at least nx buckets away in longitude and ny in latitude;
+        # cos(lat) * sin(dlon) is the sine of the distance from the query to the great circle of a meridian dlon away
+        lon_gap = numpy.sin(numpy.radians(numpy.clip(nx * self.BUCKET, 0.0, 90.0)))
+        lat_gap = numpy.radians(numpy.maximum(ny * self.BUCKET, 0.0))
+        return numpy.maximum(lat_gap, numpy.arcsin(numpy.clip(cos_lat * lon_gap, 0.0, 1.0)))
+
+    def nearest_many(self, lat, lon):
+        """Returns the index of the point closest to each of the coordinates; all the queries are searched together,
+        one ring of buckets at a time, and leave the search once no farther point can be closer"""
+        lat = numpy.atleast_1d(numpy.asarray(lat, dtype=numpy.float64))
+        lon = numpy.atleast_1d(numpy.asarray(lon, dtype=numpy.float64))
+        queries = unit_vectors(lat, lon)
+        bx = self.bucket_x(lon)
+        by = self.bucket_y(lat)
+        best = numpy.full(len(lat), -1, dtype=numpy.int64)
+        best_dot = numpy.full(len(lat), -1.0)
+        cos_lat = numpy.cos(numpy.radians(lat))
+        active = numpy.arange(len(lat))
+        for r in range(max(self.NBX // 2, self.NBY) + 1):
+            dx, dy = self.ring_offsets(r)
+            # (active queries, ring buckets) keys, the buckets off the grid in latitude are dropped
+            x = (bx[active, None] + dx[None, :]) % self.NBX
+            y = by[active, None] + dy[None, :]
+            # and so are the buckets that can't hold a point closer than the best one found yet
+            near = self.bucket_reach(numpy.abs(dx) - 1, numpy.abs(dy) - 1, cos_lat[active, None]) <= \
+                numpy.arccos(numpy.minimum(best_dot[active, None], 1.0))
+            inside = (y >= 0) & (y < self.NBY) & near
+            query = numpy.broadcast_to(active[:, None], x.shape)[inside]
+            keys = y[inside] * self.NBX + x[inside]
+            # every point of these buckets, paired with its query
+            counts = self.STARTS[keys + 1] - self.STARTS[keys]
+            total = int(counts.sum())
+            if total > 0:
+                query = numpy.repeat(query, counts)
+                first = numpy.repeat(self.STARTS[keys] - (numpy.cumsum(counts) - counts), counts)
+                points = self.ORDER[first + numpy.arange(total)]
+                dots = numpy.einsum("ij,ij->i", self.VECTORS[points], queries[query])
+                # the largest dot per query, the lowest point index on a tie
+                order = numpy.lexsort((points, -dots, query))
+                leaders = order[numpy.concatenate([[True], query[order][1:] != query[order][:-1]])]
+                better = dots[leaders] > best_dot[query[leaders]]
+                best[query[leaders][better]] = points[leaders][better]
+                best_dot[query[leaders][better]] = dots[leaders][better]
+            # every point of ring r + 1 and beyond is at least r buckets away in latitude, or in longitude, which is
+            # at least the distance to the great circle of the meridian that far away
+            reach = numpy.minimum(self.bucket_reach(r, 0, cos_lat[active]), self.bucket_reach(0, r, cos_lat[active]))
+            active = active[(best[active] < 0) | (numpy.arccos(numpy.minimum(best_dot[active], 1.0)) > reach)]
+            if len(active) == 0:
+                break
+        return best
+
+    def nearest(self, lat, lon):
+        """Returns the index of the point closest to (lat, lon)"""
+        return int(self.nearest_many(lat, lon)[0])
@@ -0,0 +1,84 @@
+"""Daily climatology of a yearly CaMa output: per cell and day of year, the mean and percentiles over the years.
+
+The years are streamed one at a time. The mean is kept as a sum and a count, and the percentiles come from a
+fixed-memory sketch: a histogram of log-spaced flow bins (one byte per bin, cell and day), so the memory doesn't grow
+with the number of years. Percentiles are interpolated geometrically inside their bin.
+"""
+import calendar
+
+import numpy
+
+DAYS = 366
+PERCENTILES = [5, 10, 25, 50, 75, 90, 95]
+STATISTICS = ["mean"] + ["p" + str(percentile) for percentile in PERCENTILES]
+# bin edges of the sketch; values below the first edge (zero flow) fall in bin 0
+LOW = 1e-2
+HIGH = 1e5
+BINS = 64
+MAX_VALUE = 100000  # larger values are CaMa fill values, left out like in the cleaning readers
+# memory of a cell: its histogram, sum and count, and its float32 statistics; about 39 KB, 1.8 GB for 50000 cells
+BYTES_PER_CELL = DAYS * ((BINS + 1) + 8 + 2 + 4 * len(STATISTICS))
+
+
+def day_of_year(year, day_count):
+    # 0-based day of a 366-day year, so that Feb 29 has its own slot and the later days line up across years
+    days = numpy.arange(day_count)
+    if not calendar.isleap(year):
+        days[59:] += 1
+    return days
+
+
+class ClimatologySketch:
+    def __init__(self, cells):
+        self.CELLS = cells
+        self.EDGES = numpy.logspace(numpy.log10(LOW), numpy.log10(HIGH), BINS)
+        self.SUM = numpy.zeros((DAYS, cells), dtype=numpy.float64)
+        self.COUNT = numpy.zeros((DAYS, cells), dtype=numpy.uint16)
+        self.HISTOGRAM = numpy.zeros((DAYS, cells, BINS + 1), dtype=numpy.uint8)
+        self.YEARS = []
+
+    def add_year(self, year, values):
+        """Adds a year of the flat days x cells output"""
+        if len(self.YEARS) == 255:
+            raise Exception("The sketch counts at most 255 years")
+        values = numpy.asarray(values, dtype=numpy.float32).reshape(-1, self.CELLS)
+        doy = day_of_year(year, values.shape[0])[:, None]
+        valid = values <= MAX_VALUE
+        cleaned = numpy.where(valid, values, 0)
+        self.SUM[doy[:, 0]] += cleaned
+        self.COUNT[doy[:, 0]] += valid
+        # bin i holds [EDGES[i - 1], EDGES[i]), computed on the log scale rather than searched
+        step = (numpy.log10(HIGH) - numpy.log10(LOW)) / (BINS - 1)
+        bins = numpy.floor((numpy.log10(numpy.maximum(cleaned, LOW / 10)) - numpy.log10(LOW)) / step) + 1
+        bins = numpy.clip(bins, 0, BINS).astype(numpy.intp)
+        # every (day, cell) pair appears once per year, so the fancy-indexed increment doesn't collide
+        flat = (doy * self.CELLS + numpy.arange(self.CELLS)[None, :]) * (BINS + 1) + bins
+        self.HISTOGRAM.reshape(-1)[flat[valid]] += 1
+        self.YEARS.append(year)
+
+    def bin_bounds(self):
+        lower = numpy.concatenate([[0.0], self.EDGES])
+        upper = numpy.concatenate([self.EDGES, [self.EDGES[-1]]])
+        return lower, upper
+
+    def statistics(self):
+        """Returns a (len(STATISTICS), DAYS, cells) float32 array; days without any value hold NaN"""
+        result = numpy.full((len(STATISTICS), DAYS, self.CELLS), numpy.nan, dtype=numpy.float32)
+        counted = self.COUNT > 0
+        result[0][counted] = self.SUM[counted] / self.COUNT[counted]
+        lower, upper = self.bin_bounds()
+        cells = numpy.arange(self.CELLS)
+        # one day at a time, so the cumulative counts stay the size of a single day
+        for day in range(DAYS):
+            cumulative = numpy.cumsum(self.HISTOGRAM[day], axis=1, dtype=numpy.uint16)
+            count = self.COUNT[day].astype(numpy.float64)
+            for k in range(len(PERCENTILES)):
+                rank = PERCENTILES[k] / 100.0 * count
+                bins = numpy.minimum((cumulative < rank[:, None]).sum(axis=1), BINS)
+                below = numpy.where(bins > 0, cumulative[cells, numpy.maximum(bins - 1, 0)], 0)
+                inside = self.HISTOGRAM[day, cells, bins].astype(numpy.float64)
+                fraction = numpy.clip((rank - below) / numpy.maximum(inside, 1), 0, 1)
+                low = numpy.maximum(lower[bins], LOW)
+                value = numpy.where(bins == 0, 0.0, low * (upper[bins] / low) ** fraction)
+                result[k + 1, day] = numpy.where(count > 0, value, numpy.nan)
+        return result
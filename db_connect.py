@@ -1,9 +1,15 @@
+import bson
+import datetime
 import pymongo
 import json
 import os
 from sshtunnel import SSHTunnelForwarder
 
 USE_SSH = False
+# id of the document in output.lock that holds the single CaMa run slot
+RUN_SLOT = "cama_run"
+# a slot claimed this long ago by a request that never inserted its running folder is considered abandoned
+STALE_SLOT_SECONDS = 600
 
 
 class DbConnect:
@@ -54,3 +60,44 @@ class DbConnect:
         except Exception as e:
             print('cannot disconnect')
             raise e
+
+
+def ensure_indexes(mongo_client):
+    """Creates the indexes of the queries by folder_name, status and job_id; create_index is a no-op when they exist"""
+    folder_collection = mongo_client["output"]["folder"]
+    # run_cama_post sets folder_name after the insert, so the documents without one yet are left out of the index
+    folder_collection.create_index("folder_name", unique=True, partialFilterExpression={"folder_name": {"$type": "string"}})
+    folder_collection.create_index("status")
+    mongo_client["output"]["job"].create_index("job_id", unique=True)
+
+
+def claim_run_slot(mongo_client):
+    """Atomically takes the single CaMa run slot and returns its token, or None when a model is in execution"""
+    lock_collection = mongo_client["output"]["lock"]
+    token = str(bson.ObjectId())
+    for attempt in range(2):
+        try:
+            # the upsert only inserts when the slot document doesn't exist yet; a held slot fails on the duplicate _id
+            lock_collection.find_one_and_update({"_id": RUN_SLOT, "holder": None},
+                                                {"$set": {"holder": token, "claimed_at": datetime.datetime.utcnow()}},
+                                                upsert=True)
+            return token
+        except pymongo.errors.DuplicateKeyError:
+            slot = lock_collection.find_one({"_id": RUN_SLOT})
+            if slot is None:
+                continue
+            # free a slot left behind by a run that ended without releasing it (killed script, crashed upload)
+            stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=STALE_SLOT_SECONDS)
+            if mongo_client["output"]["folder"].find_one({"status": "running"}) is not None or \
+                    slot.get("claimed_at") is None or slot["claimed_at"] > stale_before:
+                return None
+            lock_collection.update_one({"_id": RUN_SLOT, "holder": slot["holder"]}, {"$set": {"holder": None}})
+    return None
+
+
+def release_run_slot(mongo_client, token=None):
+    """Frees the run slot; with a token, only if that claim still holds it"""
+    query = {"_id": RUN_SLOT}
+    if token is not None:
+        query["holder"] = token
+    mongo_client["output"]["lock"].update_one(query, {"$set": {"holder": None}})
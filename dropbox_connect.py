@@ -1,21 +1,48 @@
 import dropbox
-import glob
+import hashlib
 import os.path
-import json
+import shutil
+import time
 from dropbox.files import WriteMode
-from db_connect import DbConnect
+from storage import StorageBackend, load_config
+import metrics
 
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+# files used this recently are never evicted from the download cache, a request may be about to read them
+EVICTION_GRACE_SECONDS = 60
 
-class DropBox:
+
+def content_hash(file_path):
+    """Dropbox content hash: SHA-256 of the concatenated SHA-256 digests of every 4 MB block"""
+    block_digests = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            block_digests.update(hashlib.sha256(block).digest())
+        f.close()
+    return block_digests.hexdigest()
+
+
+class DropBox(StorageBackend):
     def __init__(self):
-        file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
-        with open(file_path) as f:
-            config = json.load(f)
-            f.close()
+        super().__init__()
+        config = load_config()
         access_token = config["DROPBOX_ACCESS_TOKEN"]
         self.DBX = dropbox.Dropbox(access_token)
-        self.DB = DbConnect()
-        self.BASE_PATH = config["CAMA_BASE_PATH"]
+        # downloads are kept here between requests, so unchanged files are not fetched again
+        self.CACHE_DIR = config.get("DOWNLOAD_CACHE_DIR", "")
+        self.CACHE_MAX_BYTES = int(config.get("DOWNLOAD_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+    def remote_hash(self, path):
+        try:
+            metadata = self.DBX.files_get_metadata(path)
+            if isinstance(metadata, dropbox.files.FileMetadata):
+                return metadata.content_hash
+        except dropbox.exceptions.ApiError:
+            pass  # the file doesn't exist yet
+        return None
 
     def create_folder(self, folder_name):
         try:
@@ -25,33 +52,15 @@ class DropBox:
         except Exception as e:
             raise e
 
-    def upload_output(self):
-        folder_collection = None
-        folder = None
-        try:
-            self.DB.connect_db()
-            mongo_client = self.DB.get_connection()
-            folder_collection = mongo_client["output"]["folder"]
-            output_path = os.path.join(self.BASE_PATH, "out", "hamid")
-            folder = folder_collection.find_one({"status": "running"})
-            if folder is None:
-                raise Exception("No Record in execution in Database")
-            if not self.folder_exists(folder["folder_name"]):
-                raise Exception("Folder doesn't exist in dropbox")
-            # Uploading the results
-            folder_name = "/" + folder["folder_name"]
-            for filename in glob.glob(os.path.join(output_path, '*.bin')):
-                with open(filename, 'rb') as fp:
-                    self.DBX.files_upload(fp.read(), folder_name + "/" + filename.split("/")[-1], mode=WriteMode("overwrite"))
-                    fp.close()
-            # End of loop
-            folder_collection.update({"_id": folder["_id"]}, {"$set": {"status": "completed"}})
-        except Exception as e:
-            if folder_collection is not None and folder is not None:
-                folder_collection.update({"_id": folder["_id"]}, {"$set": {"status": "error"}})
-            raise e
-        finally:
-            self.DB.disconnect_db()
+    def upload_file(self, local_path, folder_name, file_name):
+        path = "/" + folder_name + "/" + file_name
+        if self.remote_hash(path) == content_hash(local_path):
+            metrics.inc("cama_dropbox_skipped_bytes_total", os.path.getsize(local_path), {"direction": "upload"})
+            print("unchanged, skipped upload of ", file_name)
+            return
+        with open(local_path, 'rb') as fp:
+            self.DBX.files_upload(fp.read(), path, mode=WriteMode("overwrite"))
+            fp.close()
 
     def folder_exists(self, folder_name):
         try:
@@ -66,40 +75,69 @@ class DropBox:
     def download_file(self, folder_name, file_name, download_folder_name):
         try:
             file_path = "/" + folder_name + "/" + file_name
-            download_dir = os.path.join(os.getcwd(), download_folder_name)
-            if not os.path.exists(download_dir):
-                os.makedirs(download_dir)
+            if self.CACHE_DIR:
+                download_dir = self.CACHE_DIR
+            else:
+                download_dir = os.path.join(os.getcwd(), download_folder_name)
+            if not os.path.exists(os.path.join(download_dir, folder_name)):
+                os.makedirs(os.path.join(download_dir, folder_name))
 
-            if not os.path.exists(os.path.join(os.getcwd(), download_folder_name, folder_name)):
-                os.mkdir(os.path.join(os.getcwd(), download_folder_name, folder_name))
+            local_path = os.path.join(download_dir, folder_name, file_name)
+            if os.path.exists(local_path) and self.remote_hash(file_path) == content_hash(local_path):
+                metrics.inc("cama_dropbox_skipped_bytes_total", os.path.getsize(local_path), {"direction": "download"})
+                # the mtime is the last use of a cached file (atime isn't updated on noatime mounts)
+                os.utime(local_path)
+                return local_path
 
-            self.DBX.files_download_to_file(os.path.join(os.getcwd(), download_folder_name, folder_name, file_name), file_path)
+            # download next to the target and rename, so concurrent requests never read a partial file
+            tmp_path = local_path + "." + download_folder_name + ".part"
+            with metrics.timed("cama_dropbox_download_seconds"):
+                self.DBX.files_download_to_file(tmp_path, file_path)
+            os.replace(tmp_path, local_path)
+            metrics.inc("cama_dropbox_download_bytes_total", os.path.getsize(local_path))
             print("downloaded ", file_name)
+            if self.CACHE_DIR:
+                self.evict_cache()
+            return local_path
         except Exception as e:
             raise e
 
-    def recover(self):
-        try:
-            self.DB.connect_db()
-            mongo_client = self.DB.get_connection()
-            folder_collection = mongo_client["output"]["folder"]
-            folder = folder_collection.find_one({"status": "running"})
-            if folder is not None:
-                folder_collection.update({"_id": folder["_id"]}, {"status": "error"})
-            if self.folder_exists(folder["folder_name"]):
-                self.delete_folder(folder["folder_name"])
-        except Exception as e:
-            raise e
-        finally:
-            self.DB.disconnect_db()
+    def evict_cache(self):
+        """Removes the least recently used files of the download cache until it holds at most CACHE_MAX_BYTES"""
+        entries = []
+        for root, dirs, files in os.walk(self.CACHE_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed by a concurrent eviction
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        recent = time.time() - EVICTION_GRACE_SECONDS
+        for mtime, size, path in sorted(entries):
+            if total <= self.CACHE_MAX_BYTES or mtime > recent:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                metrics.inc("cama_dropbox_evicted_bytes_total", size)
+            except OSError:
+                pass
 
     def delete_folder(self, folder_name):
         try:
             path = "/" + folder_name
             self.DBX.files_delete_v2(path)
+            self.purge_cache(folder_name)
         except Exception as e:
             raise e
 
+    def purge_cache(self, folder_name):
+        # the cached files of a deleted folder would never be used again, or be served to a new folder of its name
+        if self.CACHE_DIR:
+            shutil.rmtree(os.path.join(self.CACHE_DIR, folder_name), ignore_errors=True)
+
 
 if __name__ == "__main__":
     dropbox_obj = None
@@ -0,0 +1,105 @@
+"""Streaming conversion of large polygon collections to a GeoJSON MultiPolygon Feature.
+
+The bounding box is a min/max over one numpy array of all the positions, no geometry object is built. The output is
+written chunk by chunk with the coordinates rounded like geojson does, so it is the same text as json.dumps of the
+geojson.Feature. On a multi-core host, collections larger than PARALLEL_FEATURES have their chunks rounded and
+serialized in a process pool.
+"""
+import itertools
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import geojson
+import numpy
+
+CHUNK_FEATURES = 2000
+PARALLEL_FEATURES = 20000
+POOL_WORKERS = max(min(os.cpu_count() or 1, 4), 1)
+# The pool is created lazily so that every uwsgi worker builds its own after the fork
+POOL = None
+POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            POOL = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return POOL
+
+
+def arcgis_features(request_data):
+    """Returns the polygon coordinates of the features of the fourth operational layer of an ArcGIS web map"""
+    features = request_data["operationalLayers"][3]["featureCollection"]["layers"][0]["featureSet"]["features"]
+    return [feature["geometry"] for feature in features]
+
+
+def positions(polygons):
+    """Returns the positions of a list of polygons (or rings) as one (n, 2) float64 array"""
+    if len(polygons) == 0:
+        return numpy.empty((0, 2), dtype=numpy.float64)
+    # unnest down to the positions, the depth is the one of the first polygon
+    nested = polygons
+    sample = polygons[0]
+    while isinstance(sample[0], (list, tuple)):
+        nested = itertools.chain.from_iterable(nested)
+        sample = sample[0]
+    # raises on non-numeric or ragged positions, before anything is streamed
+    array = numpy.array(list(nested), dtype=numpy.float64)
+    if array.ndim != 2 or array.shape[1] < 2:
+        raise ValueError("Coordinates must be lists of [x, y] positions")
+    return array[:, :2]
+
+
+def bounds(polygons):
+    """Returns the (minx, miny, maxx, maxy) of all the positions, like shapely's MultiPolygon.bounds"""
+    array = positions(polygons)
+    if len(array) == 0:
+        raise ValueError("No coordinates")
+    low = array.min(axis=0)
+    high = array.max(axis=0)
+    return float(low[0]), float(low[1]), float(high[0]), float(high[1])
+
+
+def dump_chunk(polygons):
+    # the polygons of a chunk as the comma-separated items of the coordinates list
+    cleaned = geojson.MultiPolygon.clean_coordinates(polygons, geojson.geometry.DEFAULT_PRECISION)
+    return json.dumps(cleaned)[1:-1]
+
+
+def chunks(polygons):
+    for start in range(0, len(polygons), CHUNK_FEATURES):
+        yield polygons[start:start + CHUNK_FEATURES]
+
+
+def dumped_chunks(polygons):
+    if len(polygons) <= PARALLEL_FEATURES or POOL_WORKERS == 1:
+        for chunk in chunks(polygons):
+            yield dump_chunk(chunk)
+        return
+    # a bounded window of chunks in flight, so the serialized text doesn't pile up ahead of the client
+    pool = get_pool()
+    window = []
+    for chunk in chunks(polygons):
+        window.append(pool.submit(dump_chunk, chunk))
+        if len(window) > 2 * POOL_WORKERS:
+            yield window.pop(0).result()
+    for future in window:
+        yield future.result()
+
+
+def stream_feature(polygons, bbox=None):
+    """Yields the text of the GeoJSON Feature holding the polygons as one MultiPolygon"""
+    yield '{"type": "Feature", "geometry": {"type": "MultiPolygon", "coordinates": ['
+    first = True
+    for text in dumped_chunks(polygons):
+        if len(text) == 0:
+            continue
+        yield text if first else ", " + text
+        first = False
+    yield ']}, "properties": {}'
+    if bbox is not None:
+        yield ', "bbox": ' + json.dumps(list(bbox))
+    yield '}'
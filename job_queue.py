@@ -0,0 +1,178 @@
+import datetime
+import fcntl
+import json
+import os.path
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Custom import
+import admission
+from cama_convert import CamaConvert
+from db_connect import DbConnect
+import metrics
+
+# The executor is created lazily so that every uwsgi worker builds its own pool after the fork
+EXECUTOR = None
+EXECUTOR_LOCK = threading.Lock()
+# jobs of this worker not finished yet, bounded by JOB_QUEUE_SIZE
+PENDING_JOBS = 0
+# id of this worker in the job documents, and the descriptor of its flock'ed owner file in <ADMISSION_DIR>/jobs; the
+# kernel frees the flock when the worker dies, which tells the other workers that its unfinished jobs are lost
+WORKER_ID = None
+WORKER_FD = None
+UNFINISHED = ["queued", "running"]
+
+
+class JobQueueFull(admission.AdmissionRejected):
+    pass
+
+
+def owner_file(worker_id):
+    owner_dir = os.path.join(admission.ADMISSION_DIR, "jobs")
+    if not os.path.exists(owner_dir):
+        os.makedirs(owner_dir, exist_ok=True)
+    return os.path.join(owner_dir, worker_id)
+
+
+def owner_alive(worker_id):
+    if worker_id == WORKER_ID:
+        return True
+    fd = os.open(owner_file(worker_id), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return True
+    os.remove(owner_file(worker_id))
+    admission.unlock(fd)
+    return False
+
+
+class JobQueue:
+    def __init__(self, mongo_client):
+        file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+        with open(file_path) as f:
+            config = json.load(f)
+            f.close()
+        self.MAX_WORKERS = int(config.get("JOB_WORKERS", 2))
+        self.MAX_QUEUED = int(config.get("JOB_QUEUE_SIZE", 8))
+        self.MONGO_CLIENT = mongo_client
+
+    def get_executor(self):
+        global EXECUTOR, WORKER_ID, WORKER_FD
+        with EXECUTOR_LOCK:
+            if EXECUTOR is None:
+                WORKER_ID = uuid.uuid4().hex
+                WORKER_FD = os.open(owner_file(WORKER_ID), os.O_CREAT | os.O_RDWR, 0o644)
+                fcntl.flock(WORKER_FD, fcntl.LOCK_EX)
+                EXECUTOR = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+        return EXECUTOR
+
+    def recover_orphans(self, job_filter=None):
+        """Marks as error the queued and running jobs of the workers that died (uwsgi restart, crash): they were only
+        held in the memory of their worker and will never end. Returns the number of jobs marked
+        """
+        job_collection = self.MONGO_CLIENT["output"]["job"]
+        query = dict(job_filter or {})
+        query["status"] = {"$in": UNFINISHED}
+        owners = set(job.get("worker") for job in job_collection.find(query, {"worker": 1}))
+        marked = 0
+        for owner in owners:
+            # the jobs queued before the owners were recorded can't have survived a restart either
+            if owner is not None and owner_alive(owner):
+                continue
+            orphans = dict(query)
+            orphans["worker"] = owner
+            marked += job_collection.update_many(orphans, {"$set": {"status": "error",
+                                                                    "error": "Job lost by a restart of its worker",
+                                                                    "finished_at": datetime.datetime.utcnow()}}).modified_count
+        return marked
+
+    def submit(self, p_request_json, lane=None, ticket=None):
+        """Queues a CamaConvert.do_request payload and returns the id of the job. A job of an admission lane holds a job
+        ticket of the lane (taken here unless given, may raise admission.AdmissionRejected) and runs in one of its slots
+        """
+        if lane is not None and ticket is None:
+            ticket = admission.admit_job(lane)
+        try:
+            return self.queue_job(p_request_json, lane, ticket)
+        except Exception:
+            if ticket is not None:
+                admission.release(ticket)
+            raise
+
+    def queue_job(self, p_request_json, lane, ticket):
+        global PENDING_JOBS
+        executor = self.get_executor()
+        with EXECUTOR_LOCK:
+            if PENDING_JOBS >= self.MAX_QUEUED:
+                metrics.inc("cama_admission_rejected_total", 1, {"lane": lane or "none", "reason": "job_queue_full"})
+                raise JobQueueFull(lane, "The job queue is full, retry later", 10)
+            PENDING_JOBS += 1
+        try:
+            job_collection = self.MONGO_CLIENT["output"]["job"]
+            job_id = uuid.uuid4().hex
+            request_json = dict(p_request_json)
+            request_json.pop("async", None)
+            new_record = dict({"job_id": job_id, "status": "queued", "request": request_json, "worker": WORKER_ID,
+                               "submitted_at": datetime.datetime.utcnow()})
+            job_collection.insert_one(new_record)
+            executor.submit(self.run_job, job_id, request_json, lane, ticket)
+        except Exception:
+            with EXECUTOR_LOCK:
+                PENDING_JOBS -= 1
+            raise
+        return job_id
+
+    def run_job(self, job_id, p_request_json, lane=None, ticket=None):
+        global PENDING_JOBS
+        # Runs in the worker pool, so the job opens its own connection instead of sharing the request's one
+        db = DbConnect()
+        db.connect_db()
+        job_collection = None
+        slot = None
+        try:
+            mongo_client = db.get_connection()
+            job_collection = mongo_client["output"]["job"]
+            if lane is not None:
+                slot = admission.wait_for_slot(lane)
+            job_collection.update_one({"job_id": job_id}, {"$set": {"status": "running", "started_at": datetime.datetime.utcnow()}})
+            cama = CamaConvert(mongo_client)
+            result = cama.do_request(p_request_json)
+            job_collection.update_one({"job_id": job_id}, {"$set": {"status": "completed", "result": result,
+                                                                    "finished_at": datetime.datetime.utcnow()}})
+        except Exception as e:
+            # the job's only caller is the pool, so the failure goes to the job document and the metrics
+            metrics.inc("cama_jobs_failed_total", 1, {"request": str(p_request_json.get("request"))})
+            if job_collection is not None:
+                job_collection.update_one({"job_id": job_id}, {"$set": {"status": "error", "error": str(e),
+                                                                        "traceback": traceback.format_exc(),
+                                                                        "finished_at": datetime.datetime.utcnow()}})
+        finally:
+            with EXECUTOR_LOCK:
+                PENDING_JOBS -= 1
+            if slot is not None:
+                admission.release(slot)
+            if ticket is not None:
+                admission.release(ticket)
+            db.disconnect_db()
+
+    def job_status(self, job_id):
+        job_collection = self.MONGO_CLIENT["output"]["job"]
+        job = job_collection.find_one({"job_id": job_id}, {"_id": 0, "request": 0, "worker": 0, "traceback": 0})
+        if job is None:
+            return None
+        if job["status"] in UNFINISHED and self.recover_orphans({"job_id": job_id}) > 0:
+            job = job_collection.find_one({"job_id": job_id}, {"_id": 0, "request": 0, "worker": 0, "traceback": 0})
+        for key in ["submitted_at", "started_at", "finished_at"]:
+            if key in job:
+                job[key] = job[key].isoformat()
+        # do_request returns JSON text, anything else is returned as it was stored
+        if isinstance(job.get("result"), str):
+            try:
+                job["result"] = json.loads(job["result"])
+            except ValueError:
+                pass
+        return job
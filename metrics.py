@@ -0,0 +1,181 @@
+import contextlib
+import glob
+import json
+import os.path
+import tempfile
+import threading
+import time
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, shared by every histogram
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+HELP = {
+    "cama_http_request_seconds": "Latency of the Flask endpoints",
+    "cama_dropbox_download_seconds": "Latency of the Dropbox downloads",
+    "cama_dropbox_download_bytes_total": "Bytes downloaded from Dropbox",
+    "cama_dropbox_skipped_bytes_total": "Bytes not transferred because the content hash was unchanged",
+    "cama_file_read_seconds": "Time spent mapping the binary files / in numpy.loadtxt",
+    "cama_mongo_command_seconds": "Latency of the Mongo commands",
+    "cama_active_runs": "CaMa runs with the status running",
+    "cama_admission_wait_seconds": "Time the admitted requests waited for a slot of their lane",
+    "cama_admission_rejected_total": "Requests rejected by the admission control",
+}
+
+# Every uwsgi worker keeps its own samples and dumps them to <METRICS_DIR>/<pid>.json, /metrics sums the files up
+SAMPLES = {"counters": {}, "histograms": {}}
+SAMPLES_LOCK = threading.Lock()
+FLUSH_INTERVAL = 1.0  # seconds; hot loops record many samples and must not rewrite the file every time
+LAST_FLUSH = [0.0]
+# pid of the process whose deferred flush is scheduled; a forked worker doesn't inherit the timer thread of its parent
+PENDING_FLUSH = [None]
+
+
+def get_metrics_dir():
+    file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+    with open(file_path) as f:
+        config = json.load(f)
+        f.close()
+    metrics_dir = config.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "cama_metrics"))
+    if not os.path.exists(metrics_dir):
+        os.makedirs(metrics_dir)
+    return metrics_dir
+
+
+METRICS_DIR = get_metrics_dir()
+
+
+def series_key(name, labels=None):
+    if not labels:
+        return name
+    return name + "{" + ",".join('%s="%s"' % (k, labels[k]) for k in sorted(labels)) + "}"
+
+
+def flush(force=False):
+    # called with SAMPLES_LOCK held; a throttled flush is deferred to the end of the interval instead of dropped, so
+    # the last samples of a burst are written even if nothing is recorded after them
+    wait = FLUSH_INTERVAL - (time.time() - LAST_FLUSH[0])
+    if not force and wait > 0:
+        if PENDING_FLUSH[0] != os.getpid():
+            PENDING_FLUSH[0] = os.getpid()
+            timer = threading.Timer(wait, flush_pending)
+            timer.daemon = True
+            timer.start()
+        return
+    LAST_FLUSH[0] = time.time()
+    file_path = os.path.join(METRICS_DIR, str(os.getpid()) + ".json")
+    tmp_path = file_path + ".tmp" + str(threading.get_ident())
+    with open(tmp_path, "w") as f:
+        json.dump(SAMPLES, f)
+        f.close()
+    os.replace(tmp_path, file_path)
+
+
+def flush_pending():
+    with SAMPLES_LOCK:
+        PENDING_FLUSH[0] = None
+        flush(True)
+
+
+def inc(name, value=1, labels=None):
+    key = series_key(name, labels)
+    with SAMPLES_LOCK:
+        SAMPLES["counters"][key] = SAMPLES["counters"].get(key, 0) + value
+        flush()
+
+
+def observe(name, value, labels=None):
+    key = series_key(name, labels)
+    with SAMPLES_LOCK:
+        histogram = SAMPLES["histograms"].setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0, "count": 0})
+        for i in range(len(BUCKETS)):
+            if value <= BUCKETS[i]:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+        flush()
+
+
+@contextlib.contextmanager
+def timed(name, labels=None):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, labels)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Times every command sent by the pymongo clients created after the listener is registered"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe("cama_mongo_command_seconds", event.duration_micros / 1e6, {"command": event.command_name})
+
+    def failed(self, event):
+        observe("cama_mongo_command_seconds", event.duration_micros / 1e6, {"command": event.command_name})
+
+
+def register_mongo_listener():
+    monitoring.register(MongoCommandListener())
+
+
+def split_key(key):
+    if "{" not in key:
+        return key, ""
+    return key[:key.index("{")], key[key.index("{") + 1:-1]
+
+
+def render(gauges=None):
+    """Aggregates the samples of every worker into the Prometheus text format"""
+    with SAMPLES_LOCK:
+        flush(True)
+    counters = {}
+    histograms = {}
+    for file_path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(file_path) as f:
+                samples = json.load(f)
+                f.close()
+        except ValueError:
+            continue  # the worker is rewriting the file
+        for key, value in samples["counters"].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, value in samples["histograms"].items():
+            if key not in histograms:
+                histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0, "count": 0}
+            for i in range(len(BUCKETS)):
+                histograms[key]["buckets"][i] += value["buckets"][i]
+            histograms[key]["sum"] += value["sum"]
+            histograms[key]["count"] += value["count"]
+
+    lines = []
+    written = set()
+
+    def header(name, metric_type):
+        if name not in written:
+            written.add(name)
+            lines.append("# HELP " + name + " " + HELP.get(name, name))
+            lines.append("# TYPE " + name + " " + metric_type)
+
+    for key in sorted(counters):
+        name, labels = split_key(key)
+        header(name, "counter")
+        lines.append(key + " " + repr(counters[key]))
+    for key in sorted(histograms):
+        name, labels = split_key(key)
+        header(name, "histogram")
+        prefix = labels + "," if labels else ""
+        for i in range(len(BUCKETS)):
+            lines.append(name + '_bucket{' + prefix + 'le="' + str(BUCKETS[i]) + '"} ' + str(histograms[key]["buckets"][i]))
+        lines.append(name + '_bucket{' + prefix + 'le="+Inf"} ' + str(histograms[key]["count"]))
+        lines.append(name + "_sum" + ("{" + labels + "}" if labels else "") + " " + repr(histograms[key]["sum"]))
+        lines.append(name + "_count" + ("{" + labels + "}" if labels else "") + " " + str(histograms[key]["count"]))
+    for key, value in sorted((gauges or {}).items()):
+        name, labels = split_key(key)
+        header(name, "gauge")
+        lines.append(key + " " + repr(value))
+    return "\n".join(lines) + "\n"
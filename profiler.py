@@ -0,0 +1,57 @@
+import cProfile
+import datetime
+import glob
+import hashlib
+import hmac
+import json
+import os.path
+import threading
+
+PROFILE_HEADER = "X-Cama-Profile"
+
+
+class RequestProfiler:
+    def __init__(self):
+        file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+        with open(file_path) as f:
+            config = json.load(f)
+            f.close()
+        self.SECRET = config.get("PROFILE_SECRET", "")
+        self.PROFILE_DIR = config.get("PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+        self.MAX_FILES = int(config.get("PROFILE_MAX_FILES", 50))
+
+    def is_enabled(self, header_value):
+        # profiling stays off unless a secret is configured and the client sends exactly that secret
+        if not self.SECRET or header_value is None:
+            return False
+        return hmac.compare_digest(str(header_value), str(self.SECRET))
+
+    def profile(self, function, endpoint, params):
+        """Runs function() under cProfile and dumps the stats, tagged with the endpoint and parameters"""
+        if not os.path.exists(self.PROFILE_DIR):
+            os.makedirs(self.PROFILE_DIR)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function()
+        finally:
+            profile.disable()
+            params_json = json.dumps(params, sort_keys=True, default=str)
+            file_name = "_".join([endpoint, datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f"),
+                                  hashlib.sha1(params_json.encode()).hexdigest()[:8], str(threading.get_ident())])
+            profile.dump_stats(os.path.join(self.PROFILE_DIR, file_name + ".prof"))
+            with open(os.path.join(self.PROFILE_DIR, file_name + ".json"), "w") as f:
+                f.write(json.dumps({"endpoint": endpoint, "params": params}, default=str))
+                f.close()
+            print("Profile saved to " + file_name + ".prof")
+            self.prune()
+
+    def prune(self):
+        # keep only the newest MAX_FILES profiles
+        profiles = sorted(glob.glob(os.path.join(self.PROFILE_DIR, "*.prof")), key=os.path.getmtime)
+        for file_path in profiles[:max(len(profiles) - self.MAX_FILES, 0)]:
+            for path in [file_path, file_path[:-len(".prof")] + ".json"]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
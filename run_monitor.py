@@ -0,0 +1,108 @@
+import datetime
+import json
+import os.path
+import sys
+from db_connect import DbConnect
+
+
+class RunMonitor:
+    def __init__(self):
+        file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+        with open(file_path) as f:
+            config = json.load(f)
+            f.close()
+        self.DB = DbConnect()
+        self.BASE_PATH = config["CAMA_BASE_PATH"]
+
+    def find_run(self, folder_collection, folder_name=None):
+        # concurrent runs (sweep scenarios) pass their folder_name, a single run is the one with the status running
+        if folder_name:
+            return folder_collection.find_one({"folder_name": folder_name})
+        return folder_collection.find_one({"status": "running"})
+
+    def year_started(self, year, isp, nsp, folder_name=None):
+        """Called by the run script right before MAIN_day simulates a year"""
+        try:
+            self.DB.connect_db()
+            folder_collection = self.DB.get_connection()["output"]["folder"]
+            folder = self.find_run(folder_collection, folder_name)
+            if folder is None:
+                raise Exception("No Record in execution in Database")
+            progress = {"progress.current_year": year, "progress.isp": isp, "progress.nsp": nsp,
+                        "progress.year_started_at": datetime.datetime.utcnow()}
+            if "progress" not in folder:
+                progress["progress.run_started_at"] = progress["progress.year_started_at"]
+                progress["progress.years"] = []
+            folder_collection.update_one({"_id": folder["_id"]}, {"$set": progress})
+        finally:
+            self.DB.disconnect_db()
+
+    def year_finished(self, year, isp, nsp, folder_name=None, run_name="hamid"):
+        """Called by the run script after MAIN_day returns; records the wall time of the year"""
+        try:
+            self.DB.connect_db()
+            folder_collection = self.DB.get_connection()["output"]["folder"]
+            folder = self.find_run(folder_collection, folder_name)
+            if folder is None:
+                raise Exception("No Record in execution in Database")
+            started_at = folder.get("progress", {}).get("year_started_at")
+            # CaMa keeps writing run_<YEAR>.log until the year is done, so its mtime is the end of the simulation
+            log_path = os.path.join(self.BASE_PATH, "out", run_name, "run_" + str(year) + ".log")
+            if os.path.exists(log_path):
+                finished_at = datetime.datetime.utcfromtimestamp(os.path.getmtime(log_path))
+            else:
+                finished_at = datetime.datetime.utcnow()
+            seconds = None
+            if started_at is not None:
+                seconds = max((finished_at - started_at).total_seconds(), 0)
+            timing = {"year": year, "isp": isp, "seconds": seconds}
+            folder_collection.update_one({"_id": folder["_id"]}, {"$push": {"progress.years": timing},
+                                                                   "$set": {"progress.nsp": nsp}})
+        finally:
+            self.DB.disconnect_db()
+
+
+def estimate_progress(folder):
+    """Builds the progress summary, with an ETA, of a folder document written by RunMonitor"""
+    progress = folder.get("progress")
+    if progress is None:
+        return None
+    metadata = folder.get("metadata", {})
+    years = progress.get("years", [])
+    summary = {"current_year": progress.get("current_year"), "isp": progress.get("isp"), "nsp": progress.get("nsp"),
+               "years": years, "years_done": len(years), "eta_seconds": None, "stalled": False}
+    durations = [year["seconds"] for year in years if year.get("seconds") is not None]
+    if "start_year" not in metadata or "end_year" not in metadata:
+        return summary
+    # the start year is simulated once per spin-up iteration before the run moves on, an extension starts at resume_year;
+    # the years are clamped to the forcing data (1916..2011) as config_cama does
+    first_year = max(int(folder.get("resume_year", metadata["start_year"])), 1916)
+    last_year = min(int(metadata["end_year"]), 2011)
+    total = int(progress.get("nsp") or 0) + last_year - first_year + 1
+    summary["years_total"] = total
+    if len(durations) == 0 or folder.get("status") != "running":
+        return summary
+    average = sum(durations) / len(durations)
+    elapsed = 0
+    if progress.get("year_started_at") is not None and len(years) < total:
+        elapsed = (datetime.datetime.utcnow() - progress["year_started_at"]).total_seconds()
+    summary["average_year_seconds"] = average
+    summary["current_year_seconds"] = elapsed
+    summary["eta_seconds"] = max((total - len(years)) * average - elapsed, 0)
+    summary["stalled"] = elapsed > 3 * max(durations)
+    return summary
+
+
+if __name__ == "__main__":
+    # usage: python run_monitor.py start|end <YEAR> <ISP> <NSP> [<FOLDER_NAME> <RUN>]
+    try:
+        monitor = RunMonitor()
+        run_folder = sys.argv[5] if len(sys.argv) > 5 else None
+        if sys.argv[1] == "start":
+            monitor.year_started(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), run_folder)
+        else:
+            monitor.year_finished(int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]), run_folder,
+                                  sys.argv[6] if len(sys.argv) > 6 else "hamid")
+    except Exception as e:
+        # progress tracking must never stop the simulation itself
+        print("Unable to record progress: " + str(e))
@@ -0,0 +1,182 @@
+import glob
+import json
+import os.path
+import shutil
+import sys
+import cama_archive
+import cama_grid
+from db_connect import DbConnect, release_run_slot
+
+
+def load_config():
+    file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json")
+    with open(file_path) as f:
+        config = json.load(f)
+        f.close()
+    return config
+
+
+class StorageBackend:
+    """Where the CaMa outputs are kept. Backends implement the folder and file primitives, the run bookkeeping
+    (upload_output, recover) is shared.
+    """
+
+    def __init__(self):
+        config = load_config()
+        self.DB = DbConnect()
+        self.BASE_PATH = config["CAMA_BASE_PATH"]
+        self.ARCHIVE_OUTPUT = config.get("ARCHIVE_OUTPUT", False)
+
+    def create_folder(self, folder_name):
+        raise NotImplementedError
+
+    def folder_exists(self, folder_name):
+        raise NotImplementedError
+
+    def delete_folder(self, folder_name):
+        raise NotImplementedError
+
+    def purge_cache(self, folder_name):
+        """Drops the local copies of the folder's files, for the backends that keep any"""
+        pass
+
+    def upload_file(self, local_path, folder_name, file_name):
+        raise NotImplementedError
+
+    def download_file(self, folder_name, file_name, download_folder_name):
+        """Makes the file readable locally and returns its path"""
+        raise NotImplementedError
+
+    def find_run(self, folder_collection, folder_name=None):
+        # concurrent runs (sweep scenarios) pass their folder_name, a single run is the one with the status running
+        if folder_name:
+            return folder_collection.find_one({"folder_name": folder_name})
+        return folder_collection.find_one({"status": "running"})
+
+    def release_slot(self, mongo_client):
+        # the run slot is freed once the last running folder is done, a sweep holds it until all its scenarios end
+        if mongo_client["output"]["folder"].find_one({"status": "running"}) is None:
+            release_run_slot(mongo_client)
+
+    def upload_output(self, folder_name=None, run_name="hamid"):
+        folder_collection = None
+        folder = None
+        try:
+            self.DB.connect_db()
+            mongo_client = self.DB.get_connection()
+            folder_collection = mongo_client["output"]["folder"]
+            output_path = os.path.join(self.BASE_PATH, "out", run_name)
+            folder = self.find_run(folder_collection, folder_name)
+            if folder is None:
+                raise Exception("No Record in execution in Database")
+            if not self.folder_exists(folder["folder_name"]):
+                raise Exception("Folder doesn't exist in the storage")
+            # Uploading the results
+            vector_files = glob.glob(os.path.join(output_path, '*.vec'))
+            netcdf_files = glob.glob(os.path.join(output_path, '*.nc'))
+            for filename in vector_files + netcdf_files:
+                # land-only vector (LOUTVEC) and netCDF (LOUTCDF) outputs are uploaded as they are
+                self.upload_file(filename, folder["folder_name"], filename.split("/")[-1])
+            # an extension keeps the format of the years uploaded before, whatever ARCHIVE_OUTPUT says now
+            extension = "resume_year" in folder and "format" in folder
+            archive_output = folder["format"] == "archive" if extension else self.ARCHIVE_OUTPUT
+            grid = cama_grid.load_grid(os.path.join(self.BASE_PATH, "map", "hamid"))
+            for filename in glob.glob(os.path.join(output_path, '*.bin')):
+                file_name = filename.split("/")[-1]
+                if archive_output and cama_archive.OUTPUT_NAME.match(file_name):
+                    # the yearly outputs are uploaded as compressed archives instead of raw binaries
+                    archive_path = os.path.join(output_path, cama_archive.archive_name(file_name))
+                    cama_archive.write_archive(filename, archive_path, grid.cells)
+                    self.upload_file(archive_path, folder["folder_name"], cama_archive.archive_name(file_name))
+                else:
+                    self.upload_file(filename, folder["folder_name"], file_name)
+            # End of loop
+            output_format = "archive" if archive_output else "bin"
+            if extension:
+                output_format = folder["format"]
+            elif len(vector_files) > 0:
+                output_format = "vector"
+            elif len(netcdf_files) > 0:
+                output_format = "netcdf"
+            folder_collection.update({"_id": folder["_id"]}, {"$set": {"status": "completed", "format": output_format}})
+            self.release_slot(mongo_client)
+        except Exception as e:
+            if folder_collection is not None and folder is not None:
+                folder_collection.update({"_id": folder["_id"]}, {"$set": {"status": "error"}})
+            raise e
+        finally:
+            self.DB.disconnect_db()
+
+    def recover(self, folder_name=None):
+        try:
+            self.DB.connect_db()
+            mongo_client = self.DB.get_connection()
+            folder_collection = mongo_client["output"]["folder"]
+            try:
+                folder = self.find_run(folder_collection, folder_name)
+                if folder is not None:
+                    folder_collection.update({"_id": folder["_id"]}, {"$set": {"status": "error"}})
+                    # an extended run keeps the years uploaded before the extension
+                    if "resume_year" not in folder and self.folder_exists(folder["folder_name"]):
+                        self.delete_folder(folder["folder_name"])
+            finally:
+                self.release_slot(mongo_client)
+        finally:
+            self.DB.disconnect_db()
+
+
+class LocalStorage(StorageBackend):
+    """Keeps the outputs in a directory of the compute host (or a mounted object store), reads need no copy"""
+
+    def __init__(self, root=None):
+        super().__init__()
+        self.ROOT = root if root is not None else load_config().get("LOCAL_STORAGE_PATH", os.path.join(self.BASE_PATH, "storage"))
+
+    def create_folder(self, folder_name):
+        os.makedirs(os.path.join(self.ROOT, folder_name))
+
+    def folder_exists(self, folder_name):
+        return os.path.isdir(os.path.join(self.ROOT, folder_name))
+
+    def delete_folder(self, folder_name):
+        shutil.rmtree(os.path.join(self.ROOT, folder_name))
+
+    def upload_file(self, local_path, folder_name, file_name):
+        target = os.path.join(self.ROOT, folder_name, file_name)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            # the run directory is wiped after the upload, so a hard link is enough when both are on the same disk
+            os.link(local_path, target)
+        except OSError:
+            shutil.copyfile(local_path, target)
+
+    def download_file(self, folder_name, file_name, download_folder_name):
+        file_path = os.path.join(self.ROOT, folder_name, file_name)
+        if not os.path.isfile(file_path):
+            raise Exception("File doesn't exist in the storage: " + folder_name + "/" + file_name)
+        return file_path
+
+
+def get_storage():
+    """Returns the backend selected by STORAGE_BACKEND in config.json ("dropbox" by default)"""
+    backend = load_config().get("STORAGE_BACKEND", "dropbox")
+    if backend == "local":
+        return LocalStorage()
+    elif backend == "dropbox":
+        # imported here so that local deployments don't need the dropbox package
+        from dropbox_connect import DropBox
+        return DropBox()
+    raise Exception("Unknown storage backend: " + backend)
+
+
+if __name__ == "__main__":
+    # usage: python storage.py [<FOLDER_NAME> <RUN>]
+    storage = None
+    run_folder = sys.argv[1] if len(sys.argv) > 1 else None
+    try:
+        storage = get_storage()
+        storage.upload_output(run_folder, sys.argv[2] if len(sys.argv) > 2 else "hamid")
+    except Exception as e:
+        if storage is not None:
+            storage.recover(run_folder)
@@ -19,11 +19,12 @@ cd ${CAMADIR}/gosh
 
 ##### Basic Settings ##################
 BASE=$CAMADIR                         #   base directory
-EXP="hamid"                    #   experiment name (output directory name)
+EXP="hamid"                    #   experiment name (runoff input directory name)
 # EXP="region_15min"                    # regional simulation
-RDIR=${BASE}/out/$EXP                 #   directory to run CaMa-Flood
+RUN="<RUN>"                           #   run name (map and output directory name), "hamid" except for sweep scenarios
+RDIR=${BASE}/out/$RUN                 #   directory to run CaMa-Flood
 PROG=${BASE}/src/MAIN_day             #   main program
-export OMP_NUM_THREADS=4              #   OpenMP cpu num
+export OMP_NUM_THREADS=<OMP_NUM_THREADS>  #   OpenMP cpu num (set by config_cama)
 LFLDOUT=".TRUE."                      #   .TRUE. to activate floodplain discharge
 LPTHOUT=".FALSE."                     #   .TRUE. to activate bifurcation flow, mainly for delta simulation
 LSTOONLY=".FALSE."                    #   .TRUE. for restart only from storage (no previous-time-step discharge)
@@ -38,12 +39,12 @@ DTIN=86400                            #   input runoff time step [sec]
 ##### Simulation Time #################
 YSTART=<SYEAR>                       #   start year (from YSTART / Jan / 1st )
 YEND=<EYEAR>
-SPINUP=2                              #   1 for restart, 2 for spinup
+SPINUP=<SPINUP>                       #   1 for restart, 2 for spinup (set by config_cama)
 NSP=5                                 #   spinup years
 # CRESTSTO="set-by-shell"               #   restart file name
 
 ##### Map & Topography ################
-FMAP=${BASE}/map/$EXP       #   map directory
+FMAP=${BASE}/map/$RUN       #   map directory
 # FMAP="${BASE}/map/region_15min"       # (regional map) 
 
 CDIMINFO="${FMAP}/diminfo_0625.txt"   #   dimention info (1deg, 0E->360E, 90N-90S)
@@ -88,28 +89,29 @@ CROFSUF=".bin"
 DROFUNIT=1.D-3                             #   runoff unit conversion (1.D-3 when input [mm] is converted to [m3/m2])
 
 ##### Output Settings #################
-mkdir ../out/$EXP
-LOUTCDF=".FALSE."                     # true for netCDF output, false for plain binary output
+mkdir ../out/$RUN
+LOUTCDF="<LOUTCDF>"                   # true for netCDF output, false for plain binary output (set by config_cama)
+LOUTVEC="<LOUTVEC>"                   # true for 1-D land-only output (*.vec), decoded by cama_convert with map nextxy.bin
 COUTDIR="./"                          # output directory 
 
-# output variables set "NONE" for no output
-CRIVOUTDIR="NONE"                     #   river discharge         [m3/s]
-CRIVSTODIR="NONE"                     #   river storage           [m3]
-CRIVVELDIR="NONE"                     #   river flow velocity     [m/s]
-CRIVDPHDIR="NONE"                 #   river water depth       [m]
+# output variables set "NONE" for no output (set by config_cama from the run's output_variables)
+CRIVOUTDIR="<CRIVOUTDIR>"                     #   river discharge         [m3/s]
+CRIVSTODIR="<CRIVSTODIR>"                     #   river storage           [m3]
+CRIVVELDIR="<CRIVVELDIR>"                     #   river flow velocity     [m/s]
+CRIVDPHDIR="<CRIVDPHDIR>"                 #   river water depth       [m]
 
-CFLDOUTDIR="NONE"                     #   floodplain discharge    [m3/s]
-CFLDSTODIR="NONE"                     #   floodplain storage      [m]
-CFLDDPHDIR="NONE"                 #   floodplain water depth  [m]
-CFLDAREDIR="NONE"                 #   flooded area            [m]
-CFLDFRCDIR="NONE"                 #   flooded area fraction   [m2/m2]
+CFLDOUTDIR="<CFLDOUTDIR>"                     #   floodplain discharge    [m3/s]
+CFLDSTODIR="<CFLDSTODIR>"                     #   floodplain storage      [m]
+CFLDDPHDIR="<CFLDDPHDIR>"                 #   floodplain water depth  [m]
+CFLDAREDIR="<CFLDAREDIR>"                 #   flooded area            [m]
+CFLDFRCDIR="<CFLDFRCDIR>"                 #   flooded area fraction   [m2/m2]
 
-CSFCELVDIR="NONE"                 #   water surface elevation [m]
-COUTFLWDIR="$COUTDIR"                 #   total discharge (rivout+fldout)   [m3/s]
-CSTORGEDIR="$COUTDIR"                 #   total storage (rivsto+fldsto)     [m3]
+CSFCELVDIR="<CSFCELVDIR>"                 #   water surface elevation [m]
+COUTFLWDIR="<COUTFLWDIR>"                 #   total discharge (rivout+fldout)   [m3/s]
+CSTORGEDIR="<CSTORGEDIR>"                 #   total storage (rivsto+fldsto)     [m3]
 
-CPTHOUTDIR="NONE"                 #   net bifurcation flow (grid-based) [m3/s]
-CPTHFLWDIR="NONE"                 #   bifurcation flow (channel based)  [m3/s]
+CPTHOUTDIR="<CPTHOUTDIR>"                 #   net bifurcation flow (grid-based) [m3/s]
+CPTHFLWDIR="<CPTHFLWDIR>"                 #   bifurcation flow (channel based)  [m3/s]
 
 ##### Model Parameters ################
 # PMANRIV=0.03D0                        # manning coefficient river
@@ -245,7 +247,7 @@ CSTORGEDIR="${CSTORGEDIR}"          ! total storage   (rivsto+fldsto)   [m3]
 CPTHOUTDIR="${CPTHOUTDIR}"          ! net bifurcation flow (grid-based) [m3/s]
 CPTHFLWDIR="${CPTHFLWDIR}"          ! bifurcation flow (channel-based)  [m3/s]
 COUTINSDIR="NONE"                   ! instantaneous discharge (no river routing, summation of upstream runoff)
-LOUTVEC=.FALSE.                     ! for 1-D land-only output (small data size, post processing required)
+LOUTVEC=${LOUTVEC}                  ! for 1-D land-only output (small data size, post processing required)
 /
 &NCONF                              ! * NX, NY, NFLP, NXIN, NYIN, INPN, WEST, EAST, NORTH, SOUTH set by diminfo.txt
 DT=$DT                              ! time step [sec]
@@ -269,8 +271,10 @@ PMINSLP=1.D-5                       ! * minimum slope (for kinematic wave)
 EOF
 
 echo "start: ${ISYEAR}" `date` >> log.txt
+python ${APIDIR}/run_monitor.py start ${ISYEAR} ${ISP} ${NSP} <FOLDER_NAME> ${RUN}
 time ./MAIN_day > run_${ISYEAR}.log 
 echo "end:   ${ISYEAR}" `date` >> log.txt
+python ${APIDIR}/run_monitor.py end ${ISYEAR} ${ISP} ${NSP} <FOLDER_NAME> ${RUN}
 
 ###################
 
@@ -293,6 +297,7 @@ then
     mkdir ${IYR}-sp${ISP}
     mv ??????${IYR}.bin ${IYR}-sp${ISP}
     mv ??????${IYR}.pth ${IYR}-sp${ISP}
+    mv ??????${IYR}.vec ${IYR}-sp${ISP}
     mv ??????${IYR}.nc  ${IYR}-sp${ISP}
     mv *${IYR}.log      ${IYR}-sp${ISP}
 
@@ -308,11 +313,11 @@ fi
 
 done # loop to next year simulation
 
-# starting the subprocess to store the results to dropbox
-echo "saving the output to dropbox"
-python ${APIDIR}/dropbox_connect.py
+# starting the subprocess to store the results to the storage backend
+echo "saving the output to the storage"
+python ${APIDIR}/storage.py <FOLDER_NAME> ${RUN}
 
 echo "deleting any previous generated output in the server"
-rm -rf ${BASE}/out/*
+rm -rf ${RDIR}
 
 exit 0
@@ -0,0 +1,85 @@
+import os.path
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark"))
+
+import admission  # noqa: E402
+import job_queue  # noqa: E402
+from stand_ins import LocalMongoClient  # noqa: E402
+from test_storage import MemoryDbConnect  # noqa: E402
+
+
+@pytest.fixture
+def lanes(tmp_path, monkeypatch):
+    lanes = {"analysis": {"limit": 1, "queue": 1, "max_wait": 0.3, "jobs": 1}}
+    os.makedirs(os.path.join(str(tmp_path), "analysis"))
+    monkeypatch.setattr(admission, "ADMISSION_DIR", str(tmp_path))
+    monkeypatch.setattr(admission, "LANES", lanes)
+    return lanes
+
+
+def test_admit_queues_until_a_slot_is_released(lanes):
+    slot = admission.admit("analysis")
+    timer = threading.Timer(0.1, admission.release, [slot])
+    timer.start()
+    start = time.time()
+    admission.release(admission.admit("analysis"))
+    assert 0.05 < time.time() - start < 0.3
+    timer.join()
+
+
+def test_admit_times_out_after_max_wait(lanes):
+    slot = admission.admit("analysis")
+    start = time.time()
+    with pytest.raises(admission.AdmissionRejected) as rejected:
+        admission.admit("analysis")
+    assert time.time() - start >= 0.3
+    assert rejected.value.LANE == "analysis"
+    assert rejected.value.RETRY_AFTER == 1
+    admission.release(slot)
+
+
+def test_admit_rejects_at_once_when_the_queue_is_full(lanes):
+    lanes["analysis"]["queue"] = 0
+    slot = admission.admit("analysis")
+    start = time.time()
+    with pytest.raises(admission.AdmissionRejected):
+        admission.admit("analysis")
+    assert time.time() - start < 0.1
+    admission.release(slot)
+    admission.release(admission.admit("analysis"))
+
+
+class RecordingCama:
+    def __init__(self, mongo_client):
+        pass
+
+    def do_request(self, request_json):
+        return '{"done": true}'
+
+
+def test_jobs_hold_a_ticket_and_run_in_a_slot_of_their_lane(lanes, monkeypatch):
+    mongo_client = LocalMongoClient()
+    monkeypatch.setattr(job_queue, "DbConnect", lambda: MemoryDbConnect(mongo_client))
+    monkeypatch.setattr(job_queue, "CamaConvert", RecordingCama)
+    jobs = job_queue.JobQueue(mongo_client)
+    slot = admission.admit("analysis")
+    job_id = jobs.submit({"request": "analysis"}, "analysis")
+    # the lane's single job ticket is taken by the queued job
+    with pytest.raises(admission.AdmissionRejected):
+        jobs.submit({"request": "analysis"}, "analysis")
+    time.sleep(0.2)
+    assert jobs.job_status(job_id)["status"] == "queued"
+    admission.release(slot)
+    for _ in range(100):
+        if jobs.job_status(job_id)["status"] == "completed":
+            break
+        time.sleep(0.05)
+    assert jobs.job_status(job_id)["result"] == {"done": True}
+    # the ticket and the slot are given back when the job ends
+    admission.release(admission.admit_job("analysis"))
+    admission.release(admission.admit("analysis"))
@@ -0,0 +1,80 @@
+import json
+import os.path
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark"))
+
+import app  # noqa: E402
+import cama_convert  # noqa: E402
+from stand_ins import LocalMongoClient  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+from test_storage import MemoryDbConnect  # noqa: E402
+
+POST_RUN = {"riv_base": 0.03, "fld_base": 0.1, "start_year": 1990, "end_year": 1991, "folder_name": "post_run"}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "get_db", lambda: LocalMongoClient())
+    monkeypatch.setattr(cama_convert, "get_storage", lambda: LocalStorage(str(tmp_path)))
+    monkeypatch.setattr(app, "ENDPOINT_LANES", {})
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize("sites", [[5], ["site"], [{"lat": 1, "lon": 2}], []])
+def test_run_post_rejects_malformed_sites(client, sites):
+    response = client.post("/cama_run/post", json=dict(POST_RUN, sites=sites))
+    assert response.status_code == 400
+
+
+def test_missing_keys_are_a_bad_request(client):
+    response = client.post("/river_profile", json={"pre_path": "pre"})
+    assert response.status_code == 400
+    assert b"Missing required input key: post_path" in response.data
+
+
+def test_get_db_attempts_each_startup_step_once(monkeypatch):
+    attempts = []
+
+    def failing_indexes(mongo_client):
+        attempts.append("indexes")
+        raise Exception("not authorized")
+
+    class RecordingJobQueue:
+        def __init__(self, mongo_client):
+            pass
+
+        def recover_orphans(self):
+            attempts.append("orphans")
+
+    monkeypatch.setattr(app, "DbConnect", lambda: MemoryDbConnect(LocalMongoClient()))
+    monkeypatch.setattr(app, "ensure_indexes", failing_indexes)
+    monkeypatch.setattr(app, "JobQueue", RecordingJobQueue)
+    monkeypatch.setattr(app, "INDEXES_ENSURED", False)
+    monkeypatch.setattr(app, "ORPHANS_RECOVERED", False)
+    for _ in range(2):
+        with app.app.app_context():
+            app.get_db()
+    # the failed indexes neither stop the recovery nor are retried on the next request
+    assert attempts == ["indexes", "orphans"]
+
+
+def test_climatology_build_is_queued_by_default(client, monkeypatch):
+    submitted = []
+
+    class RecordingJobQueue:
+        def __init__(self, mongo_client):
+            pass
+
+        def submit(self, request_data, lane=None, ticket=None):
+            submitted.append(request_data["request"])
+            return "job"
+
+    monkeypatch.setattr(app, "JobQueue", RecordingJobQueue)
+    response = client.post("/climatology/build", json={"folder_name": "post_run"})
+    assert response.status_code == 202 and json.loads(response.data) == {"job_id": "job", "status": "queued"}
+    # run inline on request, where the missing folder is reported at once
+    response = client.post("/climatology/build", json={"folder_name": "post_run", "async": False})
+    assert response.status_code == 500 and submitted == ["build_climatology"]
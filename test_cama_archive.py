@@ -0,0 +1,48 @@
+import os.path
+
+import numpy
+import pytest
+
+import cama_archive
+
+
+def write_output(tmp_path, days, cells):
+    rng = numpy.random.default_rng(3)
+    data = rng.random(days * cells, dtype=numpy.float32) * 500
+    data[::11] = 1e20  # the no-data filler must come back as is
+    bin_path = str(tmp_path / "outflw1990.bin")
+    data.tofile(bin_path)
+    return bin_path, data
+
+
+def test_archive_round_trips_the_output(tmp_path):
+    # 150 cells: the last block is partial
+    bin_path, data = write_output(tmp_path, 365, 150)
+    archive_path = str(tmp_path / cama_archive.archive_name("outflw1990.bin"))
+    cama_archive.write_archive(bin_path, archive_path, 150)
+    assert archive_path.endswith("outflw1990.cca") and cama_archive.is_archive(archive_path)
+    assert os.path.getsize(archive_path) < os.path.getsize(bin_path)
+    assert numpy.array_equal(cama_archive.read_all(archive_path), data)
+
+
+def test_read_values_gathers_like_the_flat_array(tmp_path):
+    bin_path, data = write_output(tmp_path, 366, 150)
+    archive_path = str(tmp_path / "outflw1990.cca")
+    cama_archive.write_archive(bin_path, archive_path, 150)
+    # one cell over all the days, cells of several blocks, and negative indices from the end
+    cell = 130 + 150 * numpy.arange(366)
+    mixed = numpy.asarray([0, 63, 64, 149, 150 * 200 + 70, -1, -150])
+    for indices in [cell, mixed]:
+        assert numpy.array_equal(cama_archive.read_values(archive_path, indices), data[indices])
+
+
+def test_write_archive_rejects_a_size_off_the_grid(tmp_path):
+    bin_path, data = write_output(tmp_path, 365, 150)
+    with pytest.raises(Exception, match="doesn't match the grid"):
+        cama_archive.write_archive(bin_path, str(tmp_path / "outflw1990.cca"), 149)
+
+
+def test_read_header_rejects_other_files(tmp_path):
+    bin_path, data = write_output(tmp_path, 365, 150)
+    with pytest.raises(Exception, match="Not a CaMa archive"):
+        cama_archive.read_values(bin_path, [0])
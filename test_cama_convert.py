@@ -0,0 +1,236 @@
+import os.path
+import sys
+
+import numpy
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark"))
+
+import cama_convert  # noqa: E402
+import db_connect  # noqa: E402
+import synthetic  # noqa: E402
+from stand_ins import LocalMongoClient  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+
+RESTART = "restart19960101.bin"
+
+
+class FinishedProcess:
+    def wait(self):
+        return 0
+
+
+@pytest.fixture
+def cama(tmp_path, monkeypatch):
+    """A CamaConvert over a synthetic CaMa tree, a local storage and an in-memory Mongo; commands are recorded"""
+    base_path = str(tmp_path / "cama")
+    synthetic.write_static(base_path)
+    storage = LocalStorage(str(tmp_path / "storage"))
+    commands = []
+    monkeypatch.setattr(cama_convert, "get_storage", lambda: storage)
+    monkeypatch.setattr(cama_convert.subprocess, "Popen", lambda command, shell=False: commands.append(command) or FinishedProcess())
+    monkeypatch.chdir(tmp_path)
+    converter = cama_convert.CamaConvert(LocalMongoClient())
+    converter.BASE_PATH = base_path
+    converter.COMMANDS = commands
+    return converter
+
+
+def completed_post_run(cama, folder_name="post_run", folder_format="bin"):
+    metadata = {"p_lat": synthetic.NORTH - 0.25, "p_lon": synthetic.WEST + 0.25, "p_riv_base": 0.03, "p_riv_new": 0.06,
+                "p_fld_base": 0.1, "p_fld_new": 0.2, "size_wetland": 1, "start_year": 1990, "end_year": 1995,
+                "output_variables": ["outflw"], "threads": 1}
+    cama.MONGO_CLIENT["output"]["folder"].insert_one({"model": "postflow", "status": "completed", "folder_name": folder_name,
+                                                      "format": folder_format, "metadata": metadata})
+    cama.STORAGE.create_folder(folder_name)
+    with open(os.path.join(cama.STORAGE.ROOT, folder_name, RESTART), "wb") as f:
+        f.write(b"restart state")
+    return cama.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": folder_name})
+
+
+def test_extend_resumes_from_the_restart_file(cama):
+    completed_post_run(cama)
+    assert cama.extend_cama_post("post_run", 2000) == "Execution queued"
+
+    with open(os.path.join(cama.BASE_PATH, "out", "hamid", RESTART), "rb") as f:
+        assert f.read() == b"restart state"
+    with open(cama.script_path("post")) as f:
+        script = f.read()
+    assert "YSTART=1996" in script and "YEND=2000" in script
+    assert cama.COMMANDS[-1].endswith("/gosh/hamid_post.sh")
+    folder = cama.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": "post_run"})
+    assert folder["status"] == "running" and folder["resume_year"] == 1996 and folder["metadata"]["end_year"] == 2000
+    # the extension holds the run slot
+    assert db_connect.claim_run_slot(cama.MONGO_CLIENT) is None
+
+
+def test_extend_rolls_the_metadata_back_on_error(cama, monkeypatch):
+    completed_post_run(cama)
+
+    def failing_config(*args, **kwargs):
+        raise IOError("template missing")
+
+    monkeypatch.setattr(cama, "config_cama", failing_config)
+    with pytest.raises(IOError):
+        cama.extend_cama_post("post_run", 2000)
+
+    folder = cama.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": "post_run"})
+    assert folder["status"] == "completed" and folder["metadata"]["end_year"] == 1995 and "resume_year" not in folder
+    assert db_connect.claim_run_slot(cama.MONGO_CLIENT) is not None
+
+
+@pytest.mark.parametrize("folder_format, netcdf_output, vector_output", [("bin", False, False), ("archive", False, False),
+                                                                         ("vector", False, True), ("netcdf", True, False)])
+def test_extend_writes_the_format_of_the_folder(cama, monkeypatch, folder_format, netcdf_output, vector_output):
+    completed_post_run(cama, folder_format=folder_format)
+    calls = []
+    monkeypatch.setattr(cama, "config_cama", lambda model, s_year, e_year, variables, threads, netcdf, **kwargs:
+                        calls.append((netcdf, kwargs["vector_output"])))
+    cama.extend_cama_post("post_run", 2000)
+    assert calls == [(netcdf_output, vector_output)]
+
+
+def test_extend_refuses_unknown_formats(cama):
+    completed_post_run(cama, folder_format="zarr")
+    with pytest.raises(Exception, match="can't be extended"):
+        cama.extend_cama_post("post_run", 2000)
+    assert cama.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": "post_run"})["status"] == "completed"
+
+
+def test_sweep_scenarios_apply_their_size_wetland(cama):
+    sizes = []
+    # the scenario maps are copied by the (recorded) sudo cp, so only the sites given to update_manning are checked
+    cama.update_manning = lambda *args, **kwargs: sizes.append([site["size_wetland"] for site in kwargs["sites"]])
+    result = cama.run_cama_sweep(1990, 1991, synthetic.NORTH - 0.25, synthetic.WEST + 0.25, 0.03, 0.1,
+                                 {"riv_new": [0.06], "fld_new": [0.2], "size_wetland": [0, 2]}, core_budget=2)
+    assert result["scenarios"] == 2 and sizes == [[0], [2]]
+
+
+class FailedProcess:
+    def wait(self):
+        return 1
+
+
+def sweep_with_failed_copies(cama, monkeypatch, failed):
+    """Runs a two scenario sweep whose map copies fail for the scenarios listed in failed"""
+    commands = cama.COMMANDS
+    monkeypatch.setattr(cama_convert.subprocess, "Popen", lambda command, shell=False: commands.append(command) or (
+        FailedProcess() if "cp -avr" in command and int(command[-1]) in failed else FinishedProcess()))
+    cama.update_manning = lambda *args, **kwargs: None
+    return cama.run_cama_sweep(1990, 1991, synthetic.NORTH - 0.25, synthetic.WEST + 0.25, 0.03, 0.1,
+                               {"riv_new": [0.06], "fld_new": [0.2], "size_wetland": [0, 2]}, core_budget=2)
+
+
+def test_sweep_runs_the_scenarios_whose_map_was_copied(cama, monkeypatch):
+    result = sweep_with_failed_copies(cama, monkeypatch, [0])
+    assert result["scenarios"] == 1
+    statuses = {folder["folder_name"][-1]: folder["status"] for folder in cama.MONGO_CLIENT["output"]["folder"].find()}
+    assert statuses == {"0": "error", "1": "running"}
+    with open(cama.script_path("sweep", "sweep_" + result["sweep_id"])) as f:
+        script = f.read()
+    # the sweep script removes the scenario scripts and itself when it exits
+    assert "trap 'rm -f " + cama.script_path("post", "sweep_" + result["sweep_id"] + "_1") in script
+    assert "_0.sh" not in script
+
+
+def test_sweep_without_any_copied_map_releases_the_slot(cama, monkeypatch):
+    with pytest.raises(Exception, match="could copy its map"):
+        sweep_with_failed_copies(cama, monkeypatch, [0, 1])
+    assert cama.MONGO_CLIENT["output"]["sweep"].find_one()["status"] == "error"
+    assert db_connect.claim_run_slot(cama.MONGO_CLIENT) is not None
+
+
+def test_failed_sweep_removes_its_scripts(cama, monkeypatch):
+    def failing_config(*args, **kwargs):
+        if kwargs["run_name"].endswith("_1"):
+            raise IOError("template missing")
+        open(cama.script_path("post", kwargs["run_name"]), "w").close()
+
+    monkeypatch.setattr(cama, "config_cama", failing_config)
+    with pytest.raises(IOError):
+        sweep_with_failed_copies(cama, monkeypatch, [])
+    assert sorted(os.listdir(os.path.join(cama.BASE_PATH, "gosh"))) == ["hamid_post_template.sh", "hamid_pre_template.sh"]
+
+
+def test_sweep_status_queues_the_summary_once(cama, monkeypatch):
+    submitted = []
+    monkeypatch.setattr("job_queue.JobQueue.submit",
+                        lambda self, request_json, lane=None: submitted.append((request_json, lane)) or "job1")
+    sweep_id = str(cama.MONGO_CLIENT["output"]["sweep"].insert_one(
+        {"status": "running", "concurrency": 1, "baseline_folder": "baseline",
+         "scenarios": [{"folder_name": "scenario_0"}]}).inserted_id)
+    completed_post_run(cama, "scenario_0")
+
+    for poll in range(2):
+        entry = cama.sweep_status(sweep_id)["scenarios"][0]
+        assert entry["summary"] is None and entry["summary_job"] == "job1"
+    assert submitted == [({"request": "summarize_scenario", "folder_name": "scenario_0", "baseline_folder": "baseline"}, "analysis")]
+
+
+def lowered_layers(cama):
+    # (layer, row) pairs of fldhgt.bin lowered from fldhgt_original.bin
+    map_path = os.path.join(cama.BASE_PATH, "map", "hamid")
+    original = numpy.fromfile(os.path.join(map_path, "fldhgt_original.bin"), dtype=numpy.float32)
+    updated = numpy.fromfile(os.path.join(map_path, "fldhgt.bin"), dtype=numpy.float32)
+    return [(int(k) // (synthetic.NX * synthetic.NY), int(k) % (synthetic.NX * synthetic.NY))
+            for k in numpy.flatnonzero(updated < original)]
+
+
+def test_one_site_list_lowers_fewer_layers_than_the_single_wetland(cama):
+    lat, lon = numpy.loadtxt(os.path.join(cama.BASE_PATH, "map", "hamid", "wetland_loc_multiple"))[3]
+    site = {"lat": lat, "lon": lon, "riv_new": 0.06, "fld_new": 0.2, "size_wetland": 1}
+    row = cama.coord_to_grid_cell(lat, lon) - 1
+
+    cama.update_manning(lat, lon, 0.03, 0.06, 0.1, 0.2, 1)
+    assert lowered_layers(cama) == [(layer, row) for layer in range(synthetic.NLFP)]
+    cama.update_manning(None, None, 0.03, None, 0.1, None, None, sites=[site])
+    assert lowered_layers(cama) == [(0, row), (1, row)]
+
+
+def test_preload_static_loads_the_tables_around_a_missing_one(cama, monkeypatch):
+    os.remove(os.path.join(cama.BASE_PATH, "map", "hamid", "nextxy.bin"))
+    # as in the uwsgi master, where no storage backend is built
+    monkeypatch.setattr(cama_convert, "get_storage", None)
+    errors = cama_convert.preload_static(cama.BASE_PATH)
+    assert sorted(errors) == ["land sequence", "nextxy.bin"]
+    for table in [os.path.join("map", "hamid", "lonlat"), os.path.join("res", "nextxy.txt"),
+                  os.path.join("inp", "hamid_dates_1915_2011")]:
+        assert os.path.join(cama.BASE_PATH, table) in cama_convert.STATIC_TABLES
+    assert os.path.join(cama.BASE_PATH, "map", "hamid", "lonlat") in cama_convert.CELL_INDEXES
+
+
+def write_small_map(cama):
+    """A 4 x 2 map: two rivers join at (3, 1) and reach the mouth (4, 1); (3, 2) is an inland termination and (4, 2)
+    is outside the river network"""
+    map_path = os.path.join(cama.BASE_PATH, "map", "hamid")
+    with open(os.path.join(map_path, "diminfo_0625.txt"), "w") as f:
+        f.write(synthetic.DIMINFO % (4, 2, 10, 4, 2, "./inpmat.bin", 0.0, 4.0, 2.0, 0.0))
+    next_x = [[2, 3, 4, -9], [2, 3, -10, -9999]]
+    next_y = [[1, 1, 1, -9], [2, 1, -10, -9999]]
+    numpy.asarray([next_x, next_y], dtype=numpy.int32).tofile(os.path.join(map_path, "nextxy.bin"))
+
+
+def test_land_sequence_follows_calc_seq(cama):
+    write_small_map(cama)
+    # the sources in row-major order, then downstream once all the upstream cells are in, then the mouth and the
+    # inland termination
+    assert list(cama.land_sequence()) == [0, 4, 1, 5, 2, 3, 6]
+
+
+def test_read_vector_puts_the_land_cells_back_in_the_grid(cama, tmp_path):
+    write_small_map(cama)
+    vector = numpy.arange(2 * 7, dtype=numpy.float32).reshape(2, 7)
+    file_path = str(tmp_path / ("outflw1990" + cama_convert.VECTOR_EXTENSION))
+    vector.tofile(file_path)
+
+    grid = cama.read_vector(file_path).reshape(2, 8)
+    assert list(grid[1]) == [7, 9, 11, 12, 8, 10, 13, cama_convert.MISSING_VALUE]
+    indices = numpy.asarray([0, 5, 7, 8 + 6, -1, -8])
+    assert numpy.array_equal(cama.read_vector_values(file_path, indices), grid.ravel()[indices])
+
+
+def test_build_climatology_refuses_maps_over_the_cell_limit(cama):
+    completed_post_run(cama)
+    cama.MAX_CLIMATOLOGY_CELLS = synthetic.NX * synthetic.NY - 1
+    with pytest.raises(ValueError, match="MAX_CLIMATOLOGY_CELLS"):
+        cama.build_climatology("post_run")
@@ -0,0 +1,78 @@
+import os.path
+
+import numpy
+
+import cama_grid
+
+STANDARD_DIMINFO = """        1440     !! nXX
+         720     !! nYY
+          10     !! floodplain layer
+        1440     !! input nXX
+         720     !! input nYY
+           1     !! input nLFP (if only 1 layer)
+./inpmat-15min.bin
+    -180.000     !! west  edge
+     180.000     !! east  edge
+      90.000     !! north edge
+     -90.000     !! south edge
+"""
+
+
+def write_map(tmp_path, diminfo, lonlat=None):
+    map_path = str(tmp_path)
+    with open(os.path.join(map_path, "diminfo_15min.txt"), "w") as f:
+        f.write(diminfo)
+    if lonlat is not None:
+        numpy.savetxt(os.path.join(map_path, "lonlat"), lonlat, fmt="%.3f")
+    cama_grid.GRIDS.pop(map_path, None)
+    return map_path
+
+
+def test_load_grid_reads_the_standard_diminfo(tmp_path):
+    grid = cama_grid.load_grid(write_map(tmp_path, STANDARD_DIMINFO))
+    assert (grid.NX, grid.NY, grid.NLFP) == (1440, 720, 10)
+    assert (grid.WEST, grid.EAST, grid.NORTH, grid.SOUTH) == (-180.0, 180.0, 90.0, -90.0)
+    assert grid.X_RESOLUTION == 4 and grid.Y_RESOLUTION == 4
+    assert grid.cell_of(89.9, -179.9) == 1
+    assert grid.cell_center(1440 * 720) == (-89.875, 179.875)
+
+
+def test_load_grid_derives_the_edges_from_lonlat(tmp_path):
+    lon, lat = numpy.meshgrid(-104.0 + 0.1 * numpy.arange(3), 34.9 - 0.1 * numpy.arange(2))
+    map_path = write_map(tmp_path, "3 !! nXX\n2 !! nYY\n10 !! floodplain layer\n",
+                         numpy.column_stack([lon.ravel(), lat.ravel()]))
+    grid = cama_grid.load_grid(map_path)
+    assert (grid.NX, grid.NY, grid.NLFP) == (3, 2, 10)
+    assert (grid.WEST, grid.EAST, grid.NORTH, grid.SOUTH) == (-104.05, -103.75, 34.95, 34.75)
+
+
+def brute_force_nearest(lon, lat, query_lat, query_lon):
+    points = cama_grid.unit_vectors(lat, lon)
+    return numpy.argmax(cama_grid.unit_vectors(query_lat, query_lon) @ points.T, axis=1)
+
+
+def test_nearest_matches_brute_force_on_a_global_irregular_grid():
+    rng = numpy.random.default_rng(7)
+    lon = rng.uniform(-180, 180, 5000)
+    lat = rng.uniform(-80, 80, 5000)
+    index = cama_grid.NearestCellIndex(lon, lat)
+    # half of the queries within 2 degrees of the antimeridian, on both sides
+    query_lon = numpy.concatenate([rng.uniform(-180, 180, 500), rng.uniform(178, 182, 500) - 360 * (rng.random(500) < 0.5)])
+    query_lat = rng.uniform(-85, 85, 1000)
+    expected = brute_force_nearest(lon, lat, query_lat, query_lon)
+    assert numpy.array_equal(index.nearest_many(query_lat, query_lon), expected)
+    assert [index.nearest(query_lat[k], query_lon[k]) for k in range(0, 1000, 50)] == list(expected[::50])
+
+
+def test_nearest_accepts_either_longitude_convention():
+    lon, lat = numpy.meshgrid(0.5 + numpy.arange(360), 0.5 - numpy.arange(3))
+    index = cama_grid.NearestCellIndex(lon.ravel(), lat.ravel())
+    assert index.nearest(0.0, -0.4) == 359 and index.nearest(0.0, 359.6) == 359
+    assert index.nearest(0.0, -179.6) == index.nearest(0.0, 180.4) == 180
+
+
+def test_cells_of_matches_cell_of():
+    grid = cama_grid.Grid(3600, 1800, 10, -180.0, 180.0, 90.0, -90.0)
+    lat = numpy.array([89.9, 0.05, -89.95, 12.34])
+    lon = numpy.array([-179.9, 0.05, 179.95, -56.78])
+    assert list(grid.cells_of(lat, lon)) == [grid.cell_of(lat[k], lon[k]) for k in range(4)]
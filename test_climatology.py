@@ -0,0 +1,41 @@
+import calendar
+
+import numpy
+import pytest
+
+import climatology
+
+
+def year_of(year, cells, value):
+    return numpy.full((366 if calendar.isleap(year) else 365) * cells, value, dtype=numpy.float32)
+
+
+def test_the_sketch_counts_up_to_255_years():
+    sketch = climatology.ClimatologySketch(2)
+    for year in range(1757, 2012):
+        sketch.add_year(year, year_of(year, 2, 40.0))
+    with pytest.raises(Exception, match="at most 255 years"):
+        sketch.add_year(2012, year_of(2012, 2, 40.0))
+    assert len(sketch.YEARS) == 255
+    # the one-byte histogram bins are full, not wrapped around
+    assert sketch.HISTOGRAM.max() == 255
+
+    statistics = sketch.statistics()
+    assert numpy.allclose(statistics[0, 0], 40.0)
+    # every percentile stays within the log bin of the value
+    step = 10 ** ((numpy.log10(climatology.HIGH) - numpy.log10(climatology.LOW)) / (climatology.BINS - 1))
+    assert numpy.all((statistics[1:, 0] >= 40.0 / step) & (statistics[1:, 0] <= 40.0 * step))
+
+
+def test_non_leap_years_skip_feb_29_and_fill_values_are_left_out():
+    sketch = climatology.ClimatologySketch(1)
+    values = year_of(1990, 1, 10.0)
+    values[59] = 30.0  # March 1st
+    values[100] = 1e20
+    sketch.add_year(1990, values)
+    sketch.add_year(1992, year_of(1992, 1, 20.0))
+
+    mean = sketch.statistics()[0, :, 0]
+    assert mean[59] == 20.0 and mean[60] == 25.0
+    # day 101 of the year (after Feb 29) only has the leap year's value
+    assert mean[101] == 20.0 and mean[0] == 15.0
@@ -0,0 +1,77 @@
+import os.path
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark"))
+
+import admission  # noqa: E402
+import job_queue  # noqa: E402
+from stand_ins import LocalMongoClient  # noqa: E402
+from test_admission import RecordingCama  # noqa: E402
+from test_storage import MemoryDbConnect  # noqa: E402
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    os.makedirs(os.path.join(str(tmp_path), "analysis"))
+    monkeypatch.setattr(admission, "ADMISSION_DIR", str(tmp_path))
+    monkeypatch.setattr(admission, "LANES", {"analysis": {"limit": 1, "queue": 0, "max_wait": 0, "jobs": 4}})
+    mongo_client = LocalMongoClient()
+    monkeypatch.setattr(job_queue, "DbConnect", lambda: MemoryDbConnect(mongo_client))
+    monkeypatch.setattr(job_queue, "CamaConvert", RecordingCama)
+    return job_queue.JobQueue(mongo_client)
+
+
+def wait_for(jobs, job_id, status):
+    for _ in range(100):
+        if jobs.job_status(job_id)["status"] == status:
+            return
+        time.sleep(0.05)
+    raise AssertionError(job_id + " not " + status)
+
+
+def test_submit_rejects_when_the_queue_is_full(jobs):
+    jobs.MAX_QUEUED = 1
+    slot = admission.admit("analysis")
+    job_id = jobs.submit({"request": "analysis"}, "analysis")
+    with pytest.raises(job_queue.JobQueueFull):
+        jobs.submit({"request": "analysis"}, "analysis")
+    admission.release(slot)
+    wait_for(jobs, job_id, "completed")
+    # the finished job freed its place, and the rejected one gave its lane ticket back
+    wait_for(jobs, jobs.submit({"request": "analysis"}, "analysis"), "completed")
+
+
+def test_recover_orphans_marks_the_jobs_of_dead_workers(jobs):
+    jobs.get_executor()
+    job_collection = jobs.MONGO_CLIENT["output"]["job"]
+    for job_id, status, worker in [("lost", "running", "dead_worker"), ("old", "queued", None),
+                                   ("alive", "queued", job_queue.WORKER_ID), ("done", "completed", "dead_worker")]:
+        job_collection.insert_one({"job_id": job_id, "status": status, "worker": worker})
+
+    assert jobs.recover_orphans() == 2
+    statuses = {job["job_id"]: job["status"] for job in job_collection.find()}
+    assert statuses == {"lost": "error", "old": "error", "alive": "queued", "done": "completed"}
+
+
+def test_job_status_recovers_a_polled_orphan(jobs):
+    jobs.MONGO_CLIENT["output"]["job"].insert_one({"job_id": "lost", "status": "running", "worker": "dead_worker"})
+    job = jobs.job_status("lost")
+    assert job["status"] == "error" and "worker" not in job
+
+
+def test_job_status_decodes_only_json_text(jobs):
+    job_collection = jobs.MONGO_CLIENT["output"]["job"]
+    for job_id, result in [("json", '{"a": 1}'), ("text", "not json"), ("dict", {"a": 1})]:
+        job_collection.insert_one({"job_id": job_id, "status": "completed", "result": result})
+    assert [jobs.job_status(job_id)["result"] for job_id in ["json", "text", "dict"]] == [{"a": 1}, "not json", {"a": 1}]
+
+
+def test_failed_jobs_record_the_traceback(jobs, monkeypatch):
+    monkeypatch.setattr(RecordingCama, "do_request", lambda self, request_json: 1 / 0)
+    job_id = jobs.submit({"request": "analysis"})
+    wait_for(jobs, job_id, "error")
+    job = jobs.MONGO_CLIENT["output"]["job"].find_one({"job_id": job_id})
+    assert job["error"] == "division by zero" and "ZeroDivisionError" in job["traceback"]
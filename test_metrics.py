@@ -0,0 +1,21 @@
+import json
+import os.path
+import time
+
+import metrics
+
+
+def test_throttled_samples_are_flushed_at_the_end_of_the_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    monkeypatch.setattr(metrics, "FLUSH_INTERVAL", 0.2)
+    monkeypatch.setattr(metrics, "LAST_FLUSH", [0.0])
+    monkeypatch.setattr(metrics, "PENDING_FLUSH", [None])
+    metrics.inc("cama_test_total")
+    # within the interval of the first flush, so only the deferred flush writes it
+    metrics.inc("cama_test_total")
+    file_path = os.path.join(str(tmp_path), str(os.getpid()) + ".json")
+    with open(file_path) as f:
+        assert json.load(f)["counters"]["cama_test_total"] == 1
+    time.sleep(0.4)
+    with open(file_path) as f:
+        assert json.load(f)["counters"]["cama_test_total"] == 2
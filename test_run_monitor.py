@@ -0,0 +1,10 @@
+from run_monitor import estimate_progress
+
+
+def test_estimate_progress_counts_the_clamped_years():
+    folder = {"status": "running", "metadata": {"start_year": 1900, "end_year": 2020},
+              "progress": {"nsp": 2, "years": [{"year": 1916, "isp": 1, "seconds": 10.0}]}}
+    summary = estimate_progress(folder)
+    # the run simulates 1916..2011, after two spin-up iterations of 1916
+    assert summary["years_total"] == 2 + 96
+    assert summary["eta_seconds"] == 97 * 10.0
@@ -0,0 +1,115 @@
+import os.path
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "benchmark"))
+
+import synthetic  # noqa: E402
+from dropbox_connect import DropBox  # noqa: E402
+from stand_ins import LocalMongoClient  # noqa: E402
+from storage import LocalStorage  # noqa: E402
+
+
+class MemoryDbConnect:
+    def __init__(self, mongo_client):
+        self.MONGO_CLIENT = mongo_client
+
+    def connect_db(self):
+        pass
+
+    def get_connection(self):
+        return self.MONGO_CLIENT
+
+    def disconnect_db(self):
+        pass
+
+
+def local_storage(tmp_path, archive_output):
+    storage = LocalStorage(str(tmp_path / "storage"))
+    storage.BASE_PATH = str(tmp_path / "cama")
+    storage.ARCHIVE_OUTPUT = archive_output
+    storage.DB = MemoryDbConnect(LocalMongoClient())
+    synthetic.write_static(storage.BASE_PATH)
+    synthetic.write_outflow(os.path.join(storage.BASE_PATH, "out", "hamid"), 1996, 0)
+    return storage
+
+
+def test_upload_archives_new_runs_when_configured(tmp_path):
+    storage = local_storage(tmp_path, True)
+    storage.DB.MONGO_CLIENT["output"]["folder"].insert_one({"folder_name": "run", "status": "running"})
+    storage.create_folder("run")
+    storage.upload_output()
+    folder = storage.DB.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": "run"})
+    assert folder["status"] == "completed" and folder["format"] == "archive"
+    assert os.listdir(os.path.join(storage.ROOT, "run")) == ["outflw1996.cca"]
+
+
+def test_upload_of_an_extension_keeps_the_folder_format(tmp_path):
+    storage = local_storage(tmp_path, True)
+    storage.DB.MONGO_CLIENT["output"]["folder"].insert_one({"folder_name": "run", "status": "running", "format": "bin",
+                                                            "resume_year": 1996})
+    storage.create_folder("run")
+    storage.upload_output()
+    folder = storage.DB.MONGO_CLIENT["output"]["folder"].find_one({"folder_name": "run"})
+    assert folder["status"] == "completed" and folder["format"] == "bin"
+    uploaded = numpy.fromfile(os.path.join(storage.ROOT, "run", "outflw1996.bin"), dtype=numpy.float32)
+    assert uploaded.size == 366 * synthetic.NX * synthetic.NY
+
+
+def cached_dropbox(tmp_path, max_bytes):
+    dropbox_obj = object.__new__(DropBox)
+    dropbox_obj.CACHE_DIR = str(tmp_path / "cache")
+    dropbox_obj.CACHE_MAX_BYTES = max_bytes
+    for age, folder_name in enumerate(["old", "older", "oldest"]):
+        os.makedirs(os.path.join(dropbox_obj.CACHE_DIR, folder_name))
+        file_path = os.path.join(dropbox_obj.CACHE_DIR, folder_name, "outflw1996.bin")
+        with open(file_path, "wb") as f:
+            f.write(b"x" * 100)
+        last_use = time.time() - 3600 * (age + 1)
+        os.utime(file_path, (last_use, last_use))
+    return dropbox_obj
+
+
+def test_evict_cache_removes_the_least_recently_used_files(tmp_path):
+    dropbox_obj = cached_dropbox(tmp_path, 150)
+    dropbox_obj.evict_cache()
+    kept = [folder_name for folder_name in ["old", "older", "oldest"]
+            if os.path.exists(os.path.join(dropbox_obj.CACHE_DIR, folder_name, "outflw1996.bin"))]
+    assert kept == ["old"]
+
+
+def test_evict_cache_keeps_the_files_in_use(tmp_path):
+    dropbox_obj = cached_dropbox(tmp_path, 0)
+    os.utime(os.path.join(dropbox_obj.CACHE_DIR, "oldest", "outflw1996.bin"))
+    dropbox_obj.evict_cache()
+    assert os.listdir(os.path.join(dropbox_obj.CACHE_DIR, "oldest")) == ["outflw1996.bin"]
+    assert os.listdir(os.path.join(dropbox_obj.CACHE_DIR, "old")) == []
+
+
+def test_purge_cache_drops_the_deleted_folder(tmp_path):
+    dropbox_obj = cached_dropbox(tmp_path, 1000)
+    dropbox_obj.purge_cache("older")
+    assert sorted(os.listdir(dropbox_obj.CACHE_DIR)) == ["old", "oldest"]
+
+
+def test_recover_without_a_running_folder_frees_the_run_slot(tmp_path):
+    storage = local_storage(tmp_path, False)
+    mongo_client = storage.DB.MONGO_CLIENT
+    mongo_client["output"]["lock"].insert_one({"_id": "cama_run", "holder": "crashed_run"})
+    storage.recover()
+    assert mongo_client["output"]["lock"].find_one({"_id": "cama_run"})["holder"] is None
+
+
+def test_recover_deletes_the_folder_of_a_new_run_only(tmp_path):
+    storage = local_storage(tmp_path, False)
+    folder_collection = storage.DB.MONGO_CLIENT["output"]["folder"]
+    folder_collection.insert_one({"folder_name": "new", "status": "running"})
+    folder_collection.insert_one({"folder_name": "extended", "status": "running", "resume_year": 1996})
+    storage.create_folder("new")
+    storage.create_folder("extended")
+    storage.recover("new")
+    storage.recover("extended")
+    assert not storage.folder_exists("new") and storage.folder_exists("extended")
+    assert [folder["status"] for folder in folder_collection.find()] == ["error", "error"]